@@ -0,0 +1,83 @@
+"""
+Synthetic LDAP entries, shaped like the results returned by ``LDAPSession.search()``.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import random
+
+BASE = 'ou=People,dc=example,dc=com'
+GROUPS_BASE = 'ou=Groups,dc=example,dc=com'
+
+OBJECT_CLASSES = [b'top', b'person', b'organizationalPerson', b'inetOrgPerson', b'posixAccount']
+
+# Attributes added to entries, in this order, depending on the requested attribute count.
+# Each factory returns the values of the attribute for the entry number i.
+ATTRIBUTES = [
+    ('uidNumber', lambda i, rnd, size: [str(10000 + i).encode()]),
+    ('gidNumber', lambda i, rnd, size: [str(10000 + i % 50).encode()]),
+    ('homeDirectory', lambda i, rnd, size: ['/home/user{}'.format(i).encode()]),
+    ('loginShell', lambda i, rnd, size: [rnd.choice([b'/bin/bash', b'/bin/sh', b'/bin/zsh'])]),
+    ('givenName', lambda i, rnd, size: ['Given{}'.format(i).encode()]),
+    ('mail', lambda i, rnd, size: ['user{}@example.com'.format(i).encode()]),
+    ('telephoneNumber', lambda i, rnd, size: ['+33 1 {:08d}'.format(i + n).encode() for n in range(size)]),
+    ('description', lambda i, rnd, size: ['Description {} of user {}'.format(n, i).encode() for n in range(size)]),
+    ('memberOf', lambda i, rnd, size: ['cn=group{},{}'.format(rnd.randrange(200), GROUPS_BASE).encode()
+                                       for _ in range(size)]),
+    ('departmentNumber', lambda i, rnd, size: ['{}'.format(i % 20).encode()]),
+    ('employeeType', lambda i, rnd, size: [rnd.choice([b'employee', b'contractor', b'intern'])]),
+    ('title', lambda i, rnd, size: [b'Engineer']),
+]
+
+
+def user_entry(i, attributes=8, multi_valued=3, binary_size=0, rnd=None):
+    """
+    Build the (dn, attributes) tuple of a synthetic user.
+
+    :param i: Entry number, used to build unique values
+    :param attributes: Number of optional attributes to add, at most len(ATTRIBUTES)
+    :param multi_valued: Number of values of multi-valued attributes
+    :param binary_size: Size of a jpegPhoto value, or 0 to skip it
+    :param rnd: a random.Random instance
+    """
+    rnd = rnd or random.Random(i)
+    uid = 'user{}'.format(i)
+    entry = {
+        'objectClass': list(OBJECT_CLASSES),
+        'uid': [uid.encode()],
+        'cn': ['User {}'.format(i).encode()],
+        'sn': ['{}'.format(i).encode()],
+    }
+    for name, factory in ATTRIBUTES[:attributes]:
+        entry[name] = factory(i, rnd, multi_valued)
+    if binary_size:
+        entry['jpegPhoto'] = [bytes(rnd.getrandbits(8) for _ in range(binary_size))]
+    return 'uid={},{}'.format(uid, BASE), entry
+
+
+def user_entries(count, attributes=8, multi_valued=3, binary_size=0, seed=0):
+    """
+    Return a list of count synthetic users. Results are reproducible for a given seed.
+    """
+    rnd = random.Random(seed)
+    photo = bytes(rnd.getrandbits(8) for _ in range(binary_size)) if binary_size else None
+    entries = []
+    for i in range(count):
+        dn, entry = user_entry(i, attributes, multi_valued, 0, rnd)
+        if photo is not None:
+            entry['jpegPhoto'] = [photo]
+        entries.append((dn, entry))
+    return entries
+
+
+def base_entries():
+    """
+    Containers required to load users in a MemoryDirectory.
+    """
+    return [
+        ('dc=example,dc=com', {'objectClass': [b'top', b'domain'], 'dc': [b'example']}),
+        (BASE, {'objectClass': [b'top', b'organizationalUnit'], 'ou': [b'People']}),
+        (GROUPS_BASE, {'objectClass': [b'top', b'organizationalUnit'], 'ou': [b'Groups']}),
+    ]
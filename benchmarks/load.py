@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Load generation: concurrent clients send a mix of operations through a pool of LDAPSession, against an in memory
+directory with injected latency and jitter, like web requests would do against a real server.
+
+A scenario is a JSON file, where every key is optional:
+
+.. code-block:: json
+
+    {
+        "users": 1000,
+        "latency": 0.002,
+        "jitter": 0.003,
+        "mode": "threads",
+        "clients": 100,
+        "processes": 4,
+        "pool_size": 8,
+        "duration": 10,
+        "mix": {"by_attr": 60, "by_dn_membership": 20, "save": 15, "change_password": 5},
+        "thresholds": {"min_throughput": 500, "max_p99": 0.25, "max_error_rate": 0.001}
+    }
+
+* ``mode`` is ``threads`` (one thread per client), ``asyncio`` (one task per client, operations run in the default
+  executor, like blocking calls of an asyncio application) or ``processes`` (clients spread on ``processes``
+  processes, each with its own directory and pool)
+* ``pool_size`` is the number of sessions shared by the clients of a process. The time spent waiting for a
+  session is reported as pool wait time, and is included in the operation latency.
+* ``mix`` gives the relative weight of each operation: ``by_attr``, ``by_dn``, ``by_dn_membership``, ``save`` and
+  ``change_password``
+
+The run reports throughput, latency percentiles (overall and per operation), pool wait time percentiles and error
+rates. Thresholds, and ``--compare`` with a previous run, make it usable as a regression gate: the exit status is 1
+when a threshold is not met.
+
+.. code-block:: shell
+
+    python -m benchmarks.load benchmarks/scenarios/web.json --output before.json
+    python -m benchmarks.load benchmarks/scenarios/web.json --compare before.json
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import multiprocessing
+import queue
+import random
+import sys
+import threading
+import time
+
+import ldap
+
+import pyldap_orm
+import pyldap_orm.models
+from pyldap_orm.exceptions import LDAPORMException
+from pyldap_orm.memory import MemoryDirectory
+
+from benchmarks.generators import BASE, GROUPS_BASE, base_entries, user_entries
+
+DEFAULTS = {
+    'users': 1000,
+    'latency': 0.001,
+    'jitter': 0.0,
+    'mode': 'threads',
+    'clients': 50,
+    'processes': 2,
+    'pool_size': 8,
+    'duration': 5.0,
+    'seed': 0,
+    'mix': {'by_attr': 1},
+    'thresholds': {},
+}
+
+MODES = ('threads', 'asyncio', 'processes')
+
+# Number of groups referenced by the memberOf values of generated users
+GROUPS = 200
+
+
+class User(pyldap_orm.models.LDAPModelUser):
+    base = BASE
+
+
+class Users(pyldap_orm.models.LDAPModelUsers):
+    children = User
+
+
+def random_user(session, rnd, users):
+    return User(session).by_attr('uid', 'user{}'.format(rnd.randrange(users)))
+
+
+def operation_save(session, rnd, users):
+    user = random_user(session, rnd, users)
+    user.description = ['Updated at {}'.format(time.time())]
+    user.save()
+
+
+def operation_change_password(session, rnd, users):
+    random_user(session, rnd, users).change_password('secret{}'.format(rnd.randrange(1000000)))
+
+
+OPERATIONS = {
+    'by_attr': random_user,
+    'by_dn': lambda session, rnd, users: User(session).by_dn('uid=user{},{}'.format(rnd.randrange(users), BASE)),
+    'by_dn_membership': lambda session, rnd, users: Users(session).by_dn_membership(
+        'cn=group{},{}'.format(rnd.randrange(GROUPS), GROUPS_BASE)),
+    'save': operation_save,
+    'change_password': operation_change_password,
+}
+
+
+def load_scenario(path):
+    """
+    Read a scenario file, and fill missing keys with defaults.
+    """
+    scenario = dict(DEFAULTS)
+    if path is not None:
+        with open(path) as fh:
+            scenario.update(json.load(fh))
+    unknown = set(scenario['mix']) - set(OPERATIONS)
+    if unknown:
+        raise ValueError("Unknown operations in mix: {}".format(', '.join(sorted(unknown))))
+    if scenario['mode'] not in MODES:
+        raise ValueError("Unknown mode: {}".format(scenario['mode']))
+    return scenario
+
+
+def build_directory(scenario):
+    directory = MemoryDirectory(latency=scenario['latency'], jitter=scenario['jitter'])
+    for dn, attributes in base_entries() + user_entries(scenario['users'], attributes=10, multi_valued=2):
+        directory.add_entry(dn, attributes)
+    return directory
+
+
+class SessionPool(object):
+    """
+    A fixed set of authenticated sessions, lent to one client at a time.
+    """
+
+    def __init__(self, directory, size):
+        self._sessions = queue.Queue()
+        for _ in range(size):
+            session = pyldap_orm.LDAPSession(backend=directory)
+            session.authenticate()
+            self._sessions.put(session)
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        :return: a context manager giving a tuple (session, time waited for it in seconds)
+        """
+        start = time.perf_counter()
+        session = self._sessions.get()
+        try:
+            yield session, time.perf_counter() - start
+        finally:
+            self._sessions.put(session)
+
+
+class Recorder(object):
+    """
+    Collect latencies, pool wait times and errors of operations.
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.waits = []
+        self.errors = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, latency, wait, error):
+        with self._lock:
+            self.latencies[name].append(latency)
+            self.waits.append(wait)
+            if error is not None:
+                self.errors[name] += 1
+
+    def merge(self, data):
+        latencies, waits, errors = data
+        for name, values in latencies.items():
+            self.latencies[name].extend(values)
+        self.waits.extend(waits)
+        self.errors.update(errors)
+
+    def data(self):
+        return dict(self.latencies), self.waits, dict(self.errors)
+
+
+def run_operation(pool, name, rnd, users, recorder):
+    start = time.perf_counter()
+    error = None
+    with pool.session() as (session, wait):
+        try:
+            OPERATIONS[name](session, rnd, users)
+        except (ldap.LDAPError, LDAPORMException) as e:
+            error = e
+    recorder.record(name, time.perf_counter() - start, wait, error)
+
+
+def choose(rnd, mix):
+    names = sorted(mix)
+    weights = [mix[name] for name in names]
+    return lambda: rnd.choices(names, weights)[0]
+
+
+def run_threads(scenario, clients, seed):
+    """
+    Run clients in threads, against a new directory.
+
+    :return: the recorded data
+    """
+    pool = SessionPool(build_directory(scenario), scenario['pool_size'])
+    recorder = Recorder()
+    deadline = time.perf_counter() + scenario['duration']
+
+    def client(number):
+        rnd = random.Random(seed * 100003 + number)
+        operation = choose(rnd, scenario['mix'])
+        while time.perf_counter() < deadline:
+            run_operation(pool, operation(), rnd, scenario['users'], recorder)
+
+    threads = [threading.Thread(target=client, args=(number,), daemon=True) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.data()
+
+
+def run_asyncio(scenario, clients, seed):
+    """
+    Run clients as asyncio tasks. Operations are blocking, so they run in the default executor.
+
+    :return: the recorded data
+    """
+    pool = SessionPool(build_directory(scenario), scenario['pool_size'])
+    recorder = Recorder()
+
+    async def client(number, deadline):
+        loop = asyncio.get_running_loop()
+        rnd = random.Random(seed * 100003 + number)
+        operation = choose(rnd, scenario['mix'])
+        while time.perf_counter() < deadline:
+            await loop.run_in_executor(None, run_operation, pool, operation(), rnd, scenario['users'], recorder)
+
+    async def main():
+        deadline = time.perf_counter() + scenario['duration']
+        await asyncio.gather(*(client(number, deadline) for number in range(clients)))
+
+    asyncio.run(main())
+    return recorder.data()
+
+
+def run_process(arguments):
+    scenario, clients, seed = arguments
+    return run_threads(scenario, clients, seed)
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    ordered = sorted(values)
+
+    def rank(fraction):
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+    return {'p50': rank(0.5), 'p90': rank(0.9), 'p99': rank(0.99), 'max': ordered[-1]}
+
+
+def run(scenario):
+    """
+    Run a scenario.
+
+    :return: a dictionary with the results
+    """
+    recorder = Recorder()
+    start = time.perf_counter()
+    if scenario['mode'] == 'threads':
+        recorder.merge(run_threads(scenario, scenario['clients'], scenario['seed']))
+    elif scenario['mode'] == 'asyncio':
+        recorder.merge(run_asyncio(scenario, scenario['clients'], scenario['seed']))
+    else:
+        processes = scenario['processes']
+        arguments = [(scenario, scenario['clients'] // processes + (number < scenario['clients'] % processes),
+                      scenario['seed'] + number) for number in range(processes)]
+        with multiprocessing.Pool(processes) as workers:
+            for data in workers.map(run_process, arguments):
+                recorder.merge(data)
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [latency for values in recorder.latencies.values() for latency in values]
+    errors = sum(recorder.errors.values())
+    operations = dict()
+    for name, values in sorted(recorder.latencies.items()):
+        operations[name] = dict(percentiles(values), count=len(values), errors=recorder.errors.get(name, 0))
+    return {
+        'scenario': {key: value for key, value in scenario.items() if key != 'thresholds'},
+        'seconds': elapsed,
+        'operations': len(all_latencies),
+        'throughput': len(all_latencies) / elapsed if elapsed else None,
+        'errors': errors,
+        'error_rate': errors / len(all_latencies) if all_latencies else 0.0,
+        'latency': percentiles(all_latencies),
+        'pool_wait': percentiles(recorder.waits),
+        'by_operation': operations,
+    }
+
+
+def check(results, thresholds):
+    """
+    :return: the list of thresholds not met
+    """
+    failures = []
+    if 'min_throughput' in thresholds and (results['throughput'] or 0) < thresholds['min_throughput']:
+        failures.append('min_throughput')
+    if 'max_error_rate' in thresholds and results['error_rate'] > thresholds['max_error_rate']:
+        failures.append('max_error_rate')
+    for name, section in (('max_p99', 'latency'), ('max_pool_wait_p99', 'pool_wait')):
+        if name in thresholds and (results[section]['p99'] or 0) > thresholds[name]:
+            failures.append(name)
+    return failures
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: the list of metrics worse than baseline by more than threshold
+    """
+    regressions = []
+    if baseline.get('throughput') and results['throughput'] < baseline['throughput'] * (1 - threshold):
+        regressions.append('throughput')
+    if baseline['latency'].get('p99') and results['latency']['p99'] > baseline['latency']['p99'] * (1 + threshold):
+        regressions.append('p99')
+    return regressions
+
+
+def report(results):
+    print("{} operations in {:.1f}s: {:.0f} ops/s, {} errors ({:.2%})".format(
+        results['operations'], results['seconds'], results['throughput'] or 0, results['errors'],
+        results['error_rate']))
+    print("{:<18} {:>8} {:>7} {:>9} {:>9} {:>9}".format('operation', 'count', 'errors', 'p50 ms', 'p99 ms', 'max ms'))
+    rows = list(results['by_operation'].items()) + [('all', dict(results['latency'], count=results['operations'],
+                                                                 errors=results['errors'])),
+                                                    ('pool wait', dict(results['pool_wait'], count='', errors=''))]
+    for name, values in rows:
+        print("{:<18} {:>8} {:>7} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            name, values['count'], values['errors'], (values['p50'] or 0) * 1000, (values['p99'] or 0) * 1000,
+            (values['max'] or 0) * 1000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenario', nargs='?', help='Scenario file, default is a short by_attr load')
+    parser.add_argument('--mode', choices=MODES, help='Override the scenario mode')
+    parser.add_argument('--clients', type=int, help='Override the scenario number of clients')
+    parser.add_argument('--duration', type=float, help='Override the scenario duration, in seconds')
+    parser.add_argument('--output', help='Store results in this JSON file')
+    parser.add_argument('--compare', help='Compare results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='With --compare, exit with an error if throughput or p99 latency are worse by more '
+                             'than this ratio')
+    args = parser.parse_args(argv)
+
+    scenario = load_scenario(args.scenario)
+    for key in ('mode', 'clients', 'duration'):
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+
+    results = run(scenario)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    failures = check(results, scenario['thresholds'])
+    if args.compare:
+        with open(args.compare) as fh:
+            failures += compare(results, json.load(fh), args.threshold)
+    if failures:
+        print("Failed: {}".format(', '.join(failures)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
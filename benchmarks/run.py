@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of pyldap_orm hot paths, run against canned search results and an in memory directory,
+so results don't depend on a LDAP server nor the network.
+
+Scenarios:
+
+* ``parse``: ``LDAPObject.parse()`` on each entry
+* ``list``: ``LDAPModelList._parse_multiple()`` on the whole result set
+* ``list_workers``: same, with entries decoded by a process pool
+* ``save``: ``save()`` of modified objects (modlist construction and modify operation)
+* ``filter``: subtree search with a compound filter, evaluated on every entry
+* ``schema``: ``LDAPSession.parse_schema()``
+* ``spill``: spill of the result set to a disk-backed ``SpilledResults``, then access to every object
+
+Each scenario reports its throughput (operations per second) and its peak memory, measured with tracemalloc
+during a second run. Results can be stored as JSON, and compared with a previous run:
+
+.. code-block:: shell
+
+    python -m benchmarks.run --size 100k --output before.json
+    python -m benchmarks.run --size 100k --output after.json --compare before.json
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pyldap_orm
+from pyldap_orm.memory import MemoryDirectory
+from pyldap_orm.spill import SpilledResults
+
+from benchmarks.generators import BASE, base_entries, user_entries
+
+SIZES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1M': 1000000,
+}
+
+SCHEMA_PARSES = 20
+
+
+class User(pyldap_orm.LDAPObject):
+    base = BASE
+    required_objectclasses = ['inetOrgPerson']
+
+
+class Users(pyldap_orm.LDAPModelList):
+    children = User
+
+
+def memory_session(entries=()):
+    """
+    Create a session on a MemoryDirectory holding entries.
+    """
+    directory = MemoryDirectory()
+    for dn, attributes in base_entries() + list(entries):
+        directory.add_entry(dn, attributes)
+    session = pyldap_orm.LDAPSession(backend=directory)
+    session.authenticate()
+    return session
+
+
+def scenario_parse(entries):
+    session = memory_session()
+
+    def run():
+        for entry in entries:
+            User(session).parse(entry)
+    return run, len(entries)
+
+
+def scenario_list(entries):
+    session = memory_session()
+
+    def run():
+        Users(session)._parse_multiple(entries)
+    return run, len(entries)
+
+
+def scenario_list_workers(entries):
+    session = memory_session()
+
+    def run():
+        Users(session, workers=os.cpu_count(), chunk_size=max(1000, len(entries) // (4 * os.cpu_count())))\
+            ._parse_multiple(entries)
+    return run, len(entries)
+
+
+def scenario_save(entries):
+    session = memory_session(entries)
+    objects = Users(session)._parse_multiple(entries)
+
+    def run():
+        for number, current in enumerate(objects):
+            current.description = ['Updated {}'.format(number)]
+            current.save()
+    return run, len(objects)
+
+
+def scenario_filter(entries):
+    session = memory_session(entries)
+
+    def run():
+        session.search(BASE, ldap_filter='(&(objectClass=inetOrgPerson)(|(employeeType=contractor)'
+                                         '(uidNumber>=10500))(!(loginShell=/bin/sh))(mail=*@example.com))',
+                       attributes=['uid'])
+    return run, len(entries)
+
+
+def scenario_schema(entries):
+    session = memory_session()
+
+    def run():
+        for _ in range(SCHEMA_PARSES):
+            session.parse_schema()
+    return run, SCHEMA_PARSES
+
+
+def scenario_spill(entries):
+    session = memory_session()
+
+    def run():
+        with SpilledResults(session, User, entries) as results:
+            for index in range(len(results)):
+                results[index]
+    return run, len(entries)
+
+
+SCENARIOS = {
+    'parse': scenario_parse,
+    'list': scenario_list,
+    'list_workers': scenario_list_workers,
+    'save': scenario_save,
+    'filter': scenario_filter,
+    'schema': scenario_schema,
+    'spill': scenario_spill,
+}
+
+
+def measure(scenario, entries):
+    """
+    Run a scenario twice: once to measure its duration, then once with tracemalloc to measure its peak memory.
+    Preparation of the scenario (like loading the directory) is not measured.
+
+    :return: a dictionary with the results
+    """
+    run, operations = scenario(entries)
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+
+    run, _ = scenario(entries)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'operations': operations,
+        'seconds': seconds,
+        'ops_per_second': operations / seconds if seconds else None,
+        'peak_memory': peak,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print throughput ratios against a previous run.
+
+    :return: the list of scenarios slower than baseline by more than threshold
+    """
+    regressions = []
+    for name, result in sorted(results['results'].items()):
+        previous = baseline['results'].get(name)
+        if not previous or not previous['ops_per_second'] or not result['ops_per_second']:
+            continue
+        ratio = result['ops_per_second'] / previous['ops_per_second']
+        print("{:<14} {:>8.2f}x throughput, {:>8.2f}x peak memory".format(
+            name, ratio, result['peak_memory'] / max(previous['peak_memory'], 1)))
+        if ratio < 1 - threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', choices=sorted(SIZES), default='1k', help='Number of entries')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run, can be repeated. Default is all scenarios')
+    parser.add_argument('--attributes', type=int, default=8, help='Number of optional attributes per entry')
+    parser.add_argument('--multi-valued', type=int, default=3, help='Number of values of multi-valued attributes')
+    parser.add_argument('--binary-size', type=int, default=0, help='Size of a binary jpegPhoto value per entry')
+    parser.add_argument('--output', help='Store results in this JSON file')
+    parser.add_argument('--compare', help='Compare results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='With --compare, exit with an error if a throughput dropped by more than this ratio')
+    args = parser.parse_args(argv)
+
+    entries = user_entries(SIZES[args.size], args.attributes, args.multi_valued, args.binary_size)
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'size': len(entries),
+        'attributes': args.attributes,
+        'multi_valued': args.multi_valued,
+        'binary_size': args.binary_size,
+        'results': {},
+    }
+    for name in args.scenario or sorted(SCENARIOS):
+        result = measure(SCENARIOS[name], entries)
+        results['results'][name] = result
+        print("{:<14} {:>12.0f} ops/s {:>10.1f} MiB peak".format(name, result['ops_per_second'] or 0,
+                                                                  result['peak_memory'] / 1024 / 1024))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = compare(results, json.load(fh), args.threshold)
+        if regressions:
+            print("Regressions: {}".format(', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
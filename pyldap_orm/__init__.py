@@ -1,7 +1,36 @@
-from pyldap_orm.core import \
-    LDAPObject, \
-    LDAPModelList, \
-    LDAPModelQueryException, \
-    LDAPORMException
+"""
+Public classes of pyldap_orm are imported on first access, so importing the package doesn't load python-ldap
+until a session or a model is actually used.
+"""
 
-from pyldap_orm.session import LDAPSession
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    'DN': 'pyldap_orm.dn',
+    'LDAPObject': 'pyldap_orm.core',
+    'LDAPModelList': 'pyldap_orm.core',
+    'LDAPModelQueryException': 'pyldap_orm.exceptions',
+    'LDAPORMException': 'pyldap_orm.exceptions',
+    'LDAPSession': 'pyldap_orm.session',
+}
+
+_SUBMODULES = ('auth', 'ber', 'codec', 'controls', 'core', 'deadline', 'dn', 'events', 'exceptions', 'export',
+               'memory', 'models', 'reconcile', 'replicas', 'scheduler', 'schema', 'session', 'spill')
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('{}.{}'.format(__name__, name))
+    try:
+        module = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name)) from None
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
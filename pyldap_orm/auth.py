@@ -0,0 +1,309 @@
+"""
+Verification of user passwords, by binding as the user on connections reserved for this purpose.
+
+``LDAPSession.authenticate()`` binds the connection used by the session and loads the schema, which is too slow
+to check the password of each user logging in. A BindVerifier keeps a pool of connections only used for binds:
+
+>>> verifier = BindVerifier(session, size=16, model=LDAPUser)
+>>> verifier.verify('jdoe', 'secret')
+True
+>>> verifier.verify_many([('jdoe', 'secret'), ('fmulder', 'invalid')])
+[True, False]
+
+Connections are opened with the session transport settings (STARTTLS, certificates), on replicas if the session
+has some, otherwise on primaries.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import collections
+import logging
+import threading
+import time
+
+import ldap
+import ldap.filter
+
+from pyldap_orm import deadline
+from pyldap_orm.replicas import FAILOVER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class _Slot(object):
+    """
+    A connection of the pool, with the message id of the bind sent to restore the service identity, if any.
+    """
+    __slots__ = ('connection', 'backend', 'rebind')
+
+    def __init__(self, connection, backend):
+        self.connection = connection
+        self.backend = backend
+        self.rebind = None
+
+
+class BindVerifier(object):
+    """
+    Check credentials with asynchronous simple binds, on a pool of at most ``size`` connections. The schema is
+    never loaded.
+
+    Once a user bind completed, the connection is bound again with the session credentials (the bind is sent
+    asynchronously, and its result read when the connection is used again), or closed when rebind is False.
+
+    When model is given, users are identified by the value of attribute, like their uid, instead of their DN.
+    DNs are searched with the session, and cached for ``cache_ttl`` seconds.
+
+    An empty password is never sent, since the server would accept it as an unauthenticated bind.
+
+    :param session: an authenticated LDAPSession
+    :param size: Maximum number of connections
+    :param model: An optional LDAPObject class, used to find the DN of users
+    :param attribute: Attribute identifying users of model
+    :param cache_size: Maximum number of DNs kept in cache, 0 to disable the cache
+    :param cache_ttl: Lifetime of cached DNs, in seconds
+    :param rebind: Bind connections again with the session identity, instead of closing them
+    :param poll_interval: Interval between polls of connections when several binds are pending, in seconds
+    """
+
+    def __init__(self, session, size=8, model=None, attribute='uid', cache_size=10000, cache_ttl=300.0,
+                 rebind=True, poll_interval=0.001):
+        self.size = size
+        self.model = model
+        self.attribute = attribute
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.rebind = rebind
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        self._session = session
+        self._backends = [node.backend for node in session.replicas or session.primaries]
+        self._next_backend = 0
+        self._idle = collections.deque()
+        self._opened = 0
+        self._condition = threading.Condition()
+        self._dns = collections.OrderedDict()
+
+    def close(self):
+        """
+        Close the idle connections of the pool.
+        """
+        with self._condition:
+            idle = list(self._idle)
+            self._idle.clear()
+        for slot in idle:
+            self._discard(slot)
+
+    def resolve(self, name):
+        """
+        Find the DN of a user.
+
+        :param name: the value of attribute identifying the user, or a DN if the verifier has no model
+        :return: a DN, or None if there is no such user
+        """
+        if self.model is None:
+            return name
+        now = time.monotonic()
+        with self._condition:
+            cached = self._dns.get(name)
+            if cached is not None and cached[1] > now:
+                self._dns.move_to_end(name)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        entries = self._session.search(base=self.model.base,
+                                       ldap_filter='(&{}({}={}))'.format(
+                                           self.model.filter(), self.attribute, ldap.filter.escape_filter_chars(name)),
+                                       attributes=['1.1'],
+                                       model=self.model)
+        # Search references are returned with a None DN
+        dns = [dn for dn, _ in entries if dn is not None]
+        if len(dns) != 1:
+            logger.debug("Can't resolve %s=%s: %d entries found", self.attribute, name, len(dns))
+            return None
+
+        if self.cache_size:
+            with self._condition:
+                self._dns[name] = (dns[0], now + self.cache_ttl)
+                self._dns.move_to_end(name)
+                while len(self._dns) > self.cache_size:
+                    self._dns.popitem(last=False)
+        return dns[0]
+
+    def forget(self, name=None):
+        """
+        Remove a DN from the cache, or clear the cache if name is None.
+        """
+        with self._condition:
+            if name is None:
+                self._dns.clear()
+            else:
+                self._dns.pop(name, None)
+
+    def _acquire(self, block=True):
+        """
+        :return: an idle connection, a new one if the pool is not full, or None if block is False and no
+                 connection is available
+        """
+        with self._condition:
+            while not self._idle and self._opened >= self.size:
+                if not block:
+                    return None
+                self._condition.wait()
+            if self._idle:
+                slot = self._idle.popleft()
+            else:
+                self._opened += 1
+                slot = None
+                backend = self._backends[self._next_backend % len(self._backends)]
+                self._next_backend += 1
+
+        if slot is None:
+            try:
+                return _Slot(self._session.connect(backend), backend)
+            except ldap.LDAPError:
+                self._closed()
+                raise
+
+        if slot.rebind is not None:
+            try:
+                deadline.wait(slot.connection, slot.rebind, deadline.remaining())
+            except ldap.TIMEOUT:
+                # The rebind was abandoned, the connection identity is unknown
+                self._discard(slot)
+                raise
+            except ldap.LDAPError as e:
+                logger.warning("Rebind to %s failed, closing the connection: %s", slot.backend, e)
+                self._discard(slot)
+                return self._acquire(block)
+            slot.rebind = None
+        return slot
+
+    def _release(self, slot):
+        credentials = self._session.credentials
+        if not self.rebind or (credentials is not None and credentials[2] != self._session.AUTH_SIMPLE_BIND):
+            self._discard(slot)
+            return
+        bind_dn, credential, _ = credentials or (None, None, None)
+        try:
+            if bind_dn is not None and credential is not None:
+                slot.rebind = slot.connection.simple_bind(bind_dn, credential)
+            else:
+                slot.rebind = slot.connection.simple_bind()
+        except ldap.LDAPError:
+            self._discard(slot)
+            return
+        with self._condition:
+            self._idle.append(slot)
+            self._condition.notify()
+
+    def _discard(self, slot):
+        try:
+            slot.connection.unbind_ext()
+        except ldap.LDAPError:
+            pass
+        self._closed()
+
+    def _closed(self):
+        with self._condition:
+            self._opened -= 1
+            self._condition.notify()
+
+    def verify(self, name, password):
+        """
+        :param name: DN of the user, or the value of attribute if the verifier has a model
+        :param password: the password to check
+        :return: True if the server accepted the bind
+        """
+        return self.verify_many([(name, password)])[0]
+
+    def verify_many(self, credentials):
+        """
+        Check many credentials at once. Binds are sent asynchronously on up to ``size`` connections; a connection
+        only has one bind in progress at a time.
+
+        A bind refused by the server, for any reason, is a failed verification. A bind sent to a server which can't
+        be reached is sent again on a new connection, to the next server.
+
+        :param credentials: an iterable of tuples (name, password)
+        :return: a list of booleans, in the same order than credentials
+        :raise: the error of the last server if no server can answer
+        """
+        queue = collections.deque((position, name, password, 0, None)
+                                  for position, (name, password) in enumerate(credentials))
+        results = [False] * len(queue)
+        pending = []
+
+        try:
+            while queue or pending:
+                while queue:
+                    position, name, password, attempts, dn = queue[0]
+                    if dn is None:
+                        dn = self.resolve(name) if password else None
+                        if dn is None:
+                            queue.popleft()
+                            continue
+                        queue[0] = (position, name, password, attempts, dn)
+                    slot = self._acquire(block=not pending)
+                    if slot is None:
+                        break
+                    queue.popleft()
+                    event = self._session.event('bind', dn, model=self.model, timestamp=time.time())
+                    try:
+                        msgid = slot.connection.simple_bind(dn, password)
+                    except FAILOVER_ERRORS:
+                        self._discard(slot)
+                        if attempts + 1 >= len(self._backends):
+                            raise
+                        queue.appendleft((position, name, password, attempts + 1, dn))
+                        continue
+                    except ldap.LDAPError:
+                        self._release(slot)
+                        continue
+                    pending.append((slot, msgid, event, time.perf_counter(), position, name, password, attempts,
+                                    dn))
+
+                left = deadline.remaining()
+                if len(pending) > 1 or queue:
+                    timeout = self.poll_interval if left is None else min(self.poll_interval, left)
+                else:
+                    timeout = -1 if left is None else left
+                for item in list(pending):
+                    slot, msgid, event, start, position, name, password, attempts, dn = item
+                    error = None
+                    try:
+                        result = slot.connection.result3(msgid, all=1, timeout=timeout)
+                    except ldap.TIMEOUT:
+                        continue
+                    except FAILOVER_ERRORS:
+                        pending.remove(item)
+                        self._discard(slot)
+                        if attempts + 1 >= len(self._backends):
+                            raise
+                        queue.append((position, name, password, attempts + 1, dn))
+                        continue
+                    except ldap.LDAPError as e:
+                        result = None
+                        error = e
+                    if result is not None and result[0] is None:
+                        continue
+                    pending.remove(item)
+                    results[position] = error is None
+                    if event is not None:
+                        event.duration = time.perf_counter() - start
+                        event.error = error
+                        self._session.notify(event)
+                    self._release(slot)
+        except ldap.TIMEOUT:
+            # Binds not answered yet are abandoned
+            for slot, msgid in [item[:2] for item in pending]:
+                deadline.abandon(slot.connection, msgid)
+            raise
+        finally:
+            for slot in [item[0] for item in pending]:
+                # The connection identity is unknown
+                self._discard(slot)
+        return results
@@ -0,0 +1,318 @@
+"""
+A small BER encoder and decoder for the fixed ASN.1 structures used by pyldap_orm controls and extended operations.
+
+Only definite lengths and the universal types needed by these structures (BOOLEAN, INTEGER, ENUMERATED,
+OCTET STRING and SEQUENCE) are supported. Encoded values use DER rules: minimal lengths, BOOLEAN TRUE encoded
+as 0xFF, and components equal to their DEFAULT value are omitted.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+from functools import lru_cache
+
+from pyldap_orm.exceptions import LDAPORMException
+
+BOOLEAN = 0x01
+INTEGER = 0x02
+OCTET_STRING = 0x04
+ENUMERATED = 0x0a
+SEQUENCE = 0x30
+
+# Context specific tags, primitive and constructed
+CONTEXT = 0x80
+CONTEXT_CONSTRUCTED = 0xa0
+
+
+class BERDecodeError(LDAPORMException):
+    pass
+
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes((length,))
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(encoded),)) + encoded
+
+
+def encode_tlv(tag, content):
+    return bytes((tag,)) + encode_length(len(content)) + content
+
+
+def encode_octet_string(value, tag=OCTET_STRING):
+    if isinstance(value, str):
+        value = value.encode('UTF-8')
+    return encode_tlv(tag, value)
+
+
+def encode_integer(value, tag=INTEGER):
+    length = (value + (value < 0)).bit_length() // 8 + 1
+    return encode_tlv(tag, value.to_bytes(length, 'big', signed=True))
+
+
+def encode_boolean(value, tag=BOOLEAN):
+    return encode_tlv(tag, b'\xff' if value else b'\x00')
+
+
+def encode_sequence(*components, tag=SEQUENCE):
+    return encode_tlv(tag, b''.join(components))
+
+
+def decode_tlv(data, offset=0):
+    """
+    Decode the TLV starting at offset.
+
+    :param data: BER encoded bytes
+    :param offset: Position of the tag
+    :return: a tuple (tag, content, next_offset)
+    """
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            size = length & 0x7f
+            if size == 0:
+                raise BERDecodeError("Indefinite lengths are not supported")
+            length = int.from_bytes(data[offset:offset + size], 'big')
+            offset += size
+    except IndexError:
+        raise BERDecodeError("Truncated BER value") from None
+    end = offset + length
+    if end > len(data):
+        raise BERDecodeError("Truncated BER value")
+    return tag, bytes(data[offset:end]), end
+
+
+def decode_components(content):
+    """
+    Decode the components of a constructed value.
+
+    :param content: content of a SEQUENCE
+    :return: a list of tuples (tag, content)
+    """
+    components = []
+    offset = 0
+    while offset < len(content):
+        tag, value, offset = decode_tlv(content, offset)
+        components.append((tag, value))
+    return components
+
+
+def decode_sequence(data, tag=SEQUENCE):
+    found, content, _ = decode_tlv(data)
+    if found != tag:
+        raise BERDecodeError("Expected tag 0x{:02x}, found 0x{:02x}".format(tag, found))
+    return decode_components(content)
+
+
+def decode_integer(content):
+    return int.from_bytes(content, 'big', signed=True)
+
+
+@lru_cache(maxsize=256)
+def encode_sort_key_list(keys):
+    """
+    Encode a RFC 2891 SortKeyList:
+
+          SortKeyList ::= SEQUENCE OF SEQUENCE {
+             attributeType   AttributeDescription,
+             orderingRule    [0] MatchingRuleId OPTIONAL,
+             reverseOrder    [1] BOOLEAN DEFAULT FALSE }
+
+    :param keys: a tuple of (attributeType, orderingRule or None, reverseOrder) tuples
+    :return: BER encoded value
+    """
+    encoded = []
+    for attribute_type, ordering_rule, reverse_order in keys:
+        components = [encode_octet_string(attribute_type)]
+        if ordering_rule is not None:
+            components.append(encode_octet_string(ordering_rule, tag=CONTEXT | 0))
+        if reverse_order:
+            components.append(encode_boolean(True, tag=CONTEXT | 1))
+        encoded.append(encode_sequence(*components))
+    return encode_sequence(*encoded)
+
+
+def decode_sort_key_list(data):
+    """
+    Decode a RFC 2891 SortKeyList.
+
+    :return: a tuple of (attributeType, orderingRule or None, reverseOrder) tuples
+    """
+    keys = []
+    for _, sort_key in decode_sequence(data):
+        attribute_type, ordering_rule, reverse_order = None, None, False
+        for tag, content in decode_components(sort_key):
+            if tag == OCTET_STRING:
+                attribute_type = content.decode('UTF-8')
+            elif tag == CONTEXT | 0:
+                ordering_rule = content.decode('UTF-8')
+            elif tag == CONTEXT | 1:
+                reverse_order = content != b'\x00'
+        keys.append((attribute_type, ordering_rule, reverse_order))
+    return tuple(keys)
+
+
+def encode_sort_result(result, attribute_type=None):
+    """
+    Encode a RFC 2891 SortResult.
+
+    :return: BER encoded value
+    """
+    components = [encode_integer(result, tag=ENUMERATED)]
+    if attribute_type is not None:
+        components.append(encode_octet_string(attribute_type, tag=CONTEXT | 0))
+    return encode_sequence(*components)
+
+
+def decode_sort_result(data):
+    """
+    Decode a RFC 2891 SortResult:
+
+          SortResult ::= SEQUENCE {
+             sortResult  ENUMERATED,
+             attributeType [0] AttributeDescription OPTIONAL }
+
+    :return: a tuple (sortResult, attributeType or None)
+    """
+    result = None
+    attribute_type = None
+    for tag, content in decode_sequence(data):
+        if tag == ENUMERATED:
+            result = decode_integer(content)
+        elif tag == CONTEXT | 0:
+            attribute_type = content.decode('UTF-8')
+    return result, attribute_type
+
+
+def encode_passwd_modify_request(identity=None, current=None, new=None):
+    """
+    Encode a RFC 3062 PasswdModifyRequestValue:
+
+        PasswdModifyRequestValue ::= SEQUENCE {
+            userIdentity    [0]  OCTET STRING OPTIONAL
+            oldPasswd       [1]  OCTET STRING OPTIONAL
+            newPasswd       [2]  OCTET STRING OPTIONAL }
+
+    This function is not cached, to avoid keeping passwords in memory.
+
+    :return: BER encoded value
+    """
+    components = []
+    for tag, value in enumerate((identity, current, new)):
+        if value is not None:
+            components.append(encode_octet_string(value, tag=CONTEXT | tag))
+    return encode_sequence(*components)
+
+
+def decode_passwd_modify_request(data):
+    """
+    Decode a RFC 3062 PasswdModifyRequestValue.
+
+    :return: a tuple (userIdentity, oldPasswd, newPasswd), where missing values are None
+    """
+    values = [None, None, None]
+    for tag, content in decode_sequence(data) if data else []:
+        if CONTEXT <= tag <= CONTEXT | 2:
+            values[tag & 0x1f] = content
+    return tuple(values)
+
+
+def encode_passwd_modify_response(generated=None):
+    """
+    Encode a RFC 3062 PasswdModifyResponseValue.
+
+    :return: BER encoded value
+    """
+    if generated is None:
+        return encode_sequence()
+    return encode_sequence(encode_octet_string(generated, tag=CONTEXT | 0))
+
+
+def decode_passwd_modify_response(data):
+    """
+    Decode a RFC 3062 PasswdModifyResponseValue:
+
+        PasswdModifyResponseValue ::= SEQUENCE {
+            genPasswd       [0]     OCTET STRING OPTIONAL }
+
+    :return: the generated password as bytes, or None
+    """
+    for tag, content in decode_sequence(data):
+        if tag == CONTEXT | 0:
+            return content
+    return None
+
+
+@lru_cache(maxsize=256)
+def encode_paged_results(size, cookie=b''):
+    """
+    Encode a RFC 2696 paged results control value:
+
+        realSearchControlValue ::= SEQUENCE {
+            size            INTEGER (0..maxInt),
+            cookie          OCTET STRING }
+
+    :return: BER encoded value
+    """
+    return encode_sequence(encode_integer(size), encode_octet_string(cookie))
+
+
+def decode_paged_results(data):
+    """
+    Decode a RFC 2696 paged results control value.
+
+    :return: a tuple (size, cookie)
+    """
+    (_, size), (_, cookie) = decode_sequence(data)[:2]
+    return decode_integer(size), cookie
+
+
+@lru_cache(maxsize=256)
+def encode_vlv_request(before_count, after_count, offset=None, content_count=0, assertion_value=None,
+                       context_id=None):
+    """
+    Encode a Virtual List View request control value (draft-ietf-ldapext-ldapv3-vlv-09):
+
+        VirtualListViewRequest ::= SEQUENCE {
+            beforeCount    INTEGER (0..maxInt),
+            afterCount     INTEGER (0..maxInt),
+            target       CHOICE {
+                byOffset        [0] SEQUENCE {
+                    offset          INTEGER (1 .. maxInt),
+                    contentCount    INTEGER (0 .. maxInt) },
+                greaterThanOrEqual [1] AssertionValue },
+            contextID     OCTET STRING OPTIONAL }
+
+    The target is byOffset, unless assertion_value is given.
+
+    :return: BER encoded value
+    """
+    if assertion_value is not None:
+        target = encode_octet_string(assertion_value, tag=CONTEXT | 1)
+    else:
+        target = encode_sequence(encode_integer(offset), encode_integer(content_count), tag=CONTEXT_CONSTRUCTED | 0)
+    components = [encode_integer(before_count), encode_integer(after_count), target]
+    if context_id is not None:
+        components.append(encode_octet_string(context_id))
+    return encode_sequence(*components)
+
+
+def decode_vlv_response(data):
+    """
+    Decode a Virtual List View response control value:
+
+        VirtualListViewResponse ::= SEQUENCE {
+            targetPosition    INTEGER (0 .. maxInt),
+            contentCount     INTEGER (0 .. maxInt),
+            virtualListViewResult ENUMERATED,
+            contextID     OCTET STRING OPTIONAL }
+
+    :return: a tuple (targetPosition, contentCount, virtualListViewResult, contextID or None)
+    """
+    components = decode_sequence(data)
+    position, count, result = [decode_integer(content) for _, content in components[:3]]
+    context_id = components[3][1] if len(components) > 3 else None
+    return position, count, result, context_id
@@ -0,0 +1,149 @@
+"""
+Conversion of raw LDAP values to Python values, regarding the attribute syntaxes, and of Python values to raw
+LDAP values.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+from pyldap_orm.dn import DN
+
+
+def encode_values(values):
+    """
+    Convert Python values to a list of bytes, as sent to the server.
+
+    :param values: a value or a list of values, as bytes, strings, integers or booleans
+    :return: a list of bytes
+    """
+    if not isinstance(values, (list, tuple, set, frozenset)):
+        values = [values]
+    encoded = []
+    for value in values:
+        if isinstance(value, bool):
+            value = b'TRUE' if value else b'FALSE'
+        elif isinstance(value, int):
+            value = str(value).encode('UTF-8')
+        elif isinstance(value, str):
+            value = value.encode('UTF-8')
+        encoded.append(value)
+    return encoded
+
+
+class SchemaCodec(object):
+    """
+    A SchemaCodec is a compiled view of a session schema: for each attribute, it holds how values must be
+    decoded (kept as bytes, decoded to string, DN, integer or boolean).
+
+    Instances only hold builtin types, so they can be pickled and sent to worker processes.
+
+    Values of low cardinality attributes, like ``objectClass``, can be interned: equal values decoded with the same
+    table are a single object, which saves memory on large result sets and makes equality checks cheaper.
+    Attribute names are always interned when a table is given. Integer and boolean values are never interned.
+
+    :param syntaxes: The ``session.schema['attributes']`` dictionary
+    :param str_oids: Syntax OIDs decoded to strings
+    :param int_oids: Syntax OIDs decoded to integers
+    :param bool_oids: Syntax OIDs decoded to booleans
+    :param interned: Names of attributes whose values are interned
+    :param dn_oids: Syntax OIDs decoded to DN instances
+    """
+    RAW = 0
+    STR = 1
+    INT = 2
+    BOOL = 3
+    DN = 4
+
+    def __init__(self, syntaxes, str_oids, int_oids, bool_oids, interned=(), dn_oids=()):
+        kinds = dict()
+        for oid in str_oids:
+            kinds[oid] = self.STR
+        for oid in int_oids:
+            kinds[oid] = self.INT
+        for oid in bool_oids:
+            kinds[oid] = self.BOOL
+        for oid in dn_oids:
+            kinds[oid] = self.DN
+        self._kinds = {attr: kinds.get(definition[0], self.RAW) for attr, definition in syntaxes.items()}
+        self._interned = frozenset(attr for attr in interned
+                                   if self._kinds.get(attr) in (self.RAW, self.STR, self.DN))
+
+    def kind(self, attribute):
+        """
+        Return how values of attribute are decoded.
+
+        :param attribute: Name of the attribute
+        :return: SchemaCodec.RAW, SchemaCodec.STR, SchemaCodec.INT, SchemaCodec.BOOL or SchemaCodec.DN
+        :raise KeyError: if the attribute is not defined by the schema
+        """
+        return self._kinds[attribute]
+
+    def decode(self, attributes, table=None):
+        """
+        Decode a raw attributes dictionary, as returned by a search.
+
+        :param attributes: a dictionary where values are lists of bytes
+        :param table: an optional dictionary used to intern attribute names and values
+        :return: a new dictionary where values are lists of decoded values
+        """
+        if table is not None:
+            return self._decode_interned(attributes, table)
+        decoded = dict()
+        kinds = self._kinds
+        for attr, values in attributes.items():
+            kind = kinds[attr]
+            if kind == self.STR:
+                decoded[attr] = [value.decode() for value in values]
+            elif kind == self.INT:
+                decoded[attr] = [int(value) for value in values]
+            elif kind == self.BOOL:
+                decoded[attr] = [value.upper() in (b'TRUE', b'1') for value in values]
+            elif kind == self.DN:
+                decoded[attr] = [DN(value.decode()) for value in values]
+            else:
+                decoded[attr] = values
+        return decoded
+
+    def _decode_interned(self, attributes, table):
+        decoded = dict()
+        kinds = self._kinds
+        interned = self._interned
+        intern = table.setdefault
+        for attr, values in attributes.items():
+            kind = kinds[attr]
+            attr = intern(attr, attr)
+            if kind == self.STR:
+                if attr in interned:
+                    decoded[attr] = [intern(value, value) for value in (value.decode() for value in values)]
+                else:
+                    decoded[attr] = [value.decode() for value in values]
+            elif kind == self.INT:
+                decoded[attr] = [int(value) for value in values]
+            elif kind == self.BOOL:
+                decoded[attr] = [value.upper() in (b'TRUE', b'1') for value in values]
+            elif kind == self.DN:
+                if attr in interned:
+                    # DNs are interned by their raw value, in their own table
+                    dns = table.get(DN)
+                    if dns is None:
+                        dns = table[DN] = dict()
+                    decoded[attr] = [dns.get(value) or dns.setdefault(value, DN(value.decode())) for value in values]
+                else:
+                    decoded[attr] = [DN(value.decode()) for value in values]
+            elif attr in interned:
+                decoded[attr] = [intern(value, value) for value in values]
+            else:
+                decoded[attr] = values
+        return decoded
+
+    def decode_entries(self, entries, intern=False):
+        """
+        Decode a list of (dn, attributes) tuples.
+
+        :param entries: a list of entries as returned by a search
+        :param intern: True to intern attribute names and values with a table shared by entries
+        :return: a list of decoded attributes dictionaries, in the same order
+        """
+        table = dict() if intern else None
+        return [self.decode(attributes, table) for (dn, attributes) in entries]
@@ -2,16 +2,18 @@
 # Copyright: Bruno Bonfils
 # License: Apache License version2
 import ldap.controls
-import pyasn1.type.univ
-import pyasn1.codec.ber.encoder
-import pyasn1.type.namedtype
-import pyasn1.type.tag
+import ldap.extop
+
+from pyldap_orm import ber
 
 
 class ServerSideSort(ldap.controls.LDAPControl):
     """
     Implements RFC 2891, LDAP Control Extension for Server Side Sorting of Search Results
 
+    Each sort key is an attribute name, optionally prefixed by ``-`` to reverse the order and
+    followed by ``:orderingRule``, like ``-cn:caseIgnoreOrderingMatch``.
+
     Reference: https://www.ietf.org/rfc/rfc2891.txt
     """
     controlType = '1.2.840.113556.1.4.473'
@@ -20,6 +22,15 @@ class ServerSideSort(ldap.controls.LDAPControl):
         self.criticality = False
         self.attributes = attributes
 
+    @staticmethod
+    def sort_key(attribute):
+        """
+        Split a sort key into a tuple (attributeType, orderingRule, reverseOrder)
+        """
+        reverse_order = attribute.startswith('-')
+        attribute_type, _, ordering_rule = attribute.lstrip('-').partition(':')
+        return attribute_type, ordering_rule or None, reverse_order
+
     def encodeControlValue(self):
         """
         The RFC define the following structure:
@@ -29,26 +40,111 @@ class ServerSideSort(ldap.controls.LDAPControl):
                  orderingRule    [0] MatchingRuleId OPTIONAL,
                  reverseOrder    [1] BOOLEAN DEFAULT FALSE }
 
-        However, is in this implementation, only attributeType can be used.
-
         :return: BER encoded value of attributes
         """
-        sort_key_list = ServerSideSort.SortKeyList()
-        i = 0
-        for attribute in self.attributes:
-            sort_key = ServerSideSort.SortKey()
-            sort_key.setComponentByName('attributeType', attribute)
-            sort_key_list.setComponentByPosition(i, sort_key)
-            i += 1
-        return pyasn1.codec.ber.encoder.encode(sort_key_list)
+        return ber.encode_sort_key_list(tuple(self.sort_key(attribute) for attribute in self.attributes))
+
 
-    class SortKeyList(pyasn1.type.univ.SequenceOf):
-        componentType = pyasn1.type.univ.Sequence()
+class ServerSideSortResponse(ldap.controls.ResponseControl):
+    """
+    RFC 2891 sort response control. ``result`` holds the sortResult code, and ``attribute`` the optional
+    attributeType in error.
+    """
+    controlType = '1.2.840.113556.1.4.474'
 
-    class SortKey(pyasn1.type.univ.Sequence):
-        componentType = pyasn1.type.namedtype.NamedTypes(
-            pyasn1.type.namedtype.NamedType('attributeType', pyasn1.type.univ.OctetString()),
-        )
+    def decodeControlValue(self, encodedControlValue):
+        self.result, self.attribute = ber.decode_sort_result(encodedControlValue)
+
+
+class PagedResults(ldap.controls.LDAPControl):
+    """
+    Implements RFC 2696, LDAP Control Extension for Simple Paged Results Manipulation.
+
+    The same class is used to decode the response control, where ``size`` is the server estimate of the
+    result set size and ``cookie`` the value to send to request the next page.
+
+    Reference: https://www.ietf.org/rfc/rfc2696.txt
+    """
+    controlType = '1.2.840.113556.1.4.319'
+
+    def __init__(self, size=1000, cookie=b'', criticality=False):
+        self.criticality = criticality
+        self.size = size
+        self.cookie = cookie
+
+    def encodeControlValue(self):
+        return ber.encode_paged_results(self.size, self.cookie)
+
+    def decodeControlValue(self, encodedControlValue):
+        self.size, self.cookie = ber.decode_paged_results(encodedControlValue)
+
+
+class VirtualListView(ldap.controls.LDAPControl):
+    """
+    Implements the Virtual List View request control (draft-ietf-ldapext-ldapv3-vlv-09). It must be used with
+    a ServerSideSort control.
+
+    The target entry is given by offset (and the client estimate of the content count), or by an assertion value
+    compared to the first sort key.
+    """
+    controlType = '2.16.840.1.113730.3.4.9'
+
+    def __init__(self, before_count=0, after_count=0, offset=1, content_count=0, assertion_value=None,
+                 context_id=None, criticality=True):
+        self.criticality = criticality
+        self.before_count = before_count
+        self.after_count = after_count
+        self.offset = offset
+        self.content_count = content_count
+        self.assertion_value = assertion_value
+        self.context_id = context_id
+
+    def encodeControlValue(self):
+        return ber.encode_vlv_request(self.before_count, self.after_count, self.offset, self.content_count,
+                                      self.assertion_value, self.context_id)
+
+
+class VirtualListViewResponse(ldap.controls.ResponseControl):
+    """
+    Virtual List View response control, with ``target_position``, ``content_count``, ``result`` and
+    ``context_id`` attributes.
+    """
+    controlType = '2.16.840.1.113730.3.4.10'
+
+    def decodeControlValue(self, encodedControlValue):
+        (self.target_position,
+         self.content_count,
+         self.result,
+         self.context_id) = ber.decode_vlv_response(encodedControlValue)
+
+
+class TreeDelete(ldap.controls.LDAPControl):
+    """
+    Tree Delete control (draft-armijo-ldap-treedelete): the server deletes the entry and all its descendants.
+    The control has no value, and is critical by default so a server which doesn't support it refuses the delete.
+    """
+    controlType = '1.2.840.113556.1.4.805'
+
+    def __init__(self, criticality=True):
+        self.criticality = criticality
+
+    def encodeControlValue(self):
+        return None
+
+
+class PermissiveModify(ldap.controls.LDAPControl):
+    """
+    Permissive Modify control (Active Directory, also supported by OpenLDAP): adding a value which already exists
+    or deleting a value which doesn't exist is not an error, so values can be added or removed without reading
+    the entry first. The control has no value.
+    """
+    controlType = '1.2.840.113556.1.4.1413'
+
+    def __init__(self, criticality=False):
+        self.criticality = criticality
+
+    def encodeControlValue(self):
+        return None
 
 
 class PasswordModify(ldap.extop.ExtendedRequest):
@@ -65,35 +161,29 @@ class PasswordModify(ldap.extop.ExtendedRequest):
         self.current = current
 
     def encodedRequestValue(self):
-        request = self.PasswdModifyRequestValue()
-        request.setComponentByName('userIdentity', self.identity)
-        if self.current is not None:
-            request.setComponentByName('oldPasswd', self.current)
-        request.setComponentByName('newPasswd', self.new)
-        return pyasn1.codec.ber.encoder.encode(request)
-
-    class PasswdModifyRequestValue(pyasn1.type.univ.Sequence):
         """
-        PyASN1 representation of:
+        The RFC define the following structure:
+
             PasswdModifyRequestValue ::= SEQUENCE {
             userIdentity    [0]  OCTET STRING OPTIONAL
             oldPasswd       [1]  OCTET STRING OPTIONAL
             newPasswd       [2]  OCTET STRING OPTIONAL }
+
+        :return: BER encoded value of the request
         """
-        componentType = pyasn1.type.namedtype.NamedTypes(
-            pyasn1.type.namedtype.OptionalNamedType(
-                'userIdentity',
-                pyasn1.type.univ.OctetString().subtype(
-                    implicitTag=pyasn1.type.tag.Tag(pyasn1.type.tag.tagClassContext, pyasn1.type.tag.tagFormatSimple, 0)
-                )),
-            pyasn1.type.namedtype.OptionalNamedType(
-                'oldPasswd',
-                pyasn1.type.univ.OctetString().subtype(
-                    implicitTag=pyasn1.type.tag.Tag(pyasn1.type.tag.tagClassContext, pyasn1.type.tag.tagFormatSimple, 1)
-                )),
-            pyasn1.type.namedtype.OptionalNamedType(
-                'newPasswd',
-                pyasn1.type.univ.OctetString().subtype(
-                    implicitTag=pyasn1.type.tag.Tag(pyasn1.type.tag.tagClassContext, pyasn1.type.tag.tagFormatSimple, 2)
-                )),
-        )
+        return ber.encode_passwd_modify_request(self.identity, self.current, self.new)
+
+
+class PasswordModifyResponse(ldap.extop.ExtendedResponse):
+    """
+    Response of a RFC 3062 Password Modify Extended Operation. When the request did not provide a new password,
+    ``responseValue`` holds the password generated by the server, otherwise it's None.
+    """
+
+    def decodeResponseValue(self, value):
+        if not value:
+            return None
+        generated = ber.decode_passwd_modify_response(value)
+        if generated is None:
+            return None
+        return generated.decode('UTF-8')
@@ -6,10 +6,13 @@ This is core of pyldap_orm.
 # Copyright: Bruno Bonfils
 # License: Apache License version2
 
+import collections
 import logging
 
-import ldap.modlist
+import ldap
 
+from pyldap_orm.codec import encode_values
+from pyldap_orm.dn import DN
 from pyldap_orm.exceptions import *
 
 logger = logging.getLogger(__name__)
@@ -19,21 +22,28 @@ class LDAPObject(object):
     """
     LDAPObject is one of the core class of the ORM. It represent an LDAP object.
 
+    Values of ``interned_attributes`` are interned when entries are parsed, see ``LDAPSession`` intern_scope.
+
+    ``base`` is a DN, or a list of DNs when objects are spread over several branches. Searches are then sent
+    concurrently on all bases, and new objects are created under the first one.
+
     :param session: an optional LDAPSession instance used to perform operations on a LDAP server.
     :type session: LDAPSession
     """
+    __slots__ = ('_attributes', '_initial_attributes', '_dn', '_state', '_session')
+
     name_attribute = 'cn'
     base = None
     filter = None
     required_attributes = []
     required_objectclasses = []
+    interned_attributes = ['objectClass']
 
     STATUS_NEW = 1
     STATUS_SYNC = 2
     STATUS_MODIFIED = 3
 
     OID_TO_STR = [
-        '1.3.6.1.4.1.1466.115.121.1.12',  # DN
         '1.3.6.1.4.1.1466.115.121.1.15',  # Directory String
         '1.3.6.1.4.1.1466.115.121.1.26',  # IA String
         '1.3.6.1.4.1.1466.115.121.1.37',  # Object Class
@@ -49,6 +59,10 @@ class LDAPObject(object):
         '1.3.6.1.4.1.1466.115.121.1.7',  # Boolean
     ]
 
+    OID_TO_DN = [
+        '1.3.6.1.4.1.1466.115.121.1.12',  # DN
+    ]
+
     def __init__(self, session):
         self._attributes = dict()
         self._initial_attributes = None
@@ -80,7 +94,8 @@ class LDAPObject(object):
         :param attributes: Optional array of attributes to returned, if none, all standard attributes are returned.
         :return: An instance of current LDAPObject inheritance
         """
-        return self.parse_single(self._session.search(dn, scope=ldap.SCOPE_BASE, attributes=attributes))
+        return self.parse_single(self._session.search(dn, scope=ldap.SCOPE_BASE, attributes=attributes,
+                                                      model=type(self)))
 
     def by_attr(self, attr, value, attributes=None):
         """
@@ -94,10 +109,11 @@ class LDAPObject(object):
         """
         entries = self._session.search(base=self.base,
                                        ldap_filter="(&{}({}={}))".format(self.filter(), attr, value),
-                                       attributes=attributes)
+                                       attributes=attributes,
+                                       model=type(self))
         return self.parse_single(entries)
 
-    def parse(self, entry):
+    def parse(self, entry, interned=None):
         """
         This method fill attributes and dn of current instance.
 
@@ -105,38 +121,90 @@ class LDAPObject(object):
         test if each required_attributes are present.
 
         :param entry: a LDAP entry
+        :param interned: an optional table used to intern values, default is the session table
         """
         (dn, attributes) = entry
-        self._dn = dn
+        if interned is None:
+            interned = self._session.interned
+        attributes = self._complete_ranges(dn, attributes)
+        return self._load(dn, attributes, self._session.codec(type(self)).decode(attributes, interned))
+
+    def _complete_ranges(self, dn, attributes):
+        """
+        Servers like Active Directory return the values of large attributes by ranges, like
+        ``member;range=0-1499``. Read the remaining values, and store them under the name of the attribute.
+
+        :param dn: DN of the entry
+        :param attributes: raw attributes of the entry, as returned by the search
+        :return: attributes, or a new dictionary if some values were returned by ranges
+        """
+        for name in attributes:
+            if ';' in name:
+                break
+        else:
+            return attributes
+        completed = dict()
+        for name, values in attributes.items():
+            attr, _, option = name.partition(';')
+            if option.lower().startswith('range='):
+                end = option[6:].partition('-')[2]
+                if end != '*':
+                    values = values + list(self._session.ranged_values(dn, attr, int(end) + 1, model=type(self)))
+                name = attr
+            completed[name] = values
+        return completed
+
+    def _load(self, dn, attributes, decoded):
+        """
+        Fill the current instance from an entry already decoded by a SchemaCodec.
+
+        :param dn: DN of the entry
+        :param attributes: raw attributes of the entry, as returned by the search
+        :param decoded: attributes decoded by a SchemaCodec
+        """
+        self._dn = DN(dn)
         # Save initial attributes values, used for ldapmodify
         self._initial_attributes = attributes
-        for attr in attributes.keys():
-            # Decode to string some attribute, regarding the syntax hey use
-            if self._session.schema['attributes'][attr][0] in self.OID_TO_STR + self.OID_TO_INT + self.OID_TO_BOOL:
-                self._attributes[attr] = [value.decode() for value in attributes[attr]]
-                if self._session.schema['attributes'][attr][0] in self.OID_TO_INT:
-                    self._attributes[attr] = [int(value) for value in attributes[attr]]
-                if self._session.schema['attributes'][attr][0] in self.OID_TO_BOOL:
-                    self._attributes[attr] = [value.upper() in ['TRUE', '1'] for value in attributes[attr]]
-            else:
-                self._attributes[attr] = attributes[attr]
+        self._attributes = decoded
         self.check()
         self._state = self.STATUS_SYNC
         return self
 
+    def has_value(self, attr, value):
+        """
+        Check if the entry has a value with the Compare operation, without reading the values of the attribute,
+        see ``LDAPSession.compare()``.
+
+        :param attr: Name of the attribute
+        :param value: The value, as bytes, a string, an integer or a boolean
+        :return: True if the entry has the value
+        """
+        return self._session.compare(self._dn, attr, encode_values(value)[0], model=type(self))
+
+    def has_values(self, attr, values):
+        """
+        Check several values at once, with asynchronous Compare operations, see ``LDAPSession.compare_many()``.
+
+        :param attr: Name of the attribute
+        :param values: an iterable of values, as bytes, strings, integers or booleans
+        :return: a list of booleans, in the order of values
+        """
+        return self._session.compare_many([(self._dn, attr, value) for value in encode_values(list(values))],
+                                          model=type(self))
+
     def check(self):
         """
         Override this method to perform post operations like remove unwanted values or perform
         some business checks.
 
         For example, if you want to remove groups that doesn't belong to your LDAPGroup.base
-        you can use the following code:
+        you can use the following code (values of DN attributes are DN instances):
 
         .. code-block:: python
 
-            for group in getattr(self, self.membership_attribute):
-                if LDAPGroup.base not in group:
-                getattr(self, self.membership_attribute).remove(group)
+            base = DN(LDAPGroup.base)
+            setattr(self, self.membership_attribute,
+                    [group for group in getattr(self, self.membership_attribute) if group.is_descendant_of(base)])
 
         """
         pass
@@ -186,41 +254,50 @@ class LDAPObject(object):
         :param value: new value
         """
         if key == 'dn':
-            object.__setattr__(self, '_dn', value)
+            object.__setattr__(self, '_dn', value if value is None else DN(value))
             # TODO: check status, if it's sync, it's a rename operation
         elif key[0] == '_':
             object.__setattr__(self, key, value)
         else:
-            if self._state == self.STATUS_NEW:
-                self._attributes[key] = value
-            elif self._state in (self.STATUS_SYNC, self.STATUS_MODIFIED):
-                self._state = self.STATUS_MODIFIED
-                try:
-                    if self._attributes[key] == value:
-                        # Skip if there is no change (aka current value is equal the new value)
-                        return
-                except KeyError:
-                    # It may be a new attribute
-                    pass
-                self._attributes[key] = value
+            self._store(key, value)
 
-    def save(self):
+    def _store(self, key, value):
+        """
+        Update the values of an attribute, and the state of the instance.
+        """
+        if self._state == self.STATUS_NEW:
+            self._attributes[key] = value
+        elif self._state in (self.STATUS_SYNC, self.STATUS_MODIFIED):
+            self._state = self.STATUS_MODIFIED
+            try:
+                if self._attributes[key] == value:
+                    # Skip if there is no change (aka current value is equal the new value)
+                    return
+            except KeyError:
+                # It may be a new attribute
+                pass
+            self._attributes[key] = value
+
+    def save(self, timeout=None):
         """
         This method is a little magic. Depending on the object state you called it, it can create
         or update an existing object.
 
         There is even more magic when you create a new object. If the _dn attribute is not set (None),
-        it will be computed from the name_attribute, and the base.
+        it will be computed from the name_attribute, and the base (the first one when base is a list).
 
         If there is no objectClass defined, the required_objectclasses will be used.
 
         Last, verify that all attributes from required_attributes exists.
 
+        :param timeout: Maximum duration of the operation, in seconds
         """
         # Do nothing if state is not NEW or MODIFIED
         if self._state not in (self.STATUS_NEW, self.STATUS_MODIFIED):
             return
 
+        import ldap.modlist
+
         if self._state == self.STATUS_MODIFIED:
             # If status is MODIFIED, compute a modifyModList from _initial_attributes and _attributes.
             raw_attributes = self._attributes
@@ -230,12 +307,11 @@ class LDAPObject(object):
                     raw_attributes[attribute] = [str(value).lower() for value in raw_attributes[attribute]]
 
                 if self._session.schema['attributes'][attribute][0] in \
-                                        self.OID_TO_STR + self.OID_TO_BOOL + self.OID_TO_INT:
+                                        self.OID_TO_STR + self.OID_TO_DN + self.OID_TO_BOOL + self.OID_TO_INT:
                     raw_attributes[attribute] = [value.encode('UTF-8') for value in raw_attributes[attribute]]
 
             ldif = ldap.modlist.modifyModlist(self._initial_attributes, self._attributes)
-            logger.debug("Updating object: {} with following updates: {}".format(self.dn, ldif))
-            self._session.server.modify_s(self._dn, ldif)
+            self._session.modify(self._dn, ldif, model=type(self), timeout=timeout)
         elif self._state == self.STATUS_NEW:
             # Check if attributes in required_attributes are defined
             for attr in self.required_attributes:
@@ -254,59 +330,124 @@ class LDAPObject(object):
             # If dn is none, set it using <name_attribute> = <value>[0], <base>
             if self._dn is None:
                 name_attribute_value = getattr(self, self.name_attribute)[0]
-                if self._session.schema['attributes'][self.name_attribute][0] not in self.OID_TO_STR:
+                if self._session.schema['attributes'][self.name_attribute][0] not in self.OID_TO_STR + self.OID_TO_DN:
                     name_attribute_value = name_attribute_value.decode('UTF-8')
 
-                self._dn = "{}={},{}".format(self.name_attribute,
-                                             name_attribute_value,
-                                             self.base)
+                base = self.base[0] if isinstance(self.base, (list, tuple)) else self.base
+                self._dn = DN.build(self.name_attribute, name_attribute_value, base)
 
             # Convert all mapped attributes to bytes array
             for attribute in self._attributes.keys():
                 if self._session.schema['attributes'][attribute][0] in \
-                                        self.OID_TO_BOOL + self.OID_TO_INT + self.OID_TO_STR:
+                                        self.OID_TO_BOOL + self.OID_TO_INT + self.OID_TO_STR + self.OID_TO_DN:
                     raw_attributes[attribute] = [str(value) for value in self._attributes[attribute]]
                     raw_attributes[attribute] = [value.encode('UTF-8') for value in self._attributes[attribute]]
                 else:
                     raw_attributes[attribute] = self._attributes[attribute]
 
             ldif = ldap.modlist.addModlist(raw_attributes)
-            logger.debug("Adding new object: {}".format(self._dn))
-            self._session.server.add_s(self._dn, ldif)
+            self._session.add(self._dn, ldif, model=type(self), timeout=timeout)
 
         self._state = self.STATUS_SYNC
         self._initial_attributes = None
 
-    def delete(self):
-        self._session.server.delete_s(self._dn)
+    def delete(self, timeout=None):
+        """
+        Delete the object.
+
+        :param timeout: Maximum duration of the operation, in seconds
+        """
+        self._session.delete(self._dn, model=type(self), timeout=timeout)
+
+    def delete_subtree(self, tree_delete=None, window=64):
+        """
+        Delete the object and all its descendants, see ``LDAPSession.delete_subtree()``.
+
+        :param tree_delete: True to use the Tree Delete control, False to delete entries one by one, None to use
+                            the control if the server advertises it
+        :param window: Maximum number of pending deletes
+        """
+        self._session.delete_subtree(self._dn, model=type(self), tree_delete=tree_delete, window=window)
 
 
 class LDAPModelList(object):
     """
     Manages a list of ``LDAPObject`` instances.
 
+    Large result sets can be decoded by a pool of worker processes: entries are sent to the workers by chunks of
+    ``chunk_size`` entries, decoded by a SchemaCodec, then the ``children`` instances are built in the current
+    process. The pool is only used when the result set holds more than one chunk.
+
     :param session: An optional instance of LDAPSession.
     :type session: LDAPSession
+    :param workers: An optional number of worker processes used to decode entries
+    :param chunk_size: Number of entries sent to a worker at once
+    :param spill: True, or a directory, to store result sets in a temporary file instead of memory. ``all()`` and
+                  ``by_attr()`` then return a :class:`pyldap_orm.spill.SpilledResults`, filled by a paged search of
+                  ``page_size`` entries per page.
+
+    When ``generated_children`` is True, instances are built from the class generated by ``session.model(children)``,
+    see :mod:`pyldap_orm.schema`.
     """
     children = None  # type: LDAPObject()
+    generated_children = False
+    page_size = 1000
 
-    def __init__(self, session=None):
+    def __init__(self, session=None, workers=None, chunk_size=5000, spill=None):
         self._objects = list()
         self._dn = None
         self._session = session
+        self._workers = workers
+        self._chunk_size = chunk_size
+        self._spill = spill
 
     def _parse_multiple(self, entries):
-        for entry in entries:
-            current = self.children(self._session).parse(entry)
-            self._objects.append(current)
+        interned = self._session.intern_table()
+        children = self._session.model(self.children) if self.generated_children else self.children
+        if self._workers is None or len(entries) <= self._chunk_size:
+            for entry in entries:
+                current = children(self._session).parse(entry, interned)
+                self._objects.append(current)
+            return self._objects
+
+        import functools
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Values are interned by chunk in worker processes
+        complete = children(self._session)._complete_ranges
+        entries = [(dn, complete(dn, attributes)) for dn, attributes in entries]
+        decode = functools.partial(self._session.codec(self.children).decode_entries, intern=interned is not None)
+        chunks = [entries[i:i + self._chunk_size] for i in range(0, len(entries), self._chunk_size)]
+        with ProcessPoolExecutor(max_workers=self._workers) as executor:
+            for chunk, decoded_chunk in zip(chunks, executor.map(decode, chunks)):
+                for (dn, attributes), decoded in zip(chunk, decoded_chunk):
+                    self._objects.append(children(self._session)._load(dn, attributes, decoded))
+        return self._objects
+
+    def _spill_results(self, ldap_filter, attributes, serverctrls):
+        from pyldap_orm.spill import SpilledResults
+
+        entries = self._session.paged_search(base=self.children.base,
+                                             ldap_filter=ldap_filter,
+                                             scope=ldap.SCOPE_SUBTREE,
+                                             attributes=attributes,
+                                             serverctrls=serverctrls,
+                                             model=self.children,
+                                             page_size=self.page_size)
+        children = self._session.model(self.children) if self.generated_children else self.children
+        self._objects = SpilledResults(self._session, children, entries,
+                                       None if self._spill is True else self._spill)
         return self._objects
 
     def all(self, attributes=None, serverctrls=None):
+        if self._spill:
+            return self._spill_results(self.children.filter(), attributes, serverctrls)
         entries = self._session.search(base=self.children.base,
                                        ldap_filter=self.children.filter(),
                                        scope=ldap.SCOPE_SUBTREE,
                                        attributes=attributes,
-                                       serverctrls=serverctrls)
+                                       serverctrls=serverctrls,
+                                       model=self.children)
         return self._parse_multiple(entries)
 
     def by_attr(self, attr, value, attributes=None, serverctrls=None):
@@ -320,9 +461,148 @@ class LDAPModelList(object):
         :return: A list of self.children
         :rtype: list
         """
+        ldap_filter = "(&{}({}={}))".format(self.children.filter(), attr, value)
+        if self._spill:
+            return self._spill_results(ldap_filter, attributes, serverctrls)
         entries = self._session.search(base=self.children.base,
-                                       ldap_filter="(&{}({}={}))".format(self.children.filter(), attr, value),
+                                       ldap_filter=ldap_filter,
                                        scope=ldap.SCOPE_SUBTREE,
                                        attributes=attributes,
-                                       serverctrls=serverctrls)
+                                       serverctrls=serverctrls,
+                                       model=self.children)
         return self._parse_multiple(entries)
+
+    def delete_subtree(self, tree_delete=None, window=64):
+        """
+        Delete all children entries with their descendants. Children found under another child are deleted with
+        the subtree of their ancestor.
+
+        :param tree_delete: True to use the Tree Delete control, False to delete entries one by one, None to use
+                            the control if the server advertises it
+        :param window: Maximum number of pending deletes
+        :return: the number of deleted subtrees
+        """
+        dns = sorted((DN(dn) for dn, _ in self._session.paged_search(base=self.children.base,
+                                                                     ldap_filter=self.children.filter(),
+                                                                     attributes=['1.1'],
+                                                                     model=self.children,
+                                                                     page_size=self.page_size,
+                                                                     primary=True)
+                      if dn is not None), key=lambda dn: len(dn.rdns))
+        roots = []
+        normalized_roots = set()
+        for dn in dns:
+            # Ancestors are sorted first
+            if not any(','.join(dn.rdns[index:]) in normalized_roots for index in range(1, len(dn.rdns))):
+                roots.append(dn)
+                normalized_roots.add(dn.normalized)
+        for dn in roots:
+            self._session.delete_subtree(dn, model=self.children, tree_delete=tree_delete, window=window)
+        return len(roots)
+
+    def _values(self, attr, decode=True):
+        """
+        Stream the values of attr for each children entry, using a paged search. Objects are not built.
+
+        :return: a generator of lists of values, one list per entry
+        """
+        codec = self._session.codec(self.children)
+        lowered = attr.lower()
+        for dn, attributes in self._session.paged_search(base=self.children.base,
+                                                         ldap_filter=self.children.filter(),
+                                                         scope=ldap.SCOPE_SUBTREE,
+                                                         attributes=[attr],
+                                                         model=self.children,
+                                                         page_size=self.page_size):
+            if dn is None:
+                continue
+            values = []
+            for name, raw_values in attributes.items():
+                if name.lower() == lowered:
+                    values = codec.decode({name: raw_values})[name] if decode else raw_values
+                    break
+            yield values
+
+    def count_by(self, attr):
+        """
+        Count children by value of attr, like users per department. An entry is counted once for each of its
+        values, and entries without value are counted with the None key.
+
+        Entries are streamed with a paged search of ``page_size`` entries, and only attr is requested, so the
+        memory used depends on the number of distinct values, not on the number of entries.
+
+        :param attr: Attribute to group by
+        :return: a ``collections.Counter``
+        """
+        counter = collections.Counter()
+        for values in self._values(attr):
+            if values:
+                counter.update(set(values))
+            else:
+                counter[None] += 1
+        return counter
+
+    def distinct(self, attr):
+        """
+        :param attr: An attribute, like loginShell
+        :return: the set of values of attr among children
+        """
+        found = set()
+        for values in self._values(attr):
+            found.update(values)
+        return found
+
+    def histogram(self, attr, key=len):
+        """
+        Count children by a function of the values of attr, like groups by number of members:
+
+        >>> LDAPGroups(session).histogram('member')
+        Counter({1: 120, 2: 45, 3: 12})
+
+        :param attr: An attribute
+        :param key: A callable, called with the list of values of each entry (an empty list when the entry has no
+                    value). Values are not decoded when key is len.
+        :return: a ``collections.Counter``
+        """
+        counter = collections.Counter()
+        for values in self._values(attr, decode=key is not len):
+            counter[key(values)] += 1
+        return counter
+
+    def reconcile(self, records, key=None, attributes=None, delete=True, dry_run=False, window=64, page_size=1000):
+        """
+        Bring the entries of children to a desired state, see :mod:`pyldap_orm.reconcile`. Current entries are read
+        with one paged search, so a run with nothing to change costs a single search.
+
+        :param records: an iterable of dictionaries holding the desired attribute values of each entry
+        :param key: Attribute identifying records and entries, default is ``children.name_attribute``
+        :param attributes: Managed attributes, default is all the attributes found in records
+        :param delete: Delete entries without record
+        :param dry_run: Only compute the plan, don't apply it
+        :param window: Maximum number of pending operations when applying the plan
+        :param page_size: Number of entries per page of the search
+        :return: a ReconciliationPlan
+        """
+        from pyldap_orm.reconcile import Reconciler
+
+        plan = Reconciler(self, key, attributes, delete).plan(records, page_size)
+        if not dry_run:
+            plan.apply(self._session, window)
+        return plan
+
+    def export(self, callback, path, key=None, attributes=None, page_size=None):
+        """
+        Give all children to callback, page per page, recording the progress in a checkpoint file so an
+        interrupted export is resumed from the last delivered page, see :mod:`pyldap_orm.export`.
+
+        :param callback: a callable called with the list of objects of each page, and the Checkpoint
+        :param path: Path of the checkpoint file
+        :param key: Attribute used to resume from the last delivered value, which must have an ordering rule, like
+                    ``entryUUID``. None to resume with the paged results cookie.
+        :param attributes: An array of attributes to return, default is all user attributes
+        :param page_size: Number of entries per page, default is ``page_size``
+        :return: the Checkpoint
+        """
+        from pyldap_orm.export import CheckpointedExport
+
+        return CheckpointedExport(self, path, key, attributes, page_size).run(callback)
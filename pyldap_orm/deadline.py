@@ -0,0 +1,101 @@
+"""
+Deadlines of the operations of a LDAPSession.
+
+A deadline is set for the current thread or asyncio task with ``deadline()``, or for a single call with the
+``timeout`` argument of LDAPSession methods; the earliest one applies. A nested deadline can't extend the
+enclosing one:
+
+>>> with deadline(2.0):
+...     user = LDAPModelUser(session).by_attr('uid', 'jdoe')
+...     user.mail = ['jdoe@example.com']
+...     user.save()
+
+When the deadline expires, the client stops waiting, sends an Abandon request for the operation in progress, so
+the server stops working on it, and raises ``ldap.TIMEOUT``. An operation is not sent once its deadline expired.
+Searches also carry the remaining time as time limit, so the server gives up on its own.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import contextlib
+import contextvars
+import math
+import time
+
+import ldap
+
+_expires = contextvars.ContextVar('pyldap_orm_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline(timeout):
+    """
+    Context manager setting a deadline for the operations of the current thread or asyncio task.
+
+    :param timeout: Delay before the deadline, in seconds
+    """
+    expires = time.monotonic() + timeout
+    current = _expires.get()
+    if current is not None and current < expires:
+        expires = current
+    token = _expires.set(expires)
+    try:
+        yield
+    finally:
+        _expires.reset(token)
+
+
+def remaining(timeout=None):
+    """
+    :param timeout: Timeout of the call, in seconds, or None
+    :return: the number of seconds before the earliest of the call and context deadlines, or None if there is none
+    :raise ldap.TIMEOUT: if the deadline already expired
+    """
+    expires = _expires.get()
+    now = time.monotonic()
+    if timeout is not None:
+        expires = now + timeout if expires is None else min(expires, now + timeout)
+    if expires is None:
+        return None
+    if expires <= now:
+        raise ldap.TIMEOUT({'desc': 'Deadline exceeded'})
+    return expires - now
+
+
+def time_limit(timeout):
+    """
+    :param timeout: Remaining time, in seconds, or None
+    :return: the time limit of a search sent with this remaining time, as expected by ``search_ext()``. The server
+             counts whole seconds, and 0 means no limit, so the limit is rounded up.
+    """
+    return -1 if timeout is None else max(1, math.ceil(timeout))
+
+
+def wait(connection, msgid, timeout=None, **kwargs):
+    """
+    Wait for the result of an asynchronous operation. When timeout expires, the operation is abandoned.
+
+    :param connection: The connection the operation was sent on
+    :param msgid: The message id of the operation
+    :param timeout: Maximum waiting time, in seconds, or None to wait forever
+    :param kwargs: Other arguments of ``result4()``, like ``resp_ctrl_classes``
+    :return: the tuple returned by ``result4()``
+    :raise ldap.TIMEOUT: if timeout expired
+    """
+    try:
+        return connection.result4(msgid, all=1, timeout=-1 if timeout is None else timeout, **kwargs)
+    except ldap.TIMEOUT:
+        abandon(connection, msgid)
+        raise
+
+
+def abandon(connection, msgid):
+    """
+    Abandon an operation, ignoring errors: the server may have answered meanwhile.
+    """
+    try:
+        connection.abandon(msgid)
+    except ldap.LDAPError:
+        pass
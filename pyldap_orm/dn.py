@@ -0,0 +1,123 @@
+"""
+Distinguished names.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import functools
+import sys
+
+import ldap
+import ldap.dn
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_dn(dn):
+    """
+    Parse a DN, and compute its normalized form: attribute types and values in lower case, without extra spaces,
+    and attributes of multi-valued RDNs sorted. Results are cached, and normalized strings are interned.
+
+    A string which is not a valid DN is normalized as a single RDN, in lower case.
+
+    :param dn: a DN string
+    :return: a tuple (normalized DN, tuple of normalized RDNs)
+    """
+    try:
+        rdns = ldap.dn.str2dn(dn)
+    except ldap.DECODING_ERROR:
+        normalized = sys.intern(' '.join(dn.lower().split()))
+        return normalized, (normalized,)
+    normalized_rdns = tuple(sys.intern(ldap.dn.dn2str([[(attr.lower(), ' '.join(value.lower().split()), flags)
+                                                        for attr, value, flags in sorted(rdn)]]))
+                            for rdn in rdns)
+    return sys.intern(','.join(normalized_rdns)), normalized_rdns
+
+
+class DN(str):
+    """
+    A DN is a string, compared using its normalized form, so variants in case or spacing are equal:
+
+    >>> DN('CN=John Doe, ou=People,dc=example,dc=com') == 'cn=john doe,ou=people,dc=example,dc=com'
+    True
+
+    The normalized form is computed on first comparison, then kept. Its hash is the hash of the normalized form,
+    so DNs can be used as dictionary keys or in sets, as long as all keys are DN instances.
+    """
+
+    def _parsed(self):
+        try:
+            return self._parse_result
+        except AttributeError:
+            self._parse_result = parse_dn(str(self))
+            return self._parse_result
+
+    @property
+    def normalized(self):
+        return self._parsed()[0]
+
+    @property
+    def rdns(self):
+        """
+        The normalized RDNs, from the entry to the root
+        """
+        return self._parsed()[1]
+
+    @property
+    def parent(self):
+        """
+        The DN of the parent entry, or None for a DN with a single RDN
+        """
+        rdns = self.rdns
+        if len(rdns) < 2:
+            return None
+        return DN(','.join(rdns[1:]))
+
+    @classmethod
+    def build(cls, attribute, value, base):
+        """
+        Build the DN of an entry from its naming attribute and its parent DN. Special characters of the value are
+        escaped.
+
+        :param attribute: Naming attribute, like cn
+        :param value: Value of the naming attribute
+        :param base: DN of the parent entry
+        :return: a DN instance
+        """
+        return cls('{}={},{}'.format(attribute, ldap.dn.escape_dn_chars(value), base))
+
+    def is_descendant_of(self, base):
+        """
+        :param base: a DN, as a string or a DN instance
+        :return: True if the entry is base or one of its descendants, like for a subtree search
+        """
+        if not isinstance(base, DN):
+            base = DN(base)
+        rdns = self.rdns
+        base_rdns = base.rdns
+        if len(base_rdns) > len(rdns):
+            return False
+        return rdns[len(rdns) - len(base_rdns):] == base_rdns
+
+    def __eq__(self, other):
+        if isinstance(other, DN):
+            return self.normalized == other.normalized
+        if isinstance(other, str):
+            return self.normalized == parse_dn(other)[0]
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.normalized)
+
+    def __repr__(self):
+        return 'DN({})'.format(str.__repr__(self))
+
+    def __reduce__(self):
+        return DN, (str(self),)
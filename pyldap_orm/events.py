@@ -0,0 +1,188 @@
+"""
+Instrumentation of the operations performed by a LDAPSession.
+
+Hooks are callables registered with ``LDAPSession.add_hook()``. They are called with an OperationEvent once each
+operation (search, compare, add, modify, delete, bind, extop and schema load) completed, successfully or not:
+
+>>> histogram = LatencyHistogram()
+>>> session.add_hook(histogram)
+>>> session.add_hook(SlowQueryLog(threshold=0.5))
+>>> LDAPModelUsers(session).all()
+>>> histogram.percentile(0.99, operation='search', model='LDAPModelUser')
+
+When no hook is registered, operations are not instrumented at all.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import bisect
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class OperationEvent(object):
+    """
+    Description of an operation performed on the server.
+
+    * ``operation``: one of ``search``, ``compare``, ``add``, ``modify``, ``delete``, ``bind``, ``extop``, ``schema``
+    * ``target``: the base of a search, the DN of the entry or of the bind, the OID of an extended operation
+    * ``scope``, ``filter`` and ``attributes``: search parameters, None for other operations
+    * ``controls``: the list of server controls sent, or None
+    * ``model``: the LDAPObject class which requested the operation, or None
+    * ``timestamp``: start of the operation, as returned by ``time.time()``
+    * ``duration``: duration of the operation, in seconds
+    * ``result_count``: number of entries returned by a search, otherwise 0
+    * ``bytes_received``: size of the DNs and values returned by the server
+    * ``error``: the exception raised by the operation, or None
+    """
+    __slots__ = ('operation', 'target', 'scope', 'filter', 'attributes', 'controls', 'model', 'timestamp',
+                 'duration', 'result_count', 'bytes_received', 'error')
+
+    def __init__(self, operation, target, scope=None, ldap_filter=None, attributes=None, controls=None, model=None,
+                 timestamp=None):
+        self.operation = operation
+        self.target = target
+        self.scope = scope
+        self.filter = ldap_filter
+        self.attributes = attributes
+        self.controls = controls
+        self.model = model
+        self.timestamp = timestamp
+        self.duration = None
+        self.result_count = 0
+        self.bytes_received = 0
+        self.error = None
+
+    @property
+    def model_name(self):
+        return None if self.model is None else self.model.__name__
+
+    def measure(self, result):
+        """
+        Fill result_count and bytes_received from the result of the operation.
+
+        :param result: a list of (dn, attributes) entries for a search, a tuple (oid, value) for an extended
+                       operation
+        """
+        if self.operation in ('search', 'schema'):
+            size = 0
+            for dn, attributes in result:
+                size += len(dn)
+                for values in attributes.values():
+                    for value in values:
+                        size += len(value)
+            self.result_count = len(result)
+            self.bytes_received = size
+        elif self.operation == 'extop' and result:
+            self.bytes_received = len(result[1] or b'')
+
+    def __repr__(self):
+        return "<OperationEvent {} {} model={} duration={} results={} error={!r}>".format(
+            self.operation, self.target, self.model_name, self.duration, self.result_count, self.error)
+
+
+class LatencyHistogram(object):
+    """
+    Collect operation durations in buckets, per operation and model.
+
+    :param buckets: Upper bounds of buckets, in seconds. Durations above the last bound are counted in an extra
+                    bucket.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = collections.defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._totals = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        key = (event.operation, event.model_name)
+        index = bisect.bisect_left(self.buckets, event.duration)
+        with self._lock:
+            self._counts[key][index] += 1
+            self._totals[key] += event.duration
+
+    def keys(self):
+        """
+        :return: the list of (operation, model name) observed
+        """
+        with self._lock:
+            return list(self._counts)
+
+    def _select(self, operation, model):
+        return [key for key in self.keys()
+                if (operation is None or key[0] == operation) and (model is None or key[1] == model)]
+
+    def counts(self, operation=None, model=None):
+        """
+        Return the number of operations in each bucket. The last value is the count of operations slower than
+        the last bucket.
+
+        :param operation: Only count this operation
+        :param model: Only count operations of this model name
+        :return: a list of counts
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        for key in self._select(operation, model):
+            for index, count in enumerate(self._counts[key]):
+                counts[index] += count
+        return counts
+
+    def count(self, operation=None, model=None):
+        return sum(self.counts(operation, model))
+
+    def total(self, operation=None, model=None):
+        """
+        :return: the cumulated duration of operations, in seconds
+        """
+        return sum(self._totals[key] for key in self._select(operation, model))
+
+    def percentile(self, fraction, operation=None, model=None):
+        """
+        Return the upper bound of the bucket holding the given percentile.
+
+        :param fraction: percentile, between 0 and 1, like 0.99
+        :param operation: Only consider this operation
+        :param model: Only consider operations of this model name
+        :return: a duration in seconds, ``float('inf')`` if the percentile is above the last bucket, or None when no
+                 operation was observed
+        """
+        counts = self.counts(operation, model)
+        total = sum(counts)
+        if total == 0:
+            return None
+        cumulated = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulated += count
+            if cumulated >= fraction * total:
+                return bound
+
+
+class SlowQueryLog(object):
+    """
+    Keep the last operations slower than a threshold, and log them as warnings.
+
+    :param threshold: Minimal duration of logged operations, in seconds
+    :param size: Number of operations kept in ``entries``
+    :param log: The logger used, None to only keep events
+    """
+
+    def __init__(self, threshold=1.0, size=100, log=logger):
+        self.threshold = threshold
+        self.entries = collections.deque(maxlen=size)
+        self._log = log
+
+    def __call__(self, event):
+        if event.duration < self.threshold:
+            return
+        self.entries.append(event)
+        if self._log is not None:
+            self._log.warning("Slow %s on %s (model: %s, filter: %s): %.3fs, %d entries, %d bytes",
+                              event.operation, event.target, event.model_name, event.filter, event.duration,
+                              event.result_count, event.bytes_received)
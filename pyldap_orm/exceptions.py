@@ -8,3 +8,7 @@ class LDAPModelQueryException(LDAPORMException):
 
 class LDAPSessionException(LDAPORMException):
     pass
+
+
+class LDAPOverloadedException(LDAPSessionException):
+    pass
@@ -0,0 +1,258 @@
+"""
+Exports of large result sets which survive reconnects and restarts.
+
+An export reads the entries of a LDAPModelList page per page, and gives each page to a callback. Once the callback
+returned, the progress is committed to a checkpoint file, so an interrupted export is resumed from the last
+committed page instead of from the first entry:
+
+>>> def write(users, checkpoint):
+...     output.writelines('{}\\n'.format(user.dn) for user in users)
+...     output.flush()
+>>> LDAPModelUsers(session).export(write, '/var/lib/exports/users.json', key='entryUUID')
+
+Progress is tracked in one of two ways:
+
+* With a key, entries are sorted by the server on this attribute, with the server side sort control. The last
+  delivered value is the watermark: after a reconnect or a restart, the search is sent again, to any server, with
+  a filter selecting the entries from the watermark. The key must be present in every entry, and should be unique,
+  like ``uid`` or ``entryUUID``; the DNs of the delivered entries sharing the watermark value are recorded so they
+  are not delivered again. While the connection stays up, pages are read with the paged results cookie.
+* Without key, the paged results cookie is stored with the URI of the server which returned it, and pages are
+  read from this server. Most servers invalidate cookies when the connection is closed, in which case resuming the
+  export fails with the error returned by the server.
+
+A page is given to the callback once completely read, and the next page is requested once the checkpoint is
+committed, so entries are delivered once. Only a crash between the return of the callback and the commit gives a
+page again; the callback gets the checkpoint, whose ``pages`` number can be stored with the output to detect it.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import base64
+import json
+import logging
+import os
+import tempfile
+import time
+
+import ldap
+import ldap.filter
+
+from pyldap_orm.dn import DN
+from pyldap_orm.exceptions import LDAPORMException
+from pyldap_orm.replicas import FAILOVER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """
+    Progress of an export, stored in a JSON file.
+
+    * ``pages`` and ``entries``: the number of pages and entries delivered
+    * ``base``: index of the base being exported, when the model has several bases
+    * ``cookie``: the paged results cookie returned with the last delivered page
+    * ``server``: the URI of the server which returned the cookie
+    * ``watermark``: the key value of the last delivered entry
+    * ``seen``: the normalized DNs of the delivered entries whose key is the watermark
+    * ``done``: True once the last page was delivered
+
+    :param path: Path of the checkpoint file
+    """
+    __slots__ = ('path', 'pages', 'entries', 'base', 'cookie', 'server', 'watermark', 'seen', 'done')
+
+    def __init__(self, path):
+        self.path = path
+        self.pages = 0
+        self.entries = 0
+        self.base = 0
+        self.cookie = b''
+        self.server = None
+        self.watermark = None
+        self.seen = []
+        self.done = False
+
+    def __repr__(self):
+        return "<Checkpoint pages={} entries={} done={}>".format(self.pages, self.entries, self.done)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: Path of the checkpoint file
+        :return: the Checkpoint stored in path, or a new one if the file doesn't exist
+        """
+        checkpoint = cls(path)
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path) as fh:
+            state = json.load(fh)
+        for name in cls.__slots__[1:]:
+            setattr(checkpoint, name, state[name])
+        checkpoint.cookie = base64.b64decode(checkpoint.cookie)
+        return checkpoint
+
+    def commit(self):
+        """
+        Write the checkpoint to a temporary file, then replace the checkpoint file with it, so the file always holds
+        a complete checkpoint.
+        """
+        state = {name: getattr(self, name) for name in self.__slots__[1:]}
+        state['cookie'] = base64.b64encode(self.cookie).decode('ascii')
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(state, fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+class CheckpointedExport(object):
+    """
+    Export the entries of a LDAPModelList, see the module documentation.
+
+    :param model_list: a LDAPModelList instance
+    :param path: Path of the checkpoint file
+    :param key: Attribute used as watermark, which must have an ordering rule, like ``entryUUID``. None to resume
+                with the paged results cookie.
+    :param attributes: An array of attributes to return, default is all user attributes
+    :param page_size: Number of entries per page, default is the page_size of the model list
+    :param retries: Number of consecutive failures of a page, like lost connections, before giving up
+    :param retry_interval: Delay before a page is requested again, in seconds
+    :raise LDAPORMException: if key has no ordering rule in the session schema
+    """
+
+    def __init__(self, model_list, path, key=None, attributes=None, page_size=None, retries=3, retry_interval=1.0):
+        self.model = model_list.children
+        self.session = model_list._session
+        self.children = self.session.model(self.model) if model_list.generated_children else self.model
+        if key is not None and self.session.ordering_rule(key) is None:
+            raise LDAPORMException("Attribute {} has no ordering rule, it can't be used as export key".format(key))
+        self.path = path
+        self.key = key
+        if key is not None:
+            # The key may be an operational attribute, like entryUUID
+            attributes = list(attributes or ['*'])
+            if key not in attributes:
+                attributes.append(key)
+        self.attributes = attributes
+        self.page_size = page_size or model_list.page_size
+        self.retries = retries
+        self.retry_interval = retry_interval
+        bases = self.model.base
+        self.bases = list(bases) if isinstance(bases, (list, tuple)) else [bases]
+        # Search in progress, (node, filter), while cookies returned by the node can be used
+        self._search = None
+
+    def _node(self, checkpoint):
+        if checkpoint.server is not None:
+            for node in self.session.replicas + self.session.primaries:
+                if node.backend == checkpoint.server:
+                    return node
+        return self.session.page_node()
+
+    def _filter(self, checkpoint):
+        ldap_filter = self.model.filter()
+        if self.key is None:
+            return ldap_filter
+        if checkpoint.watermark is None:
+            return '(&{}({}=*))'.format(ldap_filter, self.key)
+        return '(&{}({}>={}))'.format(ldap_filter, self.key, ldap.filter.escape_filter_chars(checkpoint.watermark))
+
+    def _page(self, checkpoint):
+        """
+        Read the next page.
+
+        :return: a tuple (entries, cookie)
+        """
+        from pyldap_orm.controls import ServerSideSort
+
+        if self.key is None:
+            node, ldap_filter, cookie = self._node(checkpoint), self._filter(checkpoint), checkpoint.cookie
+            serverctrls = None
+        else:
+            serverctrls = [ServerSideSort([self.key])]
+            if self._search is not None and checkpoint.cookie:
+                node, ldap_filter = self._search
+                cookie = checkpoint.cookie
+            else:
+                # Start a new search from the watermark
+                node, ldap_filter, cookie = self.session.page_node(), self._filter(checkpoint), b''
+        self._search = (node, ldap_filter)
+        return self.session.search_page(self.bases[checkpoint.base], ldap.SCOPE_SUBTREE, ldap_filter,
+                                        self.attributes, serverctrls, self.model, self.page_size, cookie, node)
+
+    def _key_value(self, attributes):
+        lowered = self.key.lower()
+        for name, values in attributes.items():
+            if name.lower() == lowered and values:
+                return min(value.decode('UTF-8') for value in values)
+        return None
+
+    def _advance(self, checkpoint, entries, cookie, node):
+        checkpoint.pages += 1
+        checkpoint.entries += len(entries)
+        checkpoint.cookie = cookie
+        checkpoint.server = node.backend if isinstance(node.backend, str) else None
+        if self.key is not None:
+            for dn, attributes in entries:
+                value = self._key_value(attributes)
+                if value is None:
+                    continue
+                if checkpoint.watermark is None or value.lower() != checkpoint.watermark.lower():
+                    checkpoint.watermark = value
+                    checkpoint.seen = []
+                checkpoint.seen.append(DN(dn).normalized)
+        if not cookie:
+            checkpoint.base += 1
+            checkpoint.cookie = b''
+            checkpoint.server = None
+            checkpoint.watermark = None
+            checkpoint.seen = []
+            self._search = None
+            checkpoint.done = checkpoint.base >= len(self.bases)
+
+    def run(self, callback):
+        """
+        Export the remaining entries.
+
+        :param callback: a callable called with the list of objects of each page, and the Checkpoint before it's
+                         updated
+        :return: the committed Checkpoint
+        :raise: the error of the last attempt, once a page failed ``retries`` times in a row
+        """
+        checkpoint = Checkpoint.load(self.path)
+        if checkpoint.pages and not checkpoint.done:
+            logger.info("Resuming export from %s", checkpoint)
+        failures = 0
+        interned = self.session.intern_table()
+        while not checkpoint.done:
+            try:
+                entries, cookie = self._page(checkpoint)
+            except FAILOVER_ERRORS as e:
+                failures += 1
+                if failures > self.retries:
+                    raise
+                logger.warning("Failed to read page %d of export, retrying: %s", checkpoint.pages + 1, e)
+                if self.key is not None:
+                    # The cookie is lost with the connection, resume from the watermark
+                    self._search = None
+                time.sleep(self.retry_interval)
+                continue
+            failures = 0
+            node = self._search[0]
+            seen = set(checkpoint.seen)
+            entries = [(dn, attributes) for dn, attributes in entries
+                       if dn is not None and DN(dn).normalized not in seen]
+            objects = [self.children(self.session).parse(entry, interned) for entry in entries]
+            if objects:
+                callback(objects, checkpoint)
+            self._advance(checkpoint, entries, cookie, node)
+            checkpoint.commit()
+        return checkpoint
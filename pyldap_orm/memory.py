@@ -0,0 +1,1035 @@
+"""
+An in memory directory, usable as a LDAPSession backend. It doesn't need any network nor LDAP server,
+which makes tests and benchmarks deterministic.
+
+.. code-block:: python
+
+    directory = MemoryDirectory(ldif='tests/extra/opendj-sample.ldif')
+    session = LDAPSession(backend=directory)
+    session.authenticate('cn=ldapmanager,ou=Services,ou=People,dc=example,dc=com', 'password')
+
+Supported operations are bind (simple), search (base, one level and subtree scopes, with filters as defined by
+RFC 4515, except extensible matches), add, modify, delete, compare, whoami and the RFC 3062 Password Modify
+extended operation. Supported controls are server side sort, simple paged results, tree delete and permissive
+modify. Like Active Directory, values of attributes can be read by ranges (``member;range=0-*``), and attributes
+with more than ``max_values`` values are always returned by ranges. With ``ranges=False``, the directory behaves
+like OpenLDAP or OpenDJ instead: ``range=`` is an attribute option no value has, and all values are returned at once.
+
+The schema is loaded from a LDIF file, by default the bundled ``pyldap_orm/data/schema.ldif``. There is no
+access control: every bound or anonymous connection can read and write everything.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import base64
+import collections
+import datetime
+import functools
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+import uuid
+
+import ldap
+import ldap.controls
+import ldap.dn
+import ldap.schema
+import ldif
+
+from pyldap_orm import ber
+from pyldap_orm.session import LDAPBackend
+
+SCHEMA_LDIF = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'schema.ldif')
+
+OID_SERVER_SIDE_SORT = '1.2.840.113556.1.4.473'
+OID_SERVER_SIDE_SORT_RESPONSE = '1.2.840.113556.1.4.474'
+OID_PAGED_RESULTS = '1.2.840.113556.1.4.319'
+OID_TREE_DELETE = '1.2.840.113556.1.4.805'
+OID_PERMISSIVE_MODIFY = '1.2.840.113556.1.4.1413'
+OID_PASSWORD_MODIFY = '1.3.6.1.4.1.4203.1.11.1'
+OID_WHOAMI = '1.3.6.1.4.1.4203.1.11.3'
+
+SYNTAX_DN = '1.3.6.1.4.1.1466.115.121.1.12'
+SYNTAX_INTEGER = '1.3.6.1.4.1.1466.115.121.1.27'
+SYNTAX_BOOLEAN = '1.3.6.1.4.1.1466.115.121.1.7'
+
+USAGE_USER_APPLICATIONS = 0
+
+PASSWORD_SCHEMES = {
+    b'{SHA}': ('sha1', False),
+    b'{SSHA}': ('sha1', True),
+    b'{SHA256}': ('sha256', False),
+    b'{SSHA256}': ('sha256', True),
+    b'{SHA512}': ('sha512', False),
+    b'{SSHA512}': ('sha512', True),
+}
+
+
+def error(exception, desc, info=None):
+    """
+    Build a python-ldap exception, holding the same kind of dictionary than the ones raised by python-ldap.
+    """
+    details = {'desc': desc}
+    if info is not None:
+        details['info'] = info
+    return exception(details)
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_dn(dn):
+    """
+    Return a normalized form of dn: attribute types and values in lower case, without extra spaces.
+
+    :raise ldap.INVALID_DN_SYNTAX: if dn can't be parsed
+    """
+    try:
+        rdns = ldap.dn.str2dn(dn)
+    except ldap.DECODING_ERROR:
+        raise error(ldap.INVALID_DN_SYNTAX, 'Invalid DN syntax', dn) from None
+    return ldap.dn.dn2str([[(attr.lower(), ' '.join(value.lower().split()), flags)
+                            for attr, value, flags in sorted(rdn)] for rdn in rdns])
+
+
+@functools.lru_cache(maxsize=65536)
+def parent_dn(normalized_dn):
+    """
+    :param normalized_dn: a DN returned by normalize_dn()
+    :return: the normalized DN of the parent, or None for a DN with a single RDN
+    """
+    rdns = ldap.dn.str2dn(normalized_dn)
+    if len(rdns) < 2:
+        return None
+    return ldap.dn.dn2str(rdns[1:])
+
+
+def hash_password(password, scheme=b'{SSHA}'):
+    """
+    Hash a password like LDAP servers do for userPassword values.
+
+    :param password: password as bytes
+    :return: the userPassword value, like ``{SSHA}...``
+    """
+    algorithm, salted = PASSWORD_SCHEMES[scheme]
+    salt = os.urandom(8) if salted else b''
+    return scheme + base64.b64encode(hashlib.new(algorithm, password + salt).digest() + salt)
+
+
+def check_password(stored, password):
+    """
+    Compare password with a userPassword value, hashed or in clear text.
+    """
+    for scheme, (algorithm, salted) in PASSWORD_SCHEMES.items():
+        if stored[:len(scheme)].upper() == scheme:
+            digest = base64.b64decode(stored[len(scheme):])
+            size = hashlib.new(algorithm).digest_size
+            salt = digest[size:] if salted else b''
+            return hashlib.new(algorithm, password + salt).digest() == digest[:size]
+    return stored == password
+
+
+class FilterParser(object):
+    """
+    Parse a RFC 4515 search filter into nested tuples:
+
+    * ``('&', [filters])``, ``('|', [filters])`` and ``('!', filter)``
+    * ``('=', attr, value)``, ``('>=', attr, value)``, ``('<=', attr, value)``, ``('~=', attr, value)``
+    * ``('*', attr)`` for presence
+    * ``('substring', attr, initial, [any], final)`` where initial and final may be None
+
+    Values are bytes, with escapes (``\\2a``) already decoded.
+    """
+
+    def __init__(self, filterstr):
+        self._filter = filterstr
+        self._position = 0
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def parse(cls, filterstr):
+        parser = cls(filterstr.strip())
+        result = parser._parse_filter()
+        if parser._position != len(parser._filter):
+            raise parser._error()
+        return result
+
+    def _error(self):
+        return error(ldap.FILTER_ERROR, 'Bad search filter', self._filter)
+
+    def _expect(self, char):
+        if self._filter[self._position:self._position + 1] != char:
+            raise self._error()
+        self._position += 1
+
+    def _parse_filter(self):
+        self._expect('(')
+        operator = self._filter[self._position:self._position + 1]
+        if operator in ('&', '|'):
+            self._position += 1
+            filters = []
+            while self._filter[self._position:self._position + 1] == '(':
+                filters.append(self._parse_filter())
+            result = (operator, filters)
+        elif operator == '!':
+            self._position += 1
+            result = ('!', self._parse_filter())
+        else:
+            result = self._parse_item()
+        self._expect(')')
+        return result
+
+    def _parse_item(self):
+        end = self._filter.find(')', self._position)
+        if end < 0:
+            raise self._error()
+        item = self._filter[self._position:end]
+        self._position = end
+        attr, found, value = item.partition('=')
+        if not found or attr.endswith(':'):
+            # Extensible matches are not supported
+            raise self._error()
+        if attr[-1:] in ('>', '<', '~'):
+            return attr[-1] + '=', self._attribute(attr[:-1]), self._unescape(value)
+        attr = self._attribute(attr)
+        if value == '*':
+            return '*', attr
+        if '*' not in value:
+            return '=', attr, self._unescape(value)
+        parts = [self._unescape(part) for part in value.split('*')]
+        return 'substring', attr, parts[0] or None, [part for part in parts[1:-1] if part], parts[-1] or None
+
+    def _attribute(self, attr):
+        if not attr or ':' in attr:
+            raise self._error()
+        return attr.split(';')[0]
+
+    def _unescape(self, value):
+        buffer = bytearray()
+        raw = value.encode('UTF-8')
+        position = 0
+        while position < len(raw):
+            if raw[position:position + 1] == b'\\':
+                try:
+                    buffer.append(int(raw[position + 1:position + 3], 16))
+                except ValueError:
+                    raise self._error() from None
+                position += 3
+            else:
+                buffer.append(raw[position])
+                position += 1
+        return bytes(buffer)
+
+
+class MemoryDirectory(LDAPBackend):
+    """
+    An in memory directory. Entries can be loaded from a LDIF file, and are shared by all connections created
+    by connect(). ``abandoned`` counts the operations abandoned before their result was read.
+
+    :param ldif: An optional LDIF file (path or binary file object) to load
+    :param schema: LDIF file holding the subschema entry
+    :param latency: Delay, in seconds, before the result of an operation is available. It can be changed at any
+                    time with the ``latency`` attribute, to simulate a slow server.
+    :param jitter: Maximum random delay added to latency, in seconds
+    :param max_values: Maximum number of values of an attribute returned at once, None for no limit
+    :param ranges: Read values by ranges like Active Directory, False to ignore ranges and max_values
+    """
+    def __init__(self, ldif=None, schema=SCHEMA_LDIF, latency=0.0, jitter=0.0, max_values=None, ranges=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_values = max_values
+        self.ranges = ranges
+        self.abandoned = 0
+        self.running = True
+        # Incremented on each stop, connections opened before are lost
+        self._generation = 0
+        self._lock = threading.RLock()
+        # Normalized DN -> (dn, attributes)
+        self._entries = dict()
+        # Normalized DN -> set of children normalized DNs
+        self._children = collections.defaultdict(set)
+        # Normalized member DN -> set of normalized group DNs
+        self._groups = collections.defaultdict(set)
+        self._load_schema(schema)
+        if ldif is not None:
+            self.load_ldif(ldif)
+
+    def connect(self):
+        return MemoryConnection(self)
+
+    def stop(self):
+        """
+        Simulate a server shutdown: operations raise ldap.SERVER_DOWN until start() is called, and connections
+        opened before are lost.
+        """
+        self.running = False
+        self._generation += 1
+
+    def start(self):
+        self.running = True
+
+    @staticmethod
+    def _read_ldif(ldif_file):
+        if isinstance(ldif_file, str):
+            with open(ldif_file, 'rb') as fh:
+                return MemoryDirectory._read_ldif(fh)
+        records = ldif.LDIFRecordList(ldif_file)
+        records.parse()
+        return records.all_records
+
+    def _load_schema(self, schema):
+        (self._schema_dn, self._schema_entry), = self._read_ldif(schema)
+        subschema = ldap.schema.SubSchema(self._schema_entry)
+        # Lower case name or OID -> (canonical name, syntax, equality rule, usage, no user modification)
+        self._attribute_types = dict()
+        for oid in subschema.listall(ldap.schema.AttributeType):
+            definition = subschema.get_obj(ldap.schema.AttributeType, oid)
+            syntax, equality = definition.syntax, definition.equality
+            parent = definition
+            while (syntax is None or equality is None) and parent.sup:
+                parent = subschema.get_obj(ldap.schema.AttributeType, parent.sup[0])
+                syntax = syntax or parent.syntax
+                equality = equality or parent.equality
+            names = definition.names or (oid,)
+            description = (names[0], syntax, equality or '', definition.usage, definition.no_user_mod)
+            for name in names + (oid,):
+                self._attribute_types[name.lower()] = description
+
+    def load_ldif(self, ldif_file):
+        """
+        Add entries from a LDIF file. Operational attributes, like entryUUID or createTimestamp, are kept.
+
+        :param ldif_file: path or binary file object
+        """
+        for dn, attributes in self._read_ldif(ldif_file):
+            self.add_entry(dn, attributes)
+
+    def attribute_type(self, attr):
+        """
+        :return: a tuple (canonical name, syntax, equality rule, usage, no user modification)
+        :raise ldap.UNDEFINED_TYPE: if the attribute type is not defined in the schema
+        """
+        try:
+            return self._attribute_types[attr.split(';')[0].lower()]
+        except KeyError:
+            raise error(ldap.UNDEFINED_TYPE, 'Undefined attribute type', attr) from None
+
+    def add_entry(self, dn, attributes):
+        """
+        Add an entry without any check but the schema ones and the parent existence.
+
+        :param dn: DN of the new entry
+        :param attributes: a dictionary where values are lists of bytes
+        """
+        normalized = normalize_dn(dn)
+        stored = dict()
+        for attr, values in attributes.items():
+            if values:
+                stored.setdefault(self.attribute_type(attr)[0], []).extend(values)
+        with self._lock:
+            if normalized in self._entries:
+                raise error(ldap.ALREADY_EXISTS, 'Already exists', dn)
+            parent = parent_dn(normalized)
+            if parent is not None and parent not in self._entries and self._has_ancestor(parent):
+                raise error(ldap.NO_SUCH_OBJECT, 'No such object', parent)
+            self._entries[normalized] = (dn, stored)
+            if parent is not None:
+                self._children[parent].add(normalized)
+            self._index_members(normalized, stored, self._groups_add)
+
+    def _has_ancestor(self, normalized):
+        """
+        Return True if an entry exists above normalized. A DN without existing ancestor is a new naming context.
+        """
+        while normalized is not None:
+            if normalized in self._entries:
+                return True
+            normalized = parent_dn(normalized)
+        return False
+
+    def _groups_add(self, member, group):
+        self._groups[member].add(group)
+
+    def _groups_discard(self, member, group):
+        self._groups[member].discard(group)
+
+    def _index_members(self, normalized, attributes, operation):
+        for attr in ('member', 'uniqueMember'):
+            for value in attributes.get(attr, []):
+                try:
+                    operation(normalize_dn(value.decode('UTF-8').split('#')[0]), normalized)
+                except ldap.LDAPError:
+                    pass
+
+    def naming_contexts(self):
+        """
+        :return: DNs of entries without parent
+        """
+        with self._lock:
+            return [dn for normalized, (dn, _) in self._entries.items()
+                    if not self._has_ancestor(parent_dn(normalized))]
+
+    def root_dse(self):
+        return {
+            'namingContexts': [dn.encode('UTF-8') for dn in self.naming_contexts()],
+            'subschemaSubentry': [self._schema_dn.encode('UTF-8')],
+            'supportedControl': [oid.encode('UTF-8') for oid in (OID_SERVER_SIDE_SORT, OID_PAGED_RESULTS,
+                                                                   OID_TREE_DELETE, OID_PERMISSIVE_MODIFY)],
+            'supportedExtension': [oid.encode('UTF-8') for oid in (OID_PASSWORD_MODIFY, OID_WHOAMI)],
+            'supportedLDAPVersion': [b'3'],
+            'vendorName': [b'pyldap_orm'],
+        }
+
+    def matching_key(self, attr, value):
+        """
+        Return the value used to compare values of attr, regarding its equality matching rule.
+        """
+        _, syntax, equality, _, _ = self.attribute_type(attr)
+        equality = equality.lower()
+        if syntax == SYNTAX_INTEGER or equality.startswith('integer'):
+            try:
+                return int(value)
+            except ValueError:
+                return value
+        if syntax == SYNTAX_DN or equality == 'distinguishednamematch':
+            try:
+                return normalize_dn(value.decode('UTF-8'))
+            except (ldap.LDAPError, UnicodeDecodeError):
+                return value
+        if syntax == SYNTAX_BOOLEAN:
+            return value.upper()
+        if 'octetstring' in equality or 'exact' in equality:
+            return value
+        if equality.startswith('telephonenumber'):
+            return value.replace(b' ', b'').replace(b'-', b'').lower()
+        try:
+            return ' '.join(value.decode('UTF-8').lower().split())
+        except UnicodeDecodeError:
+            return value
+
+    def values(self, normalized, attr):
+        """
+        Return values of attr for the entry normalized, including operational attributes computed by the
+        directory.
+        """
+        dn, attributes = self._entries[normalized]
+        name = self.attribute_type(attr)[0]
+        if name == 'entryDN':
+            return [dn.encode('UTF-8')]
+        if name == 'hasSubordinates':
+            return [b'TRUE' if self._children.get(normalized) else b'FALSE']
+        if name == 'numSubordinates':
+            return [str(len(self._children.get(normalized, ()))).encode('UTF-8')]
+        if name == 'subschemaSubentry':
+            return [self._schema_dn.encode('UTF-8')]
+        if name in ('isMemberOf', 'memberOf') and name not in attributes:
+            return [self._entries[group][0].encode('UTF-8') for group in sorted(self._groups.get(normalized, ()))
+                    if group in self._entries]
+        return attributes.get(name, [])
+
+    def operational_attributes(self, normalized):
+        names = ['entryDN', 'hasSubordinates', 'numSubordinates', 'subschemaSubentry']
+        if self._groups.get(normalized):
+            names.append('isMemberOf')
+        dn, attributes = self._entries[normalized]
+        names.extend(attr for attr in attributes if self.attribute_type(attr)[3] != USAGE_USER_APPLICATIONS)
+        return names
+
+    def match(self, normalized, ldap_filter):
+        """
+        Evaluate a filter parsed by FilterParser against an entry.
+        """
+        operator = ldap_filter[0]
+        if operator == '&':
+            return all(self.match(normalized, sub_filter) for sub_filter in ldap_filter[1])
+        if operator == '|':
+            return any(self.match(normalized, sub_filter) for sub_filter in ldap_filter[1])
+        if operator == '!':
+            return not self.match(normalized, ldap_filter[1])
+        attr = ldap_filter[1]
+        try:
+            values = self.values(normalized, attr)
+        except ldap.UNDEFINED_TYPE:
+            return False
+        if operator == '*':
+            return len(values) > 0
+        if operator == 'substring':
+            _, _, initial, middle, final = ldap_filter
+            return any(self._match_substring(attr, value, initial, middle, final) for value in values)
+        assertion = self.matching_key(attr, ldap_filter[2])
+        for value in values:
+            key = self.matching_key(attr, value)
+            try:
+                if operator in ('=', '~=') and key == assertion:
+                    return True
+                if operator == '>=' and key >= assertion:
+                    return True
+                if operator == '<=' and key <= assertion:
+                    return True
+            except TypeError:
+                continue
+        return False
+
+    def _match_substring(self, attr, value, initial, middle, final):
+        value = self.matching_key(attr, value)
+        parts = [self.matching_key(attr, part) if part is not None else None for part in [initial] + middle + [final]]
+        if not all(isinstance(part, type(value)) for part in parts if part is not None):
+            return False
+        initial, middle, final = parts[0], parts[1:-1], parts[-1]
+        position = 0
+        if initial is not None:
+            if not value.startswith(initial):
+                return False
+            position = len(initial)
+        for part in middle:
+            position = value.find(part, position)
+            if position < 0:
+                return False
+            position += len(part)
+        if final is not None:
+            return len(value) - len(final) >= position and value.endswith(final)
+        return True
+
+    def scope(self, base, scope):
+        """
+        :return: normalized DNs of entries in scope, parents before children
+        """
+        normalized = normalize_dn(base) if base else ''
+        if normalized not in self._entries:
+            raise error(ldap.NO_SUCH_OBJECT, 'No such object', base)
+        if scope == ldap.SCOPE_BASE:
+            return [normalized]
+        if scope == ldap.SCOPE_ONELEVEL:
+            return sorted(self._children.get(normalized, ()))
+        result = []
+        stack = [normalized]
+        while stack:
+            current = stack.pop()
+            result.append(current)
+            stack.extend(sorted(self._children.get(current, ()), reverse=True))
+        return result
+
+    def select(self, normalized, attrlist, attrsonly=0):
+        """
+        Return the (dn, attributes) tuple of an entry, with only the requested attributes.
+        """
+        dn, attributes = self._entries[normalized]
+        requested = set(attrlist or ['*'])
+        names = []
+        if '*' in requested or not attrlist:
+            names.extend(attr for attr in attributes
+                         if self.attribute_type(attr)[3] == USAGE_USER_APPLICATIONS)
+        if '+' in requested:
+            names.extend(self.operational_attributes(normalized))
+        # Name -> (first, last) index of requested ranges, last is None for '*'
+        ranges = dict()
+        for attr in requested - {'*', '+', '1.1'}:
+            attr, _, option = attr.partition(';')
+            try:
+                name = self.attribute_type(attr)[0]
+            except ldap.UNDEFINED_TYPE:
+                continue
+            if option and not self.ranges:
+                # No value has the option
+                continue
+            names.append(name)
+            if option.lower().startswith('range='):
+                first, _, last = option[6:].partition('-')
+                ranges[name] = (int(first), None if last == '*' else int(last))
+        selected = dict()
+        for name in names:
+            values = self.values(normalized, name)
+            if not values or name in selected:
+                continue
+            if name in ranges or (self.ranges and self.max_values and len(values) > self.max_values):
+                first, last = ranges.get(name, (0, None))
+                last = len(values) - 1 if last is None else min(last, len(values) - 1)
+                if self.max_values:
+                    last = min(last, first + self.max_values - 1)
+                key = '{};range={}-{}'.format(name, first, '*' if last >= len(values) - 1 else last)
+                selected[key] = [] if attrsonly else list(values[first:last + 1])
+            else:
+                selected[name] = [] if attrsonly else list(values)
+        return dn, selected
+
+    def sort(self, normalized_dns, sort_keys):
+        """
+        Sort entries using RFC 2891 sort keys, entries without the attribute are returned last.
+        """
+        for attr, _, reverse_order in reversed(sort_keys):
+            def key(normalized):
+                values = [self.matching_key(attr, value) for value in self.values(normalized, attr)]
+                if not values:
+                    return (1, '')
+                return (0, max(values) if reverse_order else min(values))
+            present = [normalized for normalized in normalized_dns if key(normalized)[0] == 0]
+            missing = [normalized for normalized in normalized_dns if key(normalized)[0] == 1]
+            normalized_dns = sorted(present, key=key, reverse=reverse_order) + missing
+        return normalized_dns
+
+    def entry(self, dn):
+        """
+        :return: a tuple (normalized dn, dn, attributes) of an existing entry
+        :raise ldap.NO_SUCH_OBJECT: if the entry doesn't exist
+        """
+        normalized = normalize_dn(dn)
+        try:
+            stored_dn, attributes = self._entries[normalized]
+        except KeyError:
+            raise error(ldap.NO_SUCH_OBJECT, 'No such object', dn) from None
+        return normalized, stored_dn, attributes
+
+    def delete_subtree(self, dn):
+        """
+        Delete an entry and all its descendants.
+        """
+        with self._lock:
+            normalized = self.entry(dn)[0]
+            for child in list(self._children.get(normalized, ())):
+                self.delete_subtree(child)
+            self.delete_entry(normalized)
+
+    def delete_entry(self, dn):
+        with self._lock:
+            normalized, _, attributes = self.entry(dn)
+            if self._children.get(normalized):
+                raise error(ldap.NOT_ALLOWED_ON_NONLEAF, 'Operation not allowed on non-leaf', dn)
+            del self._entries[normalized]
+            self._children.pop(normalized, None)
+            parent = parent_dn(normalized)
+            if parent is not None:
+                self._children[parent].discard(normalized)
+            self._index_members(normalized, attributes, self._groups_discard)
+
+    def modify_entry(self, dn, modlist, modifiers_name=None, permissive=False):
+        """
+        Apply a modlist, as built by ``ldap.modlist.modifyModlist()``, to an entry. The modification is atomic.
+        When permissive is True, adding an existing value or deleting a missing value is not an error.
+        """
+        with self._lock:
+            normalized, _, attributes = self.entry(dn)
+            updated = {attr: list(values) for attr, values in attributes.items()}
+            for operation, attr, values in modlist:
+                name, _, _, _, no_user_mod = self.attribute_type(attr)
+                if no_user_mod:
+                    raise error(ldap.CONSTRAINT_VIOLATION, 'Constraint violation', attr)
+                values = check_values(values)
+                current = updated.get(name, [])
+                keys = [self.matching_key(name, value) for value in current]
+                if operation == ldap.MOD_ADD:
+                    keys = set(keys)
+                    added = []
+                    for value in values:
+                        key = self.matching_key(name, value)
+                        if key in keys:
+                            if permissive:
+                                continue
+                            raise error(ldap.TYPE_OR_VALUE_EXISTS, 'Type or value exists', attr)
+                        keys.add(key)
+                        added.append(value)
+                    updated[name] = current + added
+                elif operation == ldap.MOD_DELETE:
+                    if not current:
+                        if permissive:
+                            continue
+                        raise error(ldap.NO_SUCH_ATTRIBUTE, 'No such attribute', attr)
+                    if not values:
+                        updated.pop(name)
+                        continue
+                    deleted = set()
+                    known = set(keys)
+                    for value in values:
+                        key = self.matching_key(name, value)
+                        if key not in known:
+                            if permissive:
+                                continue
+                            raise error(ldap.NO_SUCH_ATTRIBUTE, 'No such attribute', attr)
+                        deleted.add(key)
+                    updated[name] = [value for value, key in zip(current, keys) if key not in deleted]
+                elif operation == ldap.MOD_REPLACE:
+                    updated[name] = values
+                else:
+                    raise error(ldap.PROTOCOL_ERROR, 'Protocol error', 'Unsupported modification')
+                if not updated[name]:
+                    updated.pop(name)
+            updated['modifyTimestamp'] = [generalized_time()]
+            if modifiers_name:
+                updated['modifiersName'] = [modifiers_name.encode('UTF-8')]
+            self._index_members(normalized, attributes, self._groups_discard)
+            self._entries[normalized] = (self._entries[normalized][0], updated)
+            self._index_members(normalized, updated, self._groups_add)
+
+
+def check_values(values):
+    """
+    Values must be a list of bytes, like python-ldap requires.
+    """
+    if values is None:
+        return []
+    if isinstance(values, bytes):
+        return [values]
+    for value in values:
+        if not isinstance(value, bytes):
+            raise TypeError("Attribute values must be bytes, found {!r}".format(value))
+    return list(values)
+
+
+def generalized_time():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%SZ').encode('UTF-8')
+
+
+class _Result(object):
+    """
+    Outcome of an operation, waiting to be returned by MemoryConnection.result4()
+    """
+    __slots__ = ('rtype', 'data', 'controls', 'name', 'value', 'error', 'ready')
+
+    def __init__(self, rtype, data=None, controls=None, name=None, value=None, error=None):
+        self.rtype = rtype
+        self.data = data or []
+        self.controls = controls or []
+        self.name = name
+        self.value = value
+        self.error = error
+        # time.monotonic() value from which the result is available
+        self.ready = 0
+
+
+class MemoryConnection(object):
+    """
+    A connection to a MemoryDirectory, implementing the subset of ``ldap.ldapobject.LDAPObject`` used by
+    pyldap_orm. Operations are executed when they are sent, and their result is kept until one of the
+    result methods is called. Results are available once the directory latency elapsed.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._bound = ''
+        self._msgids = itertools.count(1)
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = directory._generation
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _check(self):
+        if not self._directory.running or self._generation != self._directory._generation:
+            raise error(ldap.SERVER_DOWN, "Can't contact LDAP server")
+
+    def _send(self, rtype, operation, *args):
+        self._check()
+        msgid = next(self._msgids)
+        try:
+            result = operation(*args)
+        except ldap.LDAPError as e:
+            result = _Result(rtype, error=e)
+        if self._directory.latency or self._directory.jitter:
+            result.ready = time.monotonic() + self._directory.latency + random.uniform(0, self._directory.jitter)
+        with self._lock:
+            self._results[msgid] = result
+        return msgid
+
+    def result4(self, msgid=ldap.RES_ANY, all=1, timeout=None, add_ctrls=0, add_intermediates=0, add_extop=0,
+                resp_ctrl_classes=None):
+        self._check()
+        with self._lock:
+            if msgid == ldap.RES_ANY:
+                if not self._results:
+                    raise error(ldap.TIMEOUT, 'Timed out')
+                msgid = min(self._results, key=lambda key: self._results[key].ready)
+            try:
+                result = self._results[msgid]
+            except KeyError:
+                raise error(ldap.NO_SUCH_OPERATION, 'No such operation', msgid) from None
+        delay = result.ready - time.monotonic()
+        if delay > 0:
+            # Same behavior than python-ldap: a poll returns None values, a timeout raises ldap.TIMEOUT
+            if timeout == 0:
+                return None, None, None, None, None, None
+            if timeout is not None and 0 < timeout < delay:
+                time.sleep(timeout)
+                raise error(ldap.TIMEOUT, 'Timed out')
+            time.sleep(delay)
+        with self._lock:
+            if self._results.get(msgid) is not result:
+                # Abandoned while waiting
+                raise error(ldap.NO_SUCH_OPERATION, 'No such operation', msgid)
+            if result.error is not None:
+                del self._results[msgid]
+                raise result.error
+            if result.rtype == ldap.RES_SEARCH_RESULT and not all and result.data:
+                # Return entries one by one
+                return ldap.RES_SEARCH_ENTRY, [result.data.pop(0)], msgid, [], None, None
+            del self._results[msgid]
+        controls = ldap.controls.DecodeControlTuples(result.controls, resp_ctrl_classes)
+        return result.rtype, result.data, msgid, controls, result.name, result.value
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None, resp_ctrl_classes=None):
+        return self.result4(msgid, all, timeout, resp_ctrl_classes=resp_ctrl_classes)[:4]
+
+    def result2(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        return self.result4(msgid, all, timeout)[:3]
+
+    def result(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        return self.result4(msgid, all, timeout)[:2]
+
+    def abandon_ext(self, msgid, serverctrls=None, clientctrls=None):
+        with self._lock:
+            if self._results.pop(msgid, None) is not None:
+                self._directory.abandoned += 1
+
+    def abandon(self, msgid):
+        self.abandon_ext(msgid)
+
+    # Bind operations
+
+    def _bind(self, who, cred):
+        if not who:
+            self._bound = ''
+            return _Result(ldap.RES_BIND)
+        cred = cred.encode('UTF-8') if isinstance(cred, str) else cred or b''
+        try:
+            _, dn, attributes = self._directory.entry(who)
+        except ldap.NO_SUCH_OBJECT:
+            raise error(ldap.INVALID_CREDENTIALS, 'Invalid credentials') from None
+        if not cred or not any(check_password(value, cred) for value in attributes.get('userPassword', [])):
+            raise error(ldap.INVALID_CREDENTIALS, 'Invalid credentials')
+        self._bound = dn
+        return _Result(ldap.RES_BIND)
+
+    def simple_bind(self, who=None, cred=None, serverctrls=None, clientctrls=None):
+        return self._send(ldap.RES_BIND, self._bind, who, cred)
+
+    def simple_bind_s(self, who=None, cred=None, serverctrls=None, clientctrls=None):
+        return self.result3(self.simple_bind(who, cred, serverctrls, clientctrls))
+
+    def sasl_bind_s(self, *args, **kwargs):
+        raise error(ldap.AUTH_METHOD_NOT_SUPPORTED, 'Auth method not supported', 'SASL is not supported')
+
+    def sasl_interactive_bind_s(self, *args, **kwargs):
+        self.sasl_bind_s()
+
+    def start_tls_s(self):
+        pass
+
+    def unbind_ext(self, serverctrls=None, clientctrls=None):
+        self._bound = ''
+        with self._lock:
+            self._results.clear()
+
+    def unbind_ext_s(self, serverctrls=None, clientctrls=None):
+        self.unbind_ext()
+
+    unbind = unbind_s = unbind_ext_s
+
+    def whoami_s(self, serverctrls=None, clientctrls=None):
+        self._check()
+        return 'dn:{}'.format(self._bound) if self._bound else ''
+
+    # Search operations
+
+    def _search(self, base, scope, filterstr, attrlist, attrsonly, serverctrls, sizelimit):
+        directory = self._directory
+        ldap_filter = FilterParser.parse(filterstr or '(objectClass=*)')
+        sort_keys = None
+        paged = None
+        for control in serverctrls or []:
+            if control.controlType == OID_SERVER_SIDE_SORT:
+                sort_keys = ber.decode_sort_key_list(control.encodeControlValue())
+            elif control.controlType == OID_PAGED_RESULTS:
+                paged = ber.decode_paged_results(control.encodeControlValue())
+            elif control.criticality:
+                raise error(ldap.UNAVAILABLE_CRITICAL_EXTENSION, 'Critical extension is unavailable',
+                            control.controlType)
+
+        with directory._lock:
+            if scope == ldap.SCOPE_BASE and not base:
+                return _Result(ldap.RES_SEARCH_RESULT, [('', self._select_special(directory.root_dse(), attrlist))])
+            if scope == ldap.SCOPE_BASE and normalize_dn(base) == normalize_dn(directory._schema_dn):
+                return _Result(ldap.RES_SEARCH_RESULT,
+                               [(directory._schema_dn, self._select_special(directory._schema_entry, attrlist))])
+            matches = [normalized for normalized in directory.scope(base, scope)
+                       if directory.match(normalized, ldap_filter)]
+            controls = []
+            if sort_keys is not None:
+                matches = directory.sort(matches, sort_keys)
+                controls.append((OID_SERVER_SIDE_SORT_RESPONSE, False, ber.encode_sort_result(0)))
+            if paged is not None:
+                size, cookie = paged
+                offset = int(cookie) if cookie else 0
+                end = offset + size if size else offset
+                next_cookie = str(end).encode('UTF-8') if size and end < len(matches) else b''
+                matches = matches[offset:end]
+                controls.append((OID_PAGED_RESULTS, False, ber.encode_paged_results(len(matches), next_cookie)))
+            if sizelimit and len(matches) > sizelimit:
+                raise error(ldap.SIZELIMIT_EXCEEDED, 'Size limit exceeded')
+            entries = [directory.select(normalized, attrlist, attrsonly) for normalized in matches]
+        return _Result(ldap.RES_SEARCH_RESULT, entries, controls)
+
+    def _select_special(self, attributes, attrlist):
+        """
+        Select attributes of the root DSE or the subschema entry, where every attribute is operational.
+        """
+        requested = [attr.lower() for attr in attrlist or []]
+        return {attr: list(values) for attr, values in attributes.items()
+                if '+' in requested or attr.lower() in requested or (attr.lower() == 'objectclass' and
+                                                                      ('*' in requested or not requested))}
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0, serverctrls=None,
+                   clientctrls=None, timeout=-1, sizelimit=0):
+        return self._send(ldap.RES_SEARCH_RESULT, self._search, base, scope, filterstr, attrlist, attrsonly,
+                          serverctrls, sizelimit)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0, serverctrls=None,
+                     clientctrls=None, timeout=-1, sizelimit=0):
+        msgid = self.search_ext(base, scope, filterstr, attrlist, attrsonly, serverctrls, clientctrls, timeout,
+                                sizelimit)
+        return self.result(msgid)[1]
+
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.search_ext(base, scope, filterstr, attrlist, attrsonly)
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.search_ext_s(base, scope, filterstr, attrlist, attrsonly)
+
+    # Update operations
+
+    def _add(self, dn, modlist):
+        attributes = dict()
+        for attr, values in modlist:
+            if self._directory.attribute_type(attr)[4]:
+                raise error(ldap.CONSTRAINT_VIOLATION, 'Constraint violation', attr)
+            attributes[attr] = check_values(values)
+        if not any(self._directory.attribute_type(attr)[0] == 'objectClass' for attr in attributes):
+            raise error(ldap.OBJECT_CLASS_VIOLATION, 'Object class violation', 'no objectClass attribute')
+        attributes['createTimestamp'] = [generalized_time()]
+        attributes['entryUUID'] = [str(uuid.uuid4()).encode('UTF-8')]
+        if self._bound:
+            attributes['creatorsName'] = [self._bound.encode('UTF-8')]
+        self._directory.add_entry(dn, attributes)
+        return _Result(ldap.RES_ADD)
+
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._send(ldap.RES_ADD, self._add, dn, modlist)
+
+    def add_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self.result3(self.add_ext(dn, modlist, serverctrls, clientctrls))
+
+    def add(self, dn, modlist):
+        return self.add_ext(dn, modlist)
+
+    def add_s(self, dn, modlist):
+        return self.add_ext_s(dn, modlist)
+
+    def _modify(self, dn, modlist, serverctrls):
+        permissive = False
+        for control in serverctrls or []:
+            if control.controlType == OID_PERMISSIVE_MODIFY:
+                permissive = True
+            elif control.criticality:
+                raise error(ldap.UNAVAILABLE_CRITICAL_EXTENSION, 'Critical extension is unavailable',
+                            control.controlType)
+        self._directory.modify_entry(dn, modlist, self._bound, permissive)
+        return _Result(ldap.RES_MODIFY)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self._send(ldap.RES_MODIFY, self._modify, dn, modlist, serverctrls)
+
+    def modify_ext_s(self, dn, modlist, serverctrls=None, clientctrls=None):
+        return self.result3(self.modify_ext(dn, modlist, serverctrls, clientctrls))
+
+    def modify(self, dn, modlist):
+        return self.modify_ext(dn, modlist)
+
+    def modify_s(self, dn, modlist):
+        return self.modify_ext_s(dn, modlist)
+
+    def _delete(self, dn, serverctrls):
+        tree = False
+        for control in serverctrls or []:
+            if control.controlType == OID_TREE_DELETE:
+                tree = True
+            elif control.criticality:
+                raise error(ldap.UNAVAILABLE_CRITICAL_EXTENSION, 'Critical extension is unavailable',
+                            control.controlType)
+        if tree:
+            self._directory.delete_subtree(dn)
+        else:
+            self._directory.delete_entry(dn)
+        return _Result(ldap.RES_DELETE)
+
+    def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+        return self._send(ldap.RES_DELETE, self._delete, dn, serverctrls)
+
+    def delete_ext_s(self, dn, serverctrls=None, clientctrls=None):
+        return self.result3(self.delete_ext(dn, serverctrls, clientctrls))
+
+    def delete(self, dn):
+        return self.delete_ext(dn)
+
+    def delete_s(self, dn):
+        return self.delete_ext_s(dn)
+
+    # Compare operation
+
+    def _compare(self, dn, attr, value):
+        directory = self._directory
+        with directory._lock:
+            normalized, _, _ = directory.entry(dn)
+            name = directory.attribute_type(attr)[0]
+            if not isinstance(value, bytes):
+                value = value.encode('UTF-8')
+            key = directory.matching_key(name, value)
+            found = any(directory.matching_key(name, current) == key for current in directory.values(normalized, name))
+        raise error(ldap.COMPARE_TRUE if found else ldap.COMPARE_FALSE, 'Compare True' if found else 'Compare False')
+
+    def compare_ext(self, dn, attr, value, serverctrls=None, clientctrls=None):
+        return self._send(ldap.RES_COMPARE, self._compare, dn, attr, value)
+
+    def compare_ext_s(self, dn, attr, value, serverctrls=None, clientctrls=None):
+        try:
+            self.result3(self.compare_ext(dn, attr, value, serverctrls, clientctrls))
+        except ldap.COMPARE_TRUE:
+            return True
+        except ldap.COMPARE_FALSE:
+            return False
+        raise error(ldap.PROTOCOL_ERROR, 'Protocol error', 'Compare operation returned an unexpected result')
+
+    def compare_s(self, dn, attr, value):
+        return self.compare_ext_s(dn, attr, value)
+
+    # Extended operations
+
+    def _extop(self, request):
+        if request.requestName == OID_WHOAMI:
+            return _Result(ldap.RES_EXTENDED, value=self.whoami_s().encode('UTF-8'))
+        if request.requestName != OID_PASSWORD_MODIFY:
+            raise error(ldap.PROTOCOL_ERROR, 'Protocol error', 'Unsupported extended operation')
+        identity, current, new = ber.decode_passwd_modify_request(request.encodedRequestValue())
+        identity = identity.decode('UTF-8') if identity else self._bound
+        if not identity:
+            raise error(ldap.UNWILLING_TO_PERFORM, 'Server is unwilling to perform', 'Anonymous password change')
+        _, dn, attributes = self._directory.entry(identity)
+        if current is not None and not any(check_password(value, current)
+                                           for value in attributes.get('userPassword', [])):
+            raise error(ldap.UNWILLING_TO_PERFORM, 'Server is unwilling to perform', 'Invalid old password')
+        generated = None
+        if new is None:
+            generated = base64.b64encode(os.urandom(9))
+            new = generated
+        self._directory.modify_entry(dn, [(ldap.MOD_REPLACE, 'userPassword', [hash_password(new)])], self._bound)
+        value = ber.encode_passwd_modify_response(generated) if generated is not None else None
+        return _Result(ldap.RES_EXTENDED, value=value)
+
+    def extop(self, extreq, serverctrls=None, clientctrls=None):
+        return self._send(ldap.RES_EXTENDED, self._extop, extreq)
+
+    def extop_s(self, extreq, serverctrls=None, clientctrls=None, extop_resp_class=None):
+        _, _, _, _, name, value = self.result4(self.extop(extreq, serverctrls, clientctrls), add_extop=1)
+        if extop_resp_class is not None:
+            return extop_resp_class(name, value)
+        return name, value
@@ -2,8 +2,14 @@
 # Copyright: Bruno Bonfils
 # License: Apache License version2
 
-from pyldap_orm.__init__ import LDAPObject, LDAPModelList
-from pyldap_orm.controls import PasswordModify
+import collections
+import contextvars
+import threading
+
+import ldap
+
+from pyldap_orm.core import LDAPObject, LDAPModelList
+from pyldap_orm.dn import DN
 
 """
 Templates of current LDAP objects like user(s), group(s).
@@ -13,21 +19,41 @@ You need to create your own class that inherits of one theses.
 You must set:
 
 * ``required_attribues`` with an array of required attributes, like ``['uid', 'cn']``
-* ``base`` is the root base dn to find instances of the object, like ``ou=People,dc=example,dc=com``
+* ``base`` is the root base dn to find instances of the object, like ``ou=People,dc=example,dc=com``, or a list
+  of base DNs, searched concurrently
 
 """
 
 
+class PasswordChangeResult(collections.namedtuple('PasswordChangeResult', ['user', 'generated', 'error'])):
+    """
+    Outcome of a password change performed by ``LDAPModelUsers.change_passwords()``.
+
+    * ``user`` is the user (or DN) given in the request
+    * ``generated`` is the password generated by the server, if no new password was requested
+    * ``error`` is the ``ldap.LDAPError`` raised by the operation, or None
+    """
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.error is None
+
+
 class LDAPModelUser(LDAPObject):
     """
     This is a basic template to manage a user.
     """
+    __slots__ = ()
     required_attributes = ['cn', 'sn', 'uid']
     required_objectclasses = ['inetOrgPerson']
     membership_attribute = 'memberOf'
+    interned_attributes = ['objectClass', 'memberOf', 'isMemberOf', 'loginShell']
 
     def change_password(self, new, current=None):
-        self._session.server.extop_s(PasswordModify(self._dn, new, current))
+        from pyldap_orm.controls import PasswordModify
+
+        self._session.extop(PasswordModify(self._dn, new, current), model=type(self))
 
 
 class LDAPModelGroup(LDAPObject):
@@ -35,10 +61,95 @@ class LDAPModelGroup(LDAPObject):
     LDAPModelGroup is a template to represent a group (of users). By default, the cn attribute is required and also
     used as name attribute.
     """
+    __slots__ = ()
     required_attributes = ['cn']
     required_objectclasses = ['groupOfNames']
     name_attribute = 'cn'
     member_attribute = 'member'
+    interned_attributes = ['objectClass', 'member', 'uniqueMember']
+
+    def add_members(self, members):
+        """
+        Add members with a single modification adding only the given values: the current members are neither read
+        nor sent, so the cost doesn't depend on the size of the group.
+
+        When the server supports the Permissive Modify control, existing members are ignored. Otherwise, the
+        server refuses the whole modification if a member already belongs to the group.
+
+        :param members: an iterable of DNs, as strings, or of LDAPObject instances
+        """
+        self._modify_members(ldap.MOD_ADD, members)
+
+    def remove_members(self, members):
+        """
+        Remove members with a single modification deleting only the given values.
+
+        When the server supports the Permissive Modify control, unknown members are ignored. Otherwise, the server
+        refuses the whole modification if a DN isn't a member of the group.
+
+        :param members: an iterable of DNs, as strings, or of LDAPObject instances
+        """
+        self._modify_members(ldap.MOD_DELETE, members)
+
+    def is_member(self, member):
+        """
+        Check if a DN is a member of the group with a Compare operation: only the outcome is returned by the server,
+        whatever the size of the group.
+
+        :param member: a DN, as a string, or a LDAPObject instance
+        :return: True if member belongs to the group
+        """
+        return self.has_value(self.member_attribute, str(member.dn if isinstance(member, LDAPObject) else member))
+
+    def are_members(self, members):
+        """
+        Check several DNs at once, with asynchronous Compare operations.
+
+        :param members: an iterable of DNs, as strings, or of LDAPObject instances
+        :return: a list of booleans, in the order of members
+        """
+        return self.has_values(self.member_attribute,
+                               [str(member.dn if isinstance(member, LDAPObject) else member) for member in members])
+
+    def iter_members(self):
+        """
+        Read the members from the server by ranges, without loading the group.
+
+        :return: a generator of DN instances
+        """
+        for value in self._session.ranged_values(self._dn, self.member_attribute, model=type(self)):
+            yield DN(value.decode('UTF-8'))
+
+    def _modify_members(self, operation, members):
+        from pyldap_orm.controls import PermissiveModify
+
+        dns = [DN(member.dn if isinstance(member, LDAPObject) else member) for member in members]
+        if not dns:
+            return
+        serverctrls = None
+        if self._session.supports_control(PermissiveModify.controlType):
+            serverctrls = [PermissiveModify()]
+        self._session.modify(self._dn, [(operation, self.member_attribute, [str(dn).encode('UTF-8') for dn in dns])],
+                             model=type(self), serverctrls=serverctrls)
+
+        # Keep loaded values in sync, so save() doesn't send the modification again
+        name = self.member_attribute
+        if self._initial_attributes is None or name not in self._attributes:
+            return
+        initial = self._initial_attributes.get(name, [])
+        if operation == ldap.MOD_ADD:
+            known = set(self._attributes[name])
+            added = []
+            for dn in dns:
+                if dn not in known:
+                    known.add(dn)
+                    added.append(dn)
+            self._attributes[name] = self._attributes[name] + added
+            self._initial_attributes[name] = initial + [str(dn).encode('UTF-8') for dn in added]
+        else:
+            removed = set(dns)
+            self._attributes[name] = [dn for dn in self._attributes[name] if DN(dn) not in removed]
+            self._initial_attributes[name] = [value for value in initial if DN(value.decode('UTF-8')) not in removed]
 
 
 class LDAPModelUsers(LDAPModelList):
@@ -64,7 +175,8 @@ class LDAPModelUsers(LDAPModelList):
         entries = self._session.search(base=self.children.base,
                                        ldap_filter="(&{}({}={}))".format(self.children.filter(),
                                                                          self.children.membership_attribute,
-                                                                         dn))
+                                                                         dn),
+                                       model=self.children)
 
         return self._parse_multiple(entries)
 
@@ -82,3 +194,60 @@ class LDAPModelUsers(LDAPModelList):
                                                  attributes=[group_cls.name_attribute])
         return self.by_dn_membership(group.dn)
 
+    def change_passwords(self, changes, window=64, sessions=None):
+        """
+        Change the password of many users, using asynchronous RFC 3062 Password Modify extended operations.
+        At most ``window`` operations are waiting for a response on each connection.
+
+        If sessions is given, operations are spread on their connections in a round robin way instead of using
+        the current session, and sent by one thread per session. Sessions must be authenticated with an identity
+        allowed to change passwords. When the deadline of the current thread expires, pending operations are
+        abandoned and ``ldap.TIMEOUT`` is raised.
+
+        :param changes: An iterable of tuples (user, new, current), where user is a LDAPModelUser instance or a DN,
+                        new is the new password (None to request the server to generate one) and current the optional
+                        current password. current can be omitted.
+        :param window: Maximum number of pending operations per connection
+        :param sessions: An optional list of LDAPSession used to send the operations
+        :return: A list of PasswordChangeResult, in the same order than changes
+        :rtype: list
+        """
+        from pyldap_orm.controls import PasswordModify, PasswordModifyResponse
+
+        sessions = sessions or [self._session]
+        changes = [(tuple(change) + (None,))[:3] for change in changes]
+        responses = [None] * len(changes)
+        errors = []
+
+        def send(index):
+            positions = range(index, len(changes), len(sessions))
+            requests = (PasswordModify(getattr(changes[position][0], 'dn', changes[position][0]),
+                                       *changes[position][1:]) for position in positions)
+            try:
+                for position, response in zip(positions,
+                                              sessions[index].extop_pipeline(requests, window, self.children)):
+                    responses[position] = response
+            except Exception as e:
+                errors.append(e)
+
+        if len(sessions) == 1:
+            send(0)
+        else:
+            # One thread per session, which runs with the deadline of the current thread
+            threads = [threading.Thread(target=contextvars.copy_context().run, args=(send, index))
+                       for index in range(len(sessions))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+        results = []
+        for (user, _, _), response in zip(changes, responses):
+            if isinstance(response, ldap.LDAPError):
+                results.append(PasswordChangeResult(user, None, response))
+            else:
+                results.append(PasswordChangeResult(user, PasswordModifyResponse(*response).responseValue, None))
+        return results
+
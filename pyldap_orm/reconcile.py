@@ -0,0 +1,217 @@
+"""
+Reconciliation of the entries of a model with a desired state, like the users exported by a HR system.
+
+Current entries are read with a single paged search, projected on the managed attributes. Each entry is compared
+with its desired record attribute per attribute, on normalized values. The result is a ReconciliationPlan, applied
+with pipelined asynchronous operations:
+
+>>> records = [{'uid': 'jdoe', 'cn': 'John Doe', 'sn': 'Doe', 'mail': 'jdoe@example.com'}]
+>>> plan = LDAPUsers(session).reconcile(records, key='uid', dry_run=True)
+>>> plan
+<ReconciliationPlan adds=0 modifies=1 deletes=2 unchanged=0 errors=0>
+>>> plan.apply(session)
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import logging
+
+import ldap
+
+from pyldap_orm.codec import encode_values
+from pyldap_orm.dn import DN
+from pyldap_orm.exceptions import LDAPORMException
+
+logger = logging.getLogger(__name__)
+
+DN_SYNTAX = '1.3.6.1.4.1.1466.115.121.1.12'
+
+
+class ReconciliationPlan(object):
+    """
+    Operations needed to bring entries to their desired state.
+
+    * ``adds``: a list of (dn, modlist) tuples, like returned by ``ldap.modlist.addModlist()``
+    * ``modifies``: a list of (dn, modlist) tuples, like returned by ``ldap.modlist.modifyModlist()``
+    * ``deletes``: a list of DNs
+    * ``unchanged``: the number of entries already in their desired state
+    * ``errors``: a list of (operation, dn, error) tuples, filled by ``apply()``
+
+    :param model: The LDAPObject class of the entries, given to hooks
+    """
+
+    def __init__(self, model=None):
+        self.model = model
+        self.adds = []
+        self.modifies = []
+        self.deletes = []
+        self.unchanged = 0
+        self.errors = []
+
+    def __len__(self):
+        return len(self.adds) + len(self.modifies) + len(self.deletes)
+
+    def __repr__(self):
+        return "<ReconciliationPlan adds={} modifies={} deletes={} unchanged={} errors={}>".format(
+            len(self.adds), len(self.modifies), len(self.deletes), self.unchanged, len(self.errors))
+
+    def apply(self, session, window=64):
+        """
+        Send the operations to the writable server of session, asynchronously: at most ``window`` operations are
+        waiting for a response. Deletes complete before adds are sent, so an entry can be replaced by a new one
+        with the same DN.
+
+        Failed operations are recorded in ``errors``, other operations are still applied.
+
+        :param session: a LDAPSession
+        :param window: Maximum number of pending operations
+        :return: the list of errors
+        """
+        self.errors.extend(session.pipeline((('delete', dn, None) for dn in self.deletes), window, self.model))
+        operations = [('modify', dn, modlist) for dn, modlist in self.modifies] + \
+                     [('add', dn, modlist) for dn, modlist in self.adds]
+        self.errors.extend(session.pipeline(operations, window, self.model))
+        return self.errors
+
+
+class Reconciler(object):
+    """
+    Compute the plan bringing the entries of a LDAPModelList to a desired state.
+
+    Records are dictionaries of attribute values, identified by the value of their key attribute. Names of
+    managed attributes are compared ignoring case. A managed attribute missing from a record is removed from its
+    entry, and the entries whose key is not in the records are deleted when delete is True.
+
+    Values are compared as bytes, except DNs, compared in their normalized form. Multi-valued DN attributes, like
+    group members, are modified by adding and deleting values when it's shorter than replacing all of them.
+
+    :param model_list: a LDAPModelList instance
+    :param key: Attribute identifying records and entries, default is the name attribute of the model. Keys are
+                compared ignoring case.
+    :param attributes: Managed attributes, default is all the attributes found in records
+    :param delete: Delete entries without record
+    """
+
+    def __init__(self, model_list, key=None, attributes=None, delete=True):
+        self.model = model_list.children
+        self.session = model_list._session
+        self.key = key or self.model.name_attribute
+        self.attributes = attributes
+        self.delete = delete
+        syntaxes = self.session.schema['attributes']
+        self._dn_attributes = {name.lower() for name, syntax in syntaxes.items() if syntax[0] == DN_SYNTAX}
+
+    def _normalize(self, name, values):
+        if name in self._dn_attributes:
+            return sorted(DN(value.decode('UTF-8')).normalized.encode('UTF-8') for value in values)
+        return sorted(values)
+
+    def _diff(self, managed, wanted, current):
+        modlist = []
+        for lowered, name in managed.items():
+            want = wanted.get(lowered, [])
+            have = current.get(lowered, [])
+            if self._normalize(lowered, want) == self._normalize(lowered, have):
+                continue
+            if not want:
+                modlist.append((ldap.MOD_DELETE, name, None))
+            elif have and lowered in self._dn_attributes:
+                want_set = set(self._normalize(lowered, want))
+                have_set = set(self._normalize(lowered, have))
+                added = [value for value in want if self._normalize(lowered, [value])[0] not in have_set]
+                removed = [value for value in have if self._normalize(lowered, [value])[0] not in want_set]
+                if len(added) + len(removed) < len(want):
+                    if removed:
+                        modlist.append((ldap.MOD_DELETE, name, removed))
+                    if added:
+                        modlist.append((ldap.MOD_ADD, name, added))
+                else:
+                    modlist.append((ldap.MOD_REPLACE, name, want))
+            else:
+                modlist.append((ldap.MOD_REPLACE, name, want))
+        return modlist
+
+    def _add_modlist(self, record, wanted, managed):
+        name_attribute = self.model.name_attribute
+        name_values = wanted.get(name_attribute.lower())
+        if not name_values:
+            raise LDAPORMException("Record {} has no {} value, can't build its DN".format(record, name_attribute))
+        base = self.model.base[0] if isinstance(self.model.base, (list, tuple)) else self.model.base
+        dn = DN.build(name_attribute, name_values[0].decode('UTF-8'), base)
+        modlist = [('objectClass', encode_values(record.get('objectClass', self.model.required_objectclasses)))]
+        for lowered, name in managed.items():
+            if lowered != 'objectclass' and wanted.get(lowered):
+                modlist.append((name, wanted[lowered]))
+        return dn, modlist
+
+    def plan(self, records, page_size=1000):
+        """
+        :param records: an iterable of dictionaries
+        :param page_size: Number of entries per page of the search
+        :return: a ReconciliationPlan
+        """
+        key = self.key.lower()
+        managed = dict()
+        if self.attributes is not None:
+            managed.update((name.lower(), name) for name in self.attributes)
+
+        desired = dict()
+        for record in records:
+            values = encode_values(record[self.key])
+            if len(values) != 1:
+                raise LDAPORMException("Record {} must have a single {} value".format(record, self.key))
+            desired[values[0].decode('UTF-8').lower()] = record
+            if self.attributes is None:
+                for name in record:
+                    managed.setdefault(name.lower(), name)
+        managed.setdefault(key, self.key)
+
+        def wanted_attributes(record):
+            wanted = dict()
+            for name, values in record.items():
+                if name.lower() in managed:
+                    wanted[name.lower()] = encode_values(values)
+            return wanted
+
+        # The key is compared ignoring case, and only used to pair records and entries
+        compared = {lowered: name for lowered, name in managed.items() if lowered != key}
+
+        plan = ReconciliationPlan(self.model)
+        seen = set()
+        for dn, attributes in self.session.paged_search(base=self.model.base,
+                                                        ldap_filter=self.model.filter(),
+                                                        attributes=sorted(managed.values()),
+                                                        model=self.model,
+                                                        page_size=page_size):
+            if dn is None:
+                continue
+            current = {name.lower(): values for name, values in attributes.items() if name.lower() in managed}
+            entry_keys = current.get(key)
+            if not entry_keys:
+                continue
+            entry_key = entry_keys[0].decode('UTF-8').lower()
+            if entry_key in seen:
+                logger.warning("Entry %s has the same %s than another entry, ignored", dn, self.key)
+                continue
+            seen.add(entry_key)
+
+            record = desired.get(entry_key)
+            if record is None:
+                if self.delete:
+                    plan.deletes.append(dn)
+                continue
+            current.pop(key)
+            wanted = wanted_attributes(record)
+            wanted.pop(key, None)
+            modlist = self._diff(compared, wanted, current)
+            if modlist:
+                plan.modifies.append((dn, modlist))
+            else:
+                plan.unchanged += 1
+
+        for entry_key, record in desired.items():
+            if entry_key not in seen:
+                plan.adds.append(self._add_modlist(record, wanted_attributes(record), managed))
+        return plan
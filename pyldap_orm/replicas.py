@@ -0,0 +1,370 @@
+"""
+Servers of a session: failover between primaries, and reads spread on replicas, with hedged requests to cut the tail
+latency.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import collections
+import logging
+import random
+import time
+
+import ldap
+
+from pyldap_orm.deadline import time_limit
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the server can't answer. Other errors, like NO_SUCH_OBJECT, are legitimate answers.
+FAILOVER_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.UNAVAILABLE, ldap.BUSY)
+
+
+class Node(object):
+    """
+    A server used by a session. The connection is opened (and bound) on first use, and opened again when lost.
+
+    A node which can't be reached is ejected for ``retry_interval`` seconds, doubled on each consecutive failure
+    up to ``max_retry_interval``. Once this delay elapsed, the next operation sent to the node probes it.
+
+    :param backend: a LDAP URI or a LDAPBackend
+    :param opener: a callable returning a new bound connection to a backend, like ``LDAPSession.open()``
+    :param retry_interval: Initial ejection delay, in seconds
+    :param max_retry_interval: Maximum ejection delay, in seconds
+    :param alpha: Weight of the last latency in the moving average
+    """
+
+    def __init__(self, backend, opener, retry_interval=1.0, max_retry_interval=60.0, alpha=0.2):
+        self.backend = backend
+        self.latency = None
+        self.failures = 0
+        self.ejected_until = 0
+        self._opener = opener
+        self._connection = None
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._alpha = alpha
+
+    def __repr__(self):
+        return "<Node {} latency={} failures={}>".format(self.backend, self.latency, self.failures)
+
+    @property
+    def available(self):
+        """
+        True if the node is not ejected, or if it can be probed
+        """
+        return time.monotonic() >= self.ejected_until
+
+    @property
+    def connection(self):
+        """
+        The connection to the node, opened if needed
+        """
+        if self._connection is None:
+            self._connection = self._opener(self.backend)
+        return self._connection
+
+    @property
+    def connected(self):
+        return self._connection is not None
+
+    def reset(self):
+        """
+        Forget the connection, a new one will be opened by the next operation.
+        """
+        self._connection = None
+
+    def observe(self, latency):
+        """
+        Update the exponentially weighted moving average of the node latency.
+
+        :param latency: latency of an operation, in seconds
+        """
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self._alpha * (latency - self.latency)
+
+    def succeed(self):
+        self.failures = 0
+        self.ejected_until = 0
+
+    def fail(self, error):
+        """
+        Eject the node after a failure.
+        """
+        self.reset()
+        self.failures += 1
+        delay = min(self._retry_interval * 2 ** (self.failures - 1), self._max_retry_interval)
+        self.ejected_until = time.monotonic() + delay
+        logger.warning("Server %s ejected for %.1fs: %s", self.backend, delay, error)
+
+    def call(self, function):
+        """
+        Call function with the connection. When a connection opened by a previous operation is lost, a new
+        connection is opened and function is called again; the node is ejected if it still fails.
+
+        :param function: a callable, called with the connection as argument
+        :return: the value returned by function
+        """
+        stale = self.connected
+        try:
+            result = function(self.connection)
+        except FAILOVER_ERRORS as e:
+            if not stale:
+                self.fail(e)
+                raise
+            logger.debug("Connection to %s lost, opening a new one", self.backend)
+            self.reset()
+            try:
+                result = function(self.connection)
+            except FAILOVER_ERRORS as e:
+                self.fail(e)
+                raise
+        if self.failures:
+            logger.info("Server %s is back", self.backend)
+            self.succeed()
+        return result
+
+
+def failover(nodes, function):
+    """
+    Call function with the connection of the first node able to answer. Available nodes are used first,
+    in the given order, then ejected nodes as a last resort.
+
+    :param nodes: a list of Node
+    :param function: a callable, called with a connection as argument
+    :return: the value returned by function
+    """
+    last_error = None
+    for node in sorted(nodes, key=lambda node: not node.available):
+        try:
+            return node.call(function)
+        except FAILOVER_ERRORS as e:
+            last_error = e
+    raise last_error or ldap.SERVER_DOWN({'desc': "No server available"})
+
+
+class HedgedReader(object):
+    """
+    Send searches to the node with the lowest latency among two available nodes chosen randomly, so the load is
+    spread on all nodes while slow ones are avoided. When a node did not answer within a delay, the same search is
+    sent to the next node: the first answer wins, and the other search is abandoned. A node which can't be reached
+    is ejected, and the search is sent to the next one.
+
+    The delay is the given percentile of the latency of recent searches, so about ``1 - percentile`` of searches
+    are sent twice.
+
+    :param nodes: a list of Node
+    :param percentile: Percentile of the search latency used as hedging delay, None to disable hedging
+    :param initial_delay: Delay used until enough latencies are known, in seconds
+    :param min_delay: Lower bound of the delay, in seconds
+    :param samples: Number of latencies kept to compute the delay
+    :param poll_interval: Interval between polls of connections when two searches are pending, in seconds
+    """
+
+    def __init__(self, nodes, percentile=0.95, initial_delay=0.05, min_delay=0.001, samples=1000,
+                 poll_interval=0.001):
+        self.nodes = nodes
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.poll_interval = poll_interval
+        self.requests = 0
+        self.hedged = 0
+        self._latencies = collections.deque(maxlen=samples)
+        self._delay = initial_delay
+        self._recorded = 0
+
+    def delay(self):
+        """
+        :return: the current hedging delay, in seconds, or None if hedging is disabled
+        """
+        if self.percentile is None:
+            return None
+        return self._delay
+
+    def record(self, node, latency):
+        """
+        Record the latency of a search. The delay is computed again every 32 searches.
+        """
+        node.observe(latency)
+        self._latencies.append(latency)
+        self._recorded += 1
+        if self._recorded % 32 == 0 and self.percentile is not None and len(self._latencies) >= 32:
+            ordered = sorted(self._latencies)
+            index = min(int(self.percentile * len(ordered)), len(ordered) - 1)
+            self._delay = max(ordered[index], self.min_delay)
+
+    def candidates(self):
+        """
+        :return: nodes in the order they should be used for the next search
+        """
+        available = [node for node in self.nodes if node.available]
+        ejected = sorted((node for node in self.nodes if not node.available), key=lambda node: node.ejected_until)
+        # Nodes with no known latency are tried first
+        available.sort(key=lambda node: node.latency or 0)
+        if len(available) > 2:
+            # Power of two choices
+            first, second = sorted(random.sample(range(len(available)), 2))
+            available.insert(0, available.pop(first))
+        return available + ejected
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0, serverctrls=None,
+                     timeout=None, sizelimit=0):
+        """
+        Perform a hedged search, with the same arguments than ``ldap.ldapobject.LDAPObject.search_ext_s()``.
+
+        :param timeout: Maximum duration of the search in seconds, None for no limit. Pending searches are
+                        abandoned when it expires, and the servers are given the same time limit.
+        :param sizelimit: Maximum number of entries returned by the servers, 0 for no limit
+        :return: a list of tuples (dn, attributes)
+        :raise: the error of the last node if no node can answer, ``ldap.TIMEOUT`` if timeout expired
+        """
+        self.requests += 1
+        candidates = iter(self.candidates())
+        pending = []
+        last_error = ldap.SERVER_DOWN({'desc': "No server available"})
+        expires = None if timeout is None else time.perf_counter() + timeout
+
+        def search(connection):
+            return connection, connection.search_ext(base, scope, filterstr, attrlist, attrsonly, serverctrls,
+                                                     timeout=time_limit(timeout), sizelimit=sizelimit)
+
+        def send():
+            nonlocal last_error
+            for node in candidates:
+                try:
+                    connection, msgid = node.call(search)
+                except FAILOVER_ERRORS as e:
+                    last_error = e
+                    continue
+                pending.append((node, connection, msgid, time.perf_counter()))
+                return True
+            return False
+
+        send()
+        delay = self.delay()
+        hedge_at = None if delay is None else time.perf_counter() + delay
+        try:
+            while pending:
+                if len(pending) > 1:
+                    wait = self.poll_interval
+                elif hedge_at is not None:
+                    wait = max(hedge_at - time.perf_counter(), 0)
+                else:
+                    wait = -1
+                if expires is not None:
+                    left = expires - time.perf_counter()
+                    if left <= 0:
+                        raise ldap.TIMEOUT({'desc': 'Deadline exceeded'})
+                    wait = left if wait == -1 else min(wait, left)
+                for item in list(pending):
+                    node, connection, msgid, sent = item
+                    try:
+                        result = connection.result3(msgid, all=1, timeout=wait)
+                    except ldap.TIMEOUT:
+                        continue
+                    except FAILOVER_ERRORS as e:
+                        node.fail(e)
+                        last_error = e
+                        pending.remove(item)
+                        continue
+                    except ldap.LDAPError:
+                        pending.remove(item)
+                        raise
+                    if result[0] is None:
+                        continue
+                    pending.remove(item)
+                    self.record(node, time.perf_counter() - sent)
+                    return result[1]
+                if hedge_at is not None and time.perf_counter() >= hedge_at and pending:
+                    # Only one hedged request per search
+                    hedge_at = None
+                    if send():
+                        self.hedged += 1
+                if not pending and not send():
+                    break
+        finally:
+            for node, connection, msgid, sent in pending:
+                # The latency of the loser is at least the elapsed time
+                node.observe(time.perf_counter() - sent)
+                try:
+                    connection.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+        raise last_error
+
+    def search_ext_many(self, bases, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                        serverctrls=None, timeout=None, sizelimit=0):
+        """
+        Perform the same search on several bases at once. Searches are sent asynchronously, spread on the available
+        nodes, so the duration is the one of the slowest search. A search sent to a node which can't be reached is
+        sent to the next node. Searches are not hedged.
+
+        :param bases: a list of base DNs
+        :param timeout: Maximum duration of the searches in seconds, None for no limit
+        :param sizelimit: Maximum number of entries returned for each base, 0 for no limit
+        :return: a list of lists of tuples (dn, attributes), in the same order than bases
+        :raise: the error of a search, or the error of the last node if no node can answer, ``ldap.TIMEOUT`` if
+                timeout expired
+        """
+        self.requests += len(bases)
+        nodes = self.candidates()
+        pending = dict()
+        results = [None] * len(bases)
+        expires = None if timeout is None else time.perf_counter() + timeout
+
+        def send(index, first, end):
+            # Each search is tried once on each node, starting from a different node for each base
+            last_error = ldap.SERVER_DOWN({'desc': "No server available"})
+            for position in range(first, end):
+                node = nodes[position % len(nodes)]
+                try:
+                    connection, msgid = node.call(lambda connection: (connection, connection.search_ext(
+                        bases[index], scope, filterstr, attrlist, attrsonly, serverctrls,
+                        timeout=time_limit(timeout), sizelimit=sizelimit)))
+                except FAILOVER_ERRORS as e:
+                    last_error = e
+                    continue
+                pending[index] = (node, connection, msgid, time.perf_counter(), position + 1, end)
+                return
+            raise last_error
+
+        try:
+            for index in range(len(bases)):
+                send(index, index, index + len(nodes))
+            while pending:
+                wait = self.poll_interval if len(pending) > 1 else -1
+                if expires is not None:
+                    left = expires - time.perf_counter()
+                    if left <= 0:
+                        raise ldap.TIMEOUT({'desc': 'Deadline exceeded'})
+                    wait = left if wait == -1 else min(wait, left)
+                for index, (node, connection, msgid, sent, next_position, end) in list(pending.items()):
+                    try:
+                        result = connection.result3(msgid, all=1, timeout=wait)
+                    except ldap.TIMEOUT:
+                        continue
+                    except FAILOVER_ERRORS as e:
+                        node.fail(e)
+                        del pending[index]
+                        send(index, next_position, end)
+                        continue
+                    except ldap.LDAPError:
+                        del pending[index]
+                        raise
+                    if result[0] is None:
+                        continue
+                    del pending[index]
+                    self.record(node, time.perf_counter() - sent)
+                    results[index] = result[1]
+        finally:
+            for node, connection, msgid, _, _, _ in pending.values():
+                try:
+                    connection.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+        return results
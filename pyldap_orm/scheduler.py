@@ -0,0 +1,201 @@
+"""
+Admission control of the operations of a LDAPSession, so background jobs don't stall interactive traffic.
+
+Each operation belongs to a priority class, selected for the current thread or asyncio task with
+``Scheduler.priority()``. An operation waits for a slot before being sent: the number of running operations is
+limited globally and per class, waiting operations of a class are admitted before those of lower priority classes,
+and an operation is rejected at once when the queue of its class is full:
+
+>>> scheduler = Scheduler(concurrency=8)
+>>> session = LDAPSession(backend='ldap://localhost', scheduler=scheduler)
+>>> with scheduler.priority(BATCH):
+...     users = LDAPModelUsers(session).all()
+
+By default, ``interactive`` operations may use all the slots, ``normal`` operations (the default class) leave
+one slot to interactive ones, and ``batch`` operations run only when the session is idle, on half of the slots.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import collections
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+from pyldap_orm.exceptions import LDAPOverloadedException
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+NORMAL = 'normal'
+BATCH = 'batch'
+
+_current = contextvars.ContextVar('pyldap_orm_priority', default=None)
+_holding = contextvars.ContextVar('pyldap_orm_holding', default=False)
+
+
+class PriorityClass(object):
+    """
+    Limits and counters of a priority class.
+
+    :param name: Name of the class
+    :param rank: Classes of lower rank are admitted first
+    :param concurrency: Maximum number of running operations of the class, None for the scheduler limit
+    :param queue_depth: Maximum number of waiting operations of the class, further operations are rejected
+    :param idle_only: Admit operations only when no operation of another class is running or waiting
+    """
+    __slots__ = ('name', 'rank', 'concurrency', 'queue_depth', 'idle_only', 'running', 'waiting', 'admitted',
+                 'rejected')
+
+    def __init__(self, name, rank, concurrency=None, queue_depth=None, idle_only=False):
+        self.name = name
+        self.rank = rank
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.idle_only = idle_only
+        self.running = 0
+        self.waiting = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return "<PriorityClass {} running={} waiting={}>".format(self.name, self.running, len(self.waiting))
+
+
+class Scheduler(object):
+    """
+    Admit operations by priority class. A scheduler can be shared by several sessions, to limit the operations
+    sent to the same servers.
+
+    :param concurrency: Maximum number of running operations
+    :param default: Name of the class of operations sent outside of ``priority()``
+    :param queue_depth: Maximum number of waiting operations of the default classes
+    """
+
+    def __init__(self, concurrency=8, default=NORMAL, queue_depth=256):
+        self.concurrency = concurrency
+        self.default = default
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._running = 0
+        self._classes = dict()
+        self.add_class(INTERACTIVE, 0, queue_depth=queue_depth)
+        self.add_class(NORMAL, 1, concurrency=max(1, concurrency - 1), queue_depth=queue_depth)
+        self.add_class(BATCH, 2, concurrency=max(1, concurrency // 2), queue_depth=queue_depth, idle_only=True)
+
+    def add_class(self, name, rank, concurrency=None, queue_depth=None, idle_only=False):
+        """
+        Add or replace a priority class, see PriorityClass for parameters.
+        """
+        with self._lock:
+            self._classes[name] = PriorityClass(name, rank, concurrency, queue_depth, idle_only)
+
+    def __getitem__(self, name):
+        return self._classes[name]
+
+    @contextlib.contextmanager
+    def priority(self, name):
+        """
+        Context manager sending the operations of the current thread or asyncio task with the priority name.
+        """
+        if name not in self._classes:
+            raise KeyError("Unknown priority class: {}".format(name))
+        token = _current.set(name)
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    @property
+    def current(self):
+        """
+        Name of the priority class of the current thread or asyncio task
+        """
+        return _current.get() or self.default
+
+    def _admissible(self, klass, ticket):
+        if klass.waiting[0] is not ticket or self._running >= self.concurrency:
+            return False
+        if klass.concurrency is not None and klass.running >= klass.concurrency:
+            return False
+        for other in self._classes.values():
+            if other is klass:
+                continue
+            if klass.idle_only and not other.idle_only and (other.running or other.waiting):
+                return False
+            if other.rank < klass.rank and other.waiting and \
+                    (other.concurrency is None or other.running < other.concurrency):
+                return False
+        return True
+
+    def acquire(self, name=None, timeout=None):
+        """
+        Wait for a slot.
+
+        :param name: Name of the priority class, default is the current one
+        :param timeout: Maximum waiting time in seconds, None to wait forever
+        :return: the PriorityClass of the slot, to give to ``release()``
+        :raise LDAPOverloadedException: if the queue of the class is full, or the timeout expired
+        """
+        klass = self._classes[name or self.current]
+        with self._lock:
+            if klass.queue_depth is not None and len(klass.waiting) >= klass.queue_depth:
+                klass.rejected += 1
+                raise LDAPOverloadedException("Too many waiting {} operations".format(klass.name))
+            ticket = object()
+            klass.waiting.append(ticket)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while not self._admissible(klass, ticket):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        klass.rejected += 1
+                        raise LDAPOverloadedException("No slot for {} operation after {}s".format(klass.name,
+                                                                                                 timeout))
+                    self._condition.wait(remaining)
+            finally:
+                klass.waiting.remove(ticket)
+                # The next waiter of the class may be admissible now
+                self._condition.notify_all()
+            klass.running += 1
+            klass.admitted += 1
+            self._running += 1
+        return klass
+
+    def release(self, klass):
+        """
+        Release a slot returned by ``acquire()``.
+        """
+        with self._lock:
+            klass.running -= 1
+            self._running -= 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, name=None, timeout=None):
+        """
+        Context manager holding a slot. Operations nested in the slot of the current thread or asyncio task,
+        like the searches of a paged search, don't wait for another slot.
+        """
+        if _holding.get():
+            yield None
+            return
+        klass = self.acquire(name, timeout)
+        token = _holding.set(True)
+        try:
+            yield klass
+        finally:
+            _holding.reset(token)
+            self.release(klass)
+
+    def stats(self):
+        """
+        :return: a dictionary of class names and tuples (running, waiting, admitted, rejected)
+        """
+        with self._lock:
+            return {name: (klass.running, len(klass.waiting), klass.admitted, klass.rejected)
+                    for name, klass in self._classes.items()}
@@ -0,0 +1,122 @@
+"""
+Model classes generated from the session schema.
+
+A generated class is a subclass of a model, with ``__slots__`` and one descriptor per attribute allowed by the model
+object classes. Reading an attribute doesn't go through ``LDAPObject.__getattr__()`` anymore, and instances don't
+carry a ``__dict__`` when the model and its parents define ``__slots__``, like LDAPModelUser and LDAPModelGroup:
+
+>>> class LDAPUser(LDAPModelUser):
+...     __slots__ = ()
+...     base = 'ou=People,dc=example,dc=com'
+>>> User = session.model(LDAPUser)
+>>> user = User(session).by_attr('uid', 'jdoe')
+
+Use ``LDAPModelList.generated_children`` to build lists of generated instances.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import keyword
+
+from pyldap_orm.codec import SchemaCodec
+from pyldap_orm.dn import DN
+from pyldap_orm.exceptions import LDAPORMException
+
+
+class AttributeDescriptor(object):
+    """
+    Access to the values of an attribute. Values are always lists, like with ``LDAPObject.__getattr__()``, and
+    a KeyError is raised if the instance has no value.
+
+    New values are converted regarding the attribute codec: bytes are decoded for strings and DNs, DNs are
+    wrapped in DN instances, integers and booleans converted. A single value which is not a list, tuple or set is
+    wrapped in a list. Setting more than one value to a single valued attribute raises a LDAPORMException.
+
+    :param name: Name of the attribute
+    :param kind: How values are decoded, see SchemaCodec
+    :param single_value: True if the attribute is single valued
+    """
+    __slots__ = ('name', 'kind', 'single_value')
+
+    def __init__(self, name, kind, single_value):
+        self.name = name
+        self.kind = kind
+        self.single_value = single_value
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance._attributes[self.name]
+
+    @staticmethod
+    def _boolean(item):
+        if isinstance(item, bytes):
+            item = item.decode('UTF-8')
+        if isinstance(item, str):
+            return item.upper() in ('TRUE', '1')
+        return bool(item)
+
+    def __set__(self, instance, value):
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            value = [value]
+        if self.single_value and len(value) > 1:
+            raise LDAPORMException("Attribute {} is single valued".format(self.name))
+        if self.kind == SchemaCodec.STR:
+            value = [item.decode('UTF-8') if isinstance(item, bytes) else item for item in value]
+        elif self.kind == SchemaCodec.DN:
+            value = [DN(item.decode('UTF-8') if isinstance(item, bytes) else item) for item in value]
+        elif self.kind == SchemaCodec.INT:
+            value = [int(item) for item in value]
+        elif self.kind == SchemaCodec.BOOL:
+            value = [self._boolean(item) for item in value]
+        else:
+            value = list(value)
+        instance._store(self.name, value)
+
+
+def build_model(session, model, object_classes=None):
+    """
+    Build a subclass of model, with a descriptor per attribute allowed by object classes.
+
+    Attributes whose name is not a valid identifier, or is already used by the model (like a method), are still
+    available through ``__getattr__()``.
+
+    :param session: an authenticated LDAPSession, used to read the schema
+    :param model: a LDAPObject class
+    :param object_classes: Object classes of the instances, default is ``model.required_objectclasses``
+    :return: a new class
+    """
+    codec = session.codec(model)
+    syntaxes = session.schema['attributes']
+    must, may = session.object_class_attributes(object_classes or model.required_objectclasses)
+    names = list(must) + list(may) + list(model.required_attributes)
+    for extra in ('name_attribute', 'membership_attribute', 'member_attribute'):
+        if getattr(model, extra, None):
+            names.append(getattr(model, extra))
+
+    descriptors = dict()
+    for name in names:
+        if name in descriptors or not name.isidentifier() or keyword.iskeyword(name) or hasattr(model, name) \
+                or name not in syntaxes:
+            continue
+        descriptors[name] = AttributeDescriptor(name, codec.kind(name), syntaxes[name][1])
+
+    def __setattr__(self, key, value):
+        descriptor = descriptors.get(key)
+        if descriptor is None:
+            model.__setattr__(self, key, value)
+        else:
+            descriptor.__set__(self, value)
+
+    namespace = dict(descriptors)
+    namespace.update({
+        '__slots__': (),
+        '__module__': model.__module__,
+        '__qualname__': model.__qualname__,
+        '__setattr__': __setattr__,
+        'dn': property(lambda self: self._dn, lambda self, value: model.__setattr__(self, 'dn', value)),
+        'descriptors': descriptors,
+    })
+    return type(model.__name__, (model,), namespace)
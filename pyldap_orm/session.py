@@ -2,16 +2,135 @@
 # Copyright: Bruno Bonfils
 # License: Apache License version2
 
+import collections
+import heapq
+import itertools
 import ldap
+import ldap.schema
 import logging
 import warnings
 import os
+import threading
+import time
 
+from pyldap_orm import deadline
+from pyldap_orm.codec import SchemaCodec
+from pyldap_orm.dn import DN
+from pyldap_orm.events import OperationEvent
+from pyldap_orm.replicas import FAILOVER_ERRORS, HedgedReader, Node, failover
 from pyldap_orm.exceptions import LDAPSessionException
 
 logger = logging.getLogger(__name__)
 
 
+class LDAPBackend(object):
+    """
+    Base class of backends which are not reached using a LDAP URI, like
+    :class:`pyldap_orm.memory.MemoryDirectory`.
+
+    A backend creates connections. Connections must provide the methods of ``ldap.ldapobject.LDAPObject``
+    used by pyldap_orm: ``simple_bind_s()``, ``search_s()``, ``search_ext_s()``, ``add_s()``, ``modify_s()``,
+    ``delete_s()``, ``extop_s()``, ``whoami_s()``, their asynchronous variants and ``result4()``.
+    """
+
+    def connect(self):
+        """
+        :return: a new connection to the backend
+        """
+        raise NotImplementedError
+
+
+class _SortKey(object):
+    """
+    Sort key of an entry, with a direction per key. Missing values are always last.
+    """
+    __slots__ = ('values', 'keys')
+
+    def __init__(self, values, keys):
+        self.values = values
+        self.keys = keys
+
+    def __lt__(self, other):
+        for value, other_value, key in zip(self.values, other.values, self.keys):
+            if value == other_value:
+                continue
+            if len(value) != len(other_value):
+                return len(value) > len(other_value)
+            return value > other_value if key[3] else value < other_value
+        return False
+
+
+class _Flight(object):
+    """
+    A search in progress, shared by the threads waiting for the same result.
+    """
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class CompareCache(object):
+    """
+    Results of compare operations, kept ``ttl`` seconds. Entries are evicted in least recently used order once the
+    cache holds ``size`` entries. The session holding the cache forgets the results of an entry when it's written.
+
+    :param size: Maximum number of entries whose results are cached
+    :param ttl: Lifetime of results, in seconds
+    """
+
+    def __init__(self, size=10000, ttl=60.0):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(dn, attribute, value):
+        """
+        :return: a tuple (normalized dn, comparison), the key of a comparison in the cache
+        """
+        return DN(dn).normalized, (attribute.lower(), value)
+
+    def get(self, key):
+        """
+        :return: the cached result of a comparison, or None
+        """
+        normalized, comparison = key
+        with self._lock:
+            results = self._entries.get(normalized)
+            cached = None if results is None else results.get(comparison)
+            if cached is None or cached[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(normalized)
+            self.hits += 1
+            return cached[0]
+
+    def put(self, key, result):
+        normalized, comparison = key
+        with self._lock:
+            self._entries.setdefault(normalized, {})[comparison] = (result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(normalized)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def forget(self, dn=None):
+        """
+        Remove the results of an entry, or all results if dn is None.
+        """
+        with self._lock:
+            if dn is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(DN(dn).normalized, None)
+
+
 class LDAPSession(object):
     """
     Create a LDAPSession by connecting to the LDAP server.
@@ -29,11 +148,66 @@ class LDAPSession(object):
 
     >>> session.authenticate()
 
-    :param backend: a LDAP URI like ``ldaps?://host(:port)?``
+    Instead of a LDAP URI, backend can be a LDAPBackend instance, like an in memory directory:
+
+    >>> session = LDAPSession(backend=MemoryDirectory(ldif='tests/extra/opendj-sample.ldif'))
+
+    Reads can be spread on replicas, while writes stay on the backend. Searches are sent to the replica with the
+    lowest latency among two replicas chosen randomly, and are hedged: when a replica is slow to answer, the search
+    is sent to another replica, and the first answer wins (see :class:`pyldap_orm.replicas.HedgedReader`):
+
+    >>> session = LDAPSession(backend='ldap://primary:389', replicas=['ldap://replica1:389', 'ldap://replica2:389'])
+
+    backend can also be a list of writable servers, used in the given order. A server which can't be reached is
+    ejected for a while, and operations fail over to the next server. Lost connections are opened again, and bound
+    with the credentials given to authenticate().
+
+    Operations can be instrumented by hooks, see :mod:`pyldap_orm.events`:
+
+    >>> session.add_hook(SlowQueryLog(threshold=0.5))
+
+    Identical searches sent concurrently by several threads are coalesced: only the first one is sent to the server,
+    and other threads wait for its result, each getting its own copy of the entries. ``coalesced`` counts the
+    searches which were not sent.
+
+    Operations can be bounded by a deadline, per call with their ``timeout`` argument, or for the current thread
+    with :func:`pyldap_orm.deadline.deadline`. On expiry, the operation is abandoned and ``ldap.TIMEOUT`` is raised:
+
+    >>> with deadline(2.0):
+    ...     LDAPModelUser(session).by_attr('uid', 'jdoe')
+
+    Membership and attribute checks use the Compare operation, so the server only returns whether the entry has
+    the value. Results can be cached by a CompareCache, whose results are forgotten when the session writes the
+    entry:
+
+    >>> session = LDAPSession(backend='ldap://localhost:389', compare_cache=CompareCache(ttl=30))
+    >>> session.compare('cn=admins,ou=Groups,dc=example,dc=com', 'member', b'cn=jdoe,ou=People,dc=example,dc=com')
+    True
+
+    Interactive operations can be protected from batch jobs by a scheduler, see :mod:`pyldap_orm.scheduler`:
+
+    >>> scheduler = Scheduler(concurrency=8)
+    >>> session = LDAPSession(backend='ldap://localhost:389', scheduler=scheduler)
+    >>> with scheduler.priority(BATCH):
+    ...     LDAPModelUsers(session).all()
+
+    :param backend: a LDAP URI like ``ldaps?://host(:port)?``, a LDAPBackend instance, or a list of them
     :param mode: Transport mode, must be LDAPSession.PLAIN (the default), LDAPSession.STARTTLS or LDAPSession.LDAPS
     :param cert: An optional client certificate, in PEM format
     :param key: The client certificate related private key, in PEM format with no password
     :param cacertdir: Directory of CA certificates, default is /etc/ssl/certs
+    :param replicas: An optional list of LDAP URIs or LDAPBackend instances, used for searches
+    :param hedge_percentile: Percentile of the replicas latency after which a search is hedged, None to disable
+                             hedging
+    :param retry_interval: Delay before a server which can't be reached is used again, in seconds. It's doubled
+                           on each consecutive failure.
+    :param intern_scope: Scope of the tables used to intern attribute names and values of the
+                         ``interned_attributes`` of models: LDAPSession.INTERN_RESULT (the default) uses a table per
+                         result set, LDAPSession.INTERN_SESSION a table shared by all searches of the session, and
+                         LDAPSession.INTERN_NONE disables interning
+    :param coalesce: Set to False to send every search, even when an identical search is in progress
+    :param scheduler: An optional :class:`pyldap_orm.scheduler.Scheduler`, admitting operations by priority class
+    :param compare_cache: An optional CompareCache, used by compare() and compare_many()
     """
     PLAIN = 0
     STARTTLS = 1
@@ -42,6 +216,10 @@ class LDAPSession(object):
     AUTH_SIMPLE_BIND = 0
     AUTH_SASL_EXTERNAL = 1
 
+    INTERN_NONE = 0
+    INTERN_RESULT = 1
+    INTERN_SESSION = 2
+
     bind_dn = None
     credential = None
     backend = None
@@ -50,19 +228,42 @@ class LDAPSession(object):
                  cert=None,
                  key=None,
                  cacertdir='/etc/ssl/certs',
+                 replicas=None,
+                 hedge_percentile=0.95,
+                 retry_interval=1.0,
+                 intern_scope=INTERN_RESULT,
+                 coalesce=True,
+                 scheduler=None,
+                 compare_cache=None,
                  ):
 
         self.backend = backend
-        self._server = None
+        self._credentials = None
         self._schema = {}
+        self._codecs = {}
+        self._models = {}
+        self._subschema = None
+        self._root_dse = None
+        self._intern_scope = intern_scope
+        self._interned = {} if intern_scope == self.INTERN_SESSION else None
+        self._hooks = []
+        self._coalesce = coalesce
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.coalesced = 0
+        self._scheduler = scheduler
+        self.compare_cache = compare_cache
         self._cert = cert
         self._key = key
 
-        logger.debug("LDAP _session created, id: {}".format(id(self)))
+        logger.debug("LDAP _session created, id: %s", id(self))
+
+        backends = list(backend) if isinstance(backend, (list, tuple)) else [backend]
 
         # Switch to LDAPS mode if ldaps is backend start with 'ldaps'
-        if 'ldaps' == backend[:5].lower():
+        if isinstance(backends[0], str) and 'ldaps' == backends[0][:5].lower():
             mode = self.LDAPS
+        self._mode = mode
 
         # Set CACERTDIR and REQUIRED_CERT to TLS_DEMAND (validation required) if needed
         if mode in (self.STARTTLS, self.LDAPS) and cacertdir is not None:
@@ -82,66 +283,838 @@ class LDAPSession(object):
             ldap.set_option(ldap.OPT_X_TLS_CERTFILE, cert)
             ldap.set_option(ldap.OPT_X_TLS_KEYFILE, key)
 
-        self._server = ldap.initialize(self.backend, bytes_mode=False)
+        self._primaries = [Node(primary, self.open, retry_interval) for primary in backends]
+        self._replicas = [Node(replica, self.open, retry_interval) for replica in replicas or []]
+        # Without replicas, reads are spread on primaries
+        self._reader = HedgedReader(self._replicas or self._primaries, percentile=hedge_percentile)
+        self._primary(lambda server: server)
+
+    def connect(self, backend=None):
+        """
+        Open a new connection to the backend, and proceed STARTTLS if required. The connection is not bound.
+
+        :param backend: The LDAP URI or LDAPBackend to connect to, default is the first session backend
+        :return: a ``ldap.ldapobject.LDAPObject`` instance, or the connection created by a LDAPBackend
+        """
+        if backend is None:
+            backend = self._primaries[0].backend
+        if isinstance(backend, LDAPBackend):
+            server = backend.connect()
+        else:
+            server = ldap.initialize(backend, bytes_mode=False)
 
         # Proceed STARTTLS
-        if mode == self.STARTTLS:
-            self._server.start_tls_s()
+        if self._mode == self.STARTTLS:
+            server.start_tls_s()
+        return server
 
-    def authenticate(self, bind_dn=None, credential=None, mode=AUTH_SIMPLE_BIND):
+    def authenticate(self, bind_dn=None, credential=None, mode=AUTH_SIMPLE_BIND, timeout=None):
         """
         Perform LDAP authentication and parse schema. This method is mandatory.
 
         :param bind_dn: optional string to perform a bind
         :param credential: optional string with the password of bind_dn
         :param mode: Can se LDAPSession.AUTH_SIMPLE_BIND (the default) or LDAPSession.AUTH_SASL_EXTERNAL
+        :param timeout: Maximum duration of the bind, in seconds
+        """
+        if mode == self.AUTH_SASL_EXTERNAL and (self._cert is None or self._key is None):
+            raise LDAPSessionException(
+                "Client certificate and key must be provided to use SASL_EXTERNAL authentication")
+
+        credentials = (bind_dn, credential, mode)
+        bound = self._primary(lambda server: self._bind(server, *credentials, timeout=timeout) or server)
+        self._credentials = credentials
+        self.bind_dn = bind_dn
+
+        # Other opened connections are bound again with the new identity
+        for node in self._primaries + self._replicas:
+            if node.connected and node.connection is not bound:
+                try:
+                    node.call(lambda server: self._bind(server, *credentials))
+                except FAILOVER_ERRORS:
+                    pass
+
+        self.parse_schema()
+
+    def open(self, backend=None):
+        """
+        Open a new connection to the backend, bound with the credentials given to authenticate().
+
+        :param backend: The LDAP URI or LDAPBackend to connect to, default is the first session backend
+        :return: a ``ldap.ldapobject.LDAPObject`` instance, or the connection created by a LDAPBackend
+        """
+        server = self.connect(backend)
+        if self._credentials is not None:
+            self._bind(server, *self._credentials)
+        return server
+
+    def probe(self):
         """
+        Probe the ejected servers which can be used again, instead of waiting for an operation to do it.
+
+        :return: the list of servers (Node instances) which are back
+        """
+        recovered = []
+        for node in self._primaries + self._replicas:
+            if node.failures and node.available:
+                try:
+                    node.call(lambda server: server.search_s('', ldap.SCOPE_BASE, '(objectClass=*)', ['1.1']))
+                except FAILOVER_ERRORS:
+                    continue
+                recovered.append(node)
+        return recovered
+
+    def _primary(self, function):
+        """
+        Call function with the connection of the first writable server able to answer.
+        """
+        return failover(self._primaries, function)
+
+    def _bind(self, server, bind_dn, credential, mode, timeout=None):
         if mode == self.AUTH_SIMPLE_BIND:
+            left = deadline.remaining(timeout)
             if bind_dn is not None and credential is not None:
-                logger.debug("LDAP _session: bind as {}".format(bind_dn))
-                self._server.simple_bind_s(bind_dn, credential)
+                logger.debug("LDAP _session: bind as %s", bind_dn)
+                self._perform(self.event('bind', bind_dn), lambda: deadline.wait(
+                    server, server.simple_bind(bind_dn, credential), left))
             else:
                 logger.debug("LDAP _session: bind as anonymous")
-                self._server.simple_bind_s()
+                self._perform(self.event('bind', ''), lambda: deadline.wait(server, server.simple_bind(), left))
         elif mode == self.AUTH_SASL_EXTERNAL:
-            if self._cert is None or self._key is None:
-                raise LDAPSessionException(
-                    "Client certificate and key must be provided to use SASL_EXTERNAL authentication")
-            else:
-                self._server.sasl_bind_s(None, 'EXTERNAL', None)
-
-        self.parse_schema()
+            self._perform(self.event('bind', None), server.sasl_bind_s, None, 'EXTERNAL', None)
 
     @property
     def server(self):
-        return self._server
+        """
+        The connection to the writable server in use
+        """
+        return self._primary(lambda server: server)
+
+    @property
+    def credentials(self):
+        """
+        The tuple (bind_dn, credential, mode) given to authenticate(), or None before authentication
+        """
+        return self._credentials
+
+    @property
+    def primaries(self):
+        return self._primaries
+
+    @property
+    def replicas(self):
+        return self._replicas
+
+    def add_hook(self, hook):
+        """
+        Register a hook, called with a :class:`pyldap_orm.events.OperationEvent` after each operation.
+        Exceptions raised by hooks are logged and ignored.
+
+        :param hook: a callable
+        :return: hook
+        """
+        self._hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def notify(self, event):
+        """
+        Call the registered hooks with event. Used by operations performed asynchronously on the connection.
+
+        :param event: an OperationEvent
+        """
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception("Operation hook %r failed", hook)
+
+    def event(self, operation, target, **details):
+        """
+        Create the event of an operation performed asynchronously on the connection, to be given to notify() once
+        the operation completed.
+
+        :param operation: Name of the operation, see :class:`pyldap_orm.events.OperationEvent`
+        :param target: DN, or name of the operation target
+        :return: a new OperationEvent, or None if no hook is registered
+        """
+        if not self._hooks:
+            return None
+        return OperationEvent(operation, target, **details)
+
+    def _perform(self, event, function, *args, **kwargs):
+        """
+        Call function, then notify hooks with event once it returned or raised. When the session has a scheduler,
+        function is called once a slot is available, and the duration of the event doesn't include the wait.
+
+        :param event: an OperationEvent, or None to call function without instrumentation
+        :return: the value returned by function
+        """
+        if self._scheduler is not None:
+            with self._scheduler.slot():
+                return self._call(event, function, *args, **kwargs)
+        return self._call(event, function, *args, **kwargs)
+
+    def _call(self, event, function, *args, **kwargs):
+        if event is None:
+            return function(*args, **kwargs)
+        event.timestamp = time.time()
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            event.duration = time.perf_counter() - start
+            event.error = e
+            self.notify(event)
+            raise
+        event.duration = time.perf_counter() - start
+        event.measure(result)
+        self.notify(event)
+        return result
+
+    @property
+    def scheduler(self):
+        """
+        The Scheduler admitting the operations of the session, or None
+        """
+        return self._scheduler
+
+    @property
+    def reader(self):
+        """
+        The HedgedReader used to send searches to replicas, or to primaries if the session has no replica
+        """
+        return self._reader
 
     def search(self, base, scope=ldap.SCOPE_SUBTREE, ldap_filter='(objectClass=*)', attributes=None,
-               serverctrls=None):
+               serverctrls=None, model=None, timeout=None, sizelimit=0):
         """
-        Perform a low level LDAP search (synchronous) using the given arguments.
+        Perform a low level LDAP search (synchronous) using the given arguments. If the session has replicas,
+        the search is sent to them, otherwise to primaries.
 
-        :param base: Base DN of the search
+        When base is a list of DNs, the search is sent concurrently for each base, and results are merged in the
+        order of bases, or in the order of the sort keys when a ServerSideSort control is given. Entries found
+        under several bases are returned once.
+
+        :param base: Base DN of the search, or a list of base DNs
         :param scope: Scope of the search, default is SCOPE_SUBTREE
         :param ldap_filter: ldap filter, default is '(objectClass=*)'
         :param attributes: An array of attributes to return, default is ['*']
         :param serverctrls: An array server extended controls
+        :param model: The LDAPObject class which requested the search, given to hooks
+        :param timeout: Maximum duration of the search, in seconds
+        :param sizelimit: Maximum number of entries returned by the server, 0 for no limit
         :return: a list of tuples (dn, attributes)
         """
-        if serverctrls is None:
-            logger.debug("Performing LDAP search: base: {}, scope: {}, filter: {}".format(base, scope, ldap_filter))
-            return self._server.search_s(base, scope, ldap_filter, attributes)
+        left = deadline.remaining(timeout)
+        # A search with a deadline is not coalesced, its expiry would fail the searches waiting for it
+        if not self._coalesce or left is not None:
+            return self._search(base, scope, ldap_filter, attributes, serverctrls, model, left, sizelimit)
+
+        key = (tuple(base) if isinstance(base, (list, tuple)) else base, scope, ldap_filter,
+               None if attributes is None else tuple(attributes), sizelimit,
+               tuple((control.controlType, control.criticality, control.encodeControlValue())
+                     for control in serverctrls or ()))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            logger.debug("Waiting for the same search in progress: base: %s, filter: %s", base, ldap_filter)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._copy_entries(flight.result)
+
+        try:
+            flight.result = self._search(base, scope, ldap_filter, attributes, serverctrls, model, None, sizelimit)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+                waiters = flight.waiters
+            flight.done.set()
+        # Entries are shared with waiting threads, which copy them once the search completed
+        return self._copy_entries(flight.result) if waiters else flight.result
+
+    @staticmethod
+    def _copy_entries(entries):
+        return [(dn, {name: list(values) for name, values in attributes.items()}) for dn, attributes in entries]
+
+    def _search(self, base, scope, ldap_filter, attributes, serverctrls, model, timeout=None, sizelimit=0):
+        logger.debug("Performing LDAP search: base: %s, scope: %s, filter: %s, serverctrls: %s",
+                     base, scope, ldap_filter, serverctrls)
+        if isinstance(base, (list, tuple)):
+            event = self.event('search', tuple(base), scope=scope, ldap_filter=ldap_filter, attributes=attributes,
+                                controls=serverctrls, model=model)
+            return self._perform(event, self._search_many, base, scope, ldap_filter, attributes, serverctrls,
+                                 timeout, sizelimit)
+        event = self.event('search', base, scope=scope, ldap_filter=ldap_filter, attributes=attributes,
+                            controls=serverctrls, model=model)
+        return self._perform(event, self._reader.search_ext_s, base, scope, ldap_filter, attrlist=attributes,
+                             serverctrls=serverctrls, timeout=timeout, sizelimit=sizelimit)
+
+    def _search_many(self, bases, scope, ldap_filter, attributes, serverctrls, timeout=None, sizelimit=0):
+        results = self._reader.search_ext_many(bases, scope, ldap_filter, attrlist=attributes,
+                                               serverctrls=serverctrls, timeout=timeout, sizelimit=sizelimit)
+        sort = None
+        for control in serverctrls or ():
+            if control.controlType == '1.2.840.113556.1.4.473':
+                sort = control
+        if sort is None:
+            entries = itertools.chain.from_iterable(results)
         else:
-            logger.debug("Performing ext LDAP search: base: {}, scope: {}, filter: {}, serverctrls={}".
-                         format(base,
-                                scope,
-                                ldap_filter,
-                                serverctrls))
-            return self._server.search_ext_s(base, scope, ldap_filter, attrlist=attributes,
-                                             serverctrls=serverctrls)
+            entries = heapq.merge(*results, key=self._sort_key(sort))
+
+        seen = set()
+        merged = []
+        for dn, entry_attributes in entries:
+            key = DN(dn)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append((dn, entry_attributes))
+        return merged
+
+    def _sort_key(self, control):
+        """
+        Build a key function ordering entries like the server does for a ServerSideSort control. Integers are
+        compared as numbers, other values as strings, ignoring case unless a caseExact ordering rule is given.
+        Entries without value are sorted last, like OpenLDAP does.
+
+        :param control: a ServerSideSort instance
+        :return: a callable, called with a (dn, attributes) tuple
+        """
+        keys = []
+        for sort_key in control.attributes:
+            attribute, rule, reverse = control.sort_key(sort_key)
+            numeric = self._schema['attributes'].get(attribute, (None,))[0] == '1.3.6.1.4.1.1466.115.121.1.27'
+            exact = rule is not None and 'caseexact' in rule.lower()
+            keys.append((attribute.lower(), numeric, exact, reverse))
+
+        def key(entry):
+            values = []
+            lowered = {name.lower(): name for name in entry[1]}
+            for attribute, numeric, exact, reverse in keys:
+                raw = entry[1].get(lowered.get(attribute), ())
+                if numeric:
+                    converted = [int(value) for value in raw]
+                else:
+                    converted = [value.decode('UTF-8') if exact else value.decode('UTF-8').lower() for value in raw]
+                if not converted:
+                    values.append((1,))
+                else:
+                    # The smallest value of a multi valued attribute is used, the largest one in reverse order
+                    values.append((0, max(converted) if reverse else min(converted)))
+            return _SortKey(values, keys)
+        return key
+
+    def paged_search(self, base, scope=ldap.SCOPE_SUBTREE, ldap_filter='(objectClass=*)', attributes=None,
+                     serverctrls=None, model=None, page_size=1000, primary=False, timeout=None):
+        """
+        Perform a search with the simple paged results control, and yield entries as pages are received, so the
+        result set is never held in memory at once. All pages are read from the same server, since a cookie is
+        only valid on the server which returned it. Hooks are notified once per page.
+
+        Like search(), pages are read from replicas if the session has some, unless primary is True.
+
+        :param base: Base DN of the search, or a list of base DNs, searched one after the other
+        :param scope: Scope of the search, default is SCOPE_SUBTREE
+        :param ldap_filter: ldap filter, default is '(objectClass=*)'
+        :param attributes: An array of attributes to return, default is ['*']
+        :param serverctrls: An array of other server controls
+        :param model: The LDAPObject class which requested the search, given to hooks
+        :param page_size: Number of entries requested per page
+        :param primary: Read from the writable server, to see the latest writes
+        :param timeout: Maximum duration of the whole search, in seconds, from the first page
+        :return: a generator of tuples (dn, attributes)
+        """
+        left = deadline.remaining(timeout)
+        # The context deadline is checked on each page, the timeout of the call is converted to an expiry time
+        expires = None if timeout is None else time.monotonic() + left
+        if isinstance(base, (list, tuple)):
+            seen = set()
+            for single_base in base:
+                remaining = None if expires is None else expires - time.monotonic()
+                for dn, entry_attributes in self.paged_search(single_base, scope, ldap_filter, attributes,
+                                                              serverctrls, model, page_size, primary, remaining):
+                    key = DN(dn)
+                    if key not in seen:
+                        seen.add(key)
+                        yield dn, entry_attributes
+            return
+
+        node = self.page_node(primary)
+        cookie = b''
+        while True:
+            remaining = None if expires is None else expires - time.monotonic()
+            entries, cookie = self.search_page(base, scope, ldap_filter, attributes, serverctrls, model, page_size,
+                                               cookie, node, remaining)
+            for entry in entries:
+                yield entry
+            if not cookie:
+                return
+
+    def page_node(self, primary=False):
+        """
+        :param primary: Choose a writable server
+        :return: the Node which should receive the pages of a paged search
+        """
+        if primary:
+            return sorted(self._primaries, key=lambda node: not node.available)[0]
+        return self._reader.candidates()[0]
+
+    def search_page(self, base, scope=ldap.SCOPE_SUBTREE, ldap_filter='(objectClass=*)', attributes=None,
+                    serverctrls=None, model=None, page_size=1000, cookie=b'', node=None, timeout=None):
+        """
+        Read a single page of a search with the simple paged results control. A cookie is only valid on the server
+        which returned it, so the pages of a search must be read from the same node.
+
+        :param base: Base DN of the search
+        :param scope: Scope of the search, default is SCOPE_SUBTREE
+        :param ldap_filter: ldap filter, default is '(objectClass=*)'
+        :param attributes: An array of attributes to return, default is ['*']
+        :param serverctrls: An array of other server controls
+        :param model: The LDAPObject class which requested the search, given to hooks
+        :param page_size: Number of entries requested
+        :param cookie: The cookie returned with the previous page, empty for the first page
+        :param node: The Node to read the page from, default is the one returned by ``page_node()``
+        :param timeout: Maximum duration of the search, in seconds
+        :return: a tuple (entries, cookie), where cookie is empty on the last page
+        """
+        from pyldap_orm.controls import PagedResults
+
+        if node is None:
+            node = self.page_node()
+        controls = list(serverctrls or ()) + [PagedResults(size=page_size, cookie=cookie)]
+        response = []
+        left = deadline.remaining(timeout)
+
+        def fetch(server):
+            msgid = server.search_ext(base, scope, ldap_filter, attributes, serverctrls=controls,
+                                      timeout=deadline.time_limit(left))
+            _, entries, _, response_controls, _, _ = deadline.wait(server, msgid, left, resp_ctrl_classes={
+                PagedResults.controlType: PagedResults})
+            response.extend(response_controls)
+            return entries
+
+        logger.debug("Performing paged LDAP search: base: %s, scope: %s, filter: %s", base, scope, ldap_filter)
+        event = self.event('search', base, scope=scope, ldap_filter=ldap_filter, attributes=attributes,
+                            controls=controls, model=model)
+        entries = self._perform(event, node.call, fetch)
+        for control in response:
+            if control.controlType == PagedResults.controlType:
+                return entries, control.cookie
+        return entries, b''
+
+    def add(self, dn, modlist, model=None, timeout=None):
+        """
+        Add an entry.
+
+        :param dn: DN of the new entry
+        :param modlist: a list of (attribute, values) tuples, like returned by ``ldap.modlist.addModlist()``
+        :param model: The LDAPObject class which requested the operation, given to hooks
+        :param timeout: Maximum duration of the operation, in seconds
+        """
+        logger.debug("Adding entry: %s", dn)
+        self._forget(dn)
+        left = deadline.remaining(timeout)
+        self._perform(self.event('add', dn, model=model), self._primary,
+                      lambda server: deadline.wait(server, server.add_ext(dn, modlist), left))
+
+    def modify(self, dn, modlist, model=None, serverctrls=None, timeout=None):
+        """
+        Modify an entry.
+
+        :param dn: DN of the entry
+        :param modlist: a list of (operation, attribute, values) tuples, like returned by
+                        ``ldap.modlist.modifyModlist()``
+        :param model: The LDAPObject class which requested the operation, given to hooks
+        :param serverctrls: An optional array of server controls
+        :param timeout: Maximum duration of the operation, in seconds
+        """
+        logger.debug("Modifying entry: %s with following updates: %s", dn, modlist)
+        self._forget(dn)
+        left = deadline.remaining(timeout)
+        self._perform(self.event('modify', dn, controls=serverctrls, model=model), self._primary,
+                      lambda server: deadline.wait(server, server.modify_ext(dn, modlist, serverctrls=serverctrls),
+                                                   left))
+
+    def delete(self, dn, model=None, serverctrls=None, timeout=None):
+        """
+        Delete an entry.
+
+        :param dn: DN of the entry
+        :param model: The LDAPObject class which requested the operation, given to hooks
+        :param serverctrls: An optional array of server controls
+        :param timeout: Maximum duration of the operation, in seconds
+        """
+        logger.debug("Deleting entry: %s", dn)
+        self._forget(dn)
+        left = deadline.remaining(timeout)
+        self._perform(self.event('delete', dn, controls=serverctrls, model=model), self._primary,
+                      lambda server: deadline.wait(server, server.delete_ext(dn, serverctrls=serverctrls), left))
+
+    def pipeline(self, operations, window=64, model=None, ignored=()):
+        """
+        Send write operations asynchronously to the writable server: at most ``window`` operations are waiting
+        for a response. Operations are sent in order, but a server may apply pending operations in any order.
+
+        A failed operation doesn't stop the others. Hooks are notified once the response of each operation is
+        read; responses are read in order, so durations are upper bounds. When the deadline of the current thread
+        expires, pending operations are abandoned and ``ldap.TIMEOUT`` is raised.
+
+        :param operations: an iterable of tuples (operation, dn, modlist), where operation is ``add``, ``modify``
+                           or ``delete`` (with a None modlist)
+        :param window: Maximum number of pending operations
+        :param model: The LDAPObject class which requested the operations, given to hooks
+        :param ignored: Exception classes which are not errors, like ``ldap.NO_SUCH_OBJECT`` for deletes
+        :return: a list of tuples (operation, dn, error) for failed operations
+        """
+        if self._scheduler is not None:
+            # The whole pipeline holds a single slot
+            with self._scheduler.slot():
+                return self._pipeline(operations, window, model, ignored)
+        return self._pipeline(operations, window, model, ignored)
+
+    def _pipeline(self, operations, window, model, ignored):
+        server = self.server
+        senders = {
+            'add': server.add_ext,
+            'modify': server.modify_ext,
+            'delete': lambda dn, modlist: server.delete_ext(dn),
+        }
+        pending = collections.deque()
+        errors = []
+
+        def collect():
+            operation, dn, msgid, event, start = pending.popleft()
+            try:
+                deadline.wait(server, msgid, deadline.remaining())
+            except ldap.TIMEOUT:
+                # Operations not answered yet are abandoned
+                for _, _, other, _, _ in [(operation, dn, msgid, event, start)] + list(pending):
+                    deadline.abandon(server, other)
+                pending.clear()
+                raise
+            except ignored:
+                pass
+            except ldap.LDAPError as e:
+                logger.warning("Failed to %s %s: %s", operation, dn, e)
+                errors.append((operation, dn, e))
+                if event is not None:
+                    event.error = e
+            if event is not None:
+                event.duration = time.perf_counter() - start
+                self.notify(event)
+
+        for operation, dn, modlist in operations:
+            if len(pending) >= window:
+                collect()
+            self._forget(dn)
+            event = self.event(operation, dn, model=model, timestamp=time.time())
+            start = time.perf_counter()
+            try:
+                msgid = senders[operation](dn, modlist)
+            except ldap.LDAPError as e:
+                errors.append((operation, dn, e))
+                continue
+            pending.append((operation, dn, msgid, event, start))
+        while pending:
+            collect()
+        return errors
+
+    def extop_pipeline(self, requests, window=64, model=None):
+        """
+        Send extended operations asynchronously to the writable server, like pipeline(): at most ``window``
+        operations are waiting for a response, a failed operation doesn't stop the others, and when the deadline of
+        the current thread expires, pending operations are abandoned and ``ldap.TIMEOUT`` is raised.
+
+        :param requests: an iterable of ``ldap.extop.ExtendedRequest`` instances
+        :param window: Maximum number of pending operations
+        :param model: The LDAPObject class which requested the operations, given to hooks
+        :return: a list holding, in the same order than requests, a tuple (responseName, responseValue) for each
+                 successful operation, or the ``ldap.LDAPError`` raised by each failed one
+        """
+        if self._scheduler is not None:
+            # The whole pipeline holds a single slot
+            with self._scheduler.slot():
+                return self._extop_pipeline(requests, window, model)
+        return self._extop_pipeline(requests, window, model)
+
+    def _extop_pipeline(self, requests, window, model):
+        server = self.server
+        pending = collections.deque()
+        results = []
+
+        def collect():
+            position, msgid, event, start = pending.popleft()
+            try:
+                results[position] = deadline.wait(server, msgid, deadline.remaining(), add_extop=1)[4:]
+            except ldap.TIMEOUT:
+                # Operations not answered yet are abandoned
+                for _, other, _, _ in [(position, msgid, event, start)] + list(pending):
+                    deadline.abandon(server, other)
+                pending.clear()
+                raise
+            except ldap.LDAPError as e:
+                results[position] = e
+                if event is not None:
+                    event.error = e
+            if event is not None:
+                event.duration = time.perf_counter() - start
+                if event.error is None:
+                    event.measure(results[position])
+                self.notify(event)
+
+        for request in requests:
+            if len(pending) >= window:
+                collect()
+            event = self.event('extop', request.requestName, model=model, timestamp=time.time())
+            start = time.perf_counter()
+            try:
+                msgid = server.extop(request)
+            except ldap.LDAPError as e:
+                results.append(e)
+                continue
+            results.append(None)
+            pending.append((len(results) - 1, msgid, event, start))
+        while pending:
+            collect()
+        return results
+
+    @property
+    def root_dse(self):
+        """
+        The attributes of the root DSE of the writable server, read once
+        """
+        if self._root_dse is None:
+            entries = self._primary(lambda server: server.search_s('', ldap.SCOPE_BASE, '(objectClass=*)',
+                                                                   ['*', '+']))
+            self._root_dse = entries[0][1] if entries else {}
+        return self._root_dse
+
+    def supports_control(self, oid):
+        """
+        :param oid: OID of a control
+        :return: True if the writable server advertises the control in its root DSE
+        """
+        for name, values in self.root_dse.items():
+            if name.lower() == 'supportedcontrol':
+                return oid.encode('UTF-8') in values
+        return False
+
+    def delete_subtree(self, dn, model=None, tree_delete=None, window=64, page_size=1000):
+        """
+        Delete an entry and all its descendants.
+
+        When the server supports the Tree Delete control, a single delete is sent. Otherwise, the subtree is read
+        from the writable server with a paged search requesting no attribute, then entries are deleted by depth,
+        deepest first: all the deletes of a level are pipelined, and complete before the next level is sent.
+        Entries already deleted are ignored.
+
+        :param dn: DN of the root of the subtree
+        :param model: The LDAPObject class which requested the operation, given to hooks
+        :param tree_delete: True to use the Tree Delete control, False to delete entries one by one, None (the
+                            default) to use the control if the server advertises it
+        :param window: Maximum number of pending deletes
+        :param page_size: Number of entries per page of the search
+        :raise: the first error of a level, once the whole level was sent
+        """
+        from pyldap_orm.controls import TreeDelete
+
+        if self.compare_cache is not None:
+            # Results of descendants are cached under their own DN
+            self.compare_cache.forget()
+        if tree_delete is None:
+            tree_delete = self.supports_control(TreeDelete.controlType)
+        if tree_delete:
+            self.delete(dn, model=model, serverctrls=[TreeDelete()])
+            return
+
+        levels = collections.defaultdict(list)
+        for entry_dn, _ in self.paged_search(dn, ldap.SCOPE_SUBTREE, '(objectClass=*)', ['1.1'], model=model,
+                                             page_size=page_size, primary=True):
+            if entry_dn is not None:
+                levels[len(DN(entry_dn).rdns)].append(entry_dn)
+        for depth in sorted(levels, reverse=True):
+            logger.debug("Deleting %d entries at depth %d under %s", len(levels[depth]), depth, dn)
+            errors = self.pipeline((('delete', entry_dn, None) for entry_dn in levels[depth]), window, model,
+                                   ignored=ldap.NO_SUCH_OBJECT)
+            if errors:
+                raise errors[0][2]
+
+    def _forget(self, dn):
+        if self.compare_cache is not None:
+            self.compare_cache.forget(dn)
+
+    @staticmethod
+    def _compare_result(server, msgid, timeout):
+        try:
+            deadline.wait(server, msgid, timeout)
+        except ldap.COMPARE_TRUE:
+            return True
+        except (ldap.COMPARE_FALSE, ldap.NO_SUCH_ATTRIBUTE):
+            return False
+        raise ldap.PROTOCOL_ERROR({'desc': 'Compare operation returned an unexpected result'})
+
+    def compare(self, dn, attribute, value, model=None, timeout=None):
+        """
+        Check if an entry has a value, with the Compare operation. The server matches the value with the equality
+        rule of the attribute, using its indexes, and only returns the outcome: the cost doesn't depend on the
+        number of values of the attribute. Like searches, comparisons are sent to replicas if the session has some.
+
+        :param dn: DN of the entry
+        :param attribute: Name of the attribute
+        :param value: The value, as bytes
+        :param model: The LDAPObject class which requested the operation, given to hooks
+        :param timeout: Maximum duration of the operation, in seconds
+        :return: True if the entry has the value, False if it hasn't, or has no such attribute
+        :raise ldap.NO_SUCH_OBJECT: if the entry doesn't exist
+        """
+        key = None
+        if self.compare_cache is not None:
+            key = CompareCache.key(dn, attribute, value)
+            cached = self.compare_cache.get(key)
+            if cached is not None:
+                return cached
+        left = deadline.remaining(timeout)
+        result = self._perform(self.event('compare', dn, attributes=[attribute], model=model), failover,
+                               self._reader.candidates(),
+                               lambda server: self._compare_result(server, server.compare_ext(dn, attribute, value),
+                                                                   left))
+        if key is not None:
+            self.compare_cache.put(key, result)
+        return result
+
+    def compare_many(self, comparisons, window=64, model=None):
+        """
+        Perform many comparisons asynchronously on the same server: at most ``window`` comparisons are waiting for a
+        response. Cached results are not asked again, and identical comparisons are sent once.
+
+        :param comparisons: an iterable of tuples (dn, attribute, value), values as bytes
+        :param window: Maximum number of pending comparisons
+        :param model: The LDAPObject class which requested the operations, given to hooks
+        :return: a list of booleans, in the order of comparisons
+        :raise: the first error other than a missing attribute, like ``ldap.NO_SUCH_OBJECT``
+        """
+        comparisons = list(comparisons)
+        results = [None] * len(comparisons)
+        positions = collections.OrderedDict()
+        for index, (dn, attribute, value) in enumerate(comparisons):
+            key = CompareCache.key(dn, attribute, value)
+            cached = None if self.compare_cache is None else self.compare_cache.get(key)
+            if cached is not None:
+                results[index] = cached
+            else:
+                positions.setdefault(key, []).append(index)
+        if not positions:
+            return results
+
+        def run(server):
+            pending = collections.deque()
+            answers = dict()
+
+            def collect():
+                key, msgid, event, start = pending.popleft()
+                try:
+                    answers[key] = self._compare_result(server, msgid, deadline.remaining())
+                except ldap.LDAPError as e:
+                    if event is not None:
+                        event.error = e
+                        event.duration = time.perf_counter() - start
+                        self.notify(event)
+                    raise
+                if event is not None:
+                    event.duration = time.perf_counter() - start
+                    self.notify(event)
+
+            try:
+                for key, indexes in positions.items():
+                    if len(pending) >= window:
+                        collect()
+                    dn, attribute, value = comparisons[indexes[0]]
+                    event = self.event('compare', dn, attributes=[attribute], model=model, timestamp=time.time())
+                    pending.append((key, server.compare_ext(dn, attribute, value), event, time.perf_counter()))
+                while pending:
+                    collect()
+            finally:
+                for _, msgid, _, _ in pending:
+                    deadline.abandon(server, msgid)
+            return answers
+
+        if self._scheduler is not None:
+            with self._scheduler.slot():
+                answers = failover(self._reader.candidates(), run)
+        else:
+            answers = failover(self._reader.candidates(), run)
+        for key, indexes in positions.items():
+            if self.compare_cache is not None:
+                self.compare_cache.put(key, answers[key])
+            for index in indexes:
+                results[index] = answers[key]
+        return results
+
+    def ranged_values(self, dn, attribute, start=0, model=None):
+        """
+        Read the values of an attribute by ranges, one base search per range. The attribute is first requested by
+        its name: servers which limit the number of values returned at once, like Active Directory, answer with the
+        range they returned, like ``member;range=0-1499``, and the next search asks for the following values with
+        ``member;range=1500-*``. Other servers, like OpenLDAP or OpenDJ, return all the values at once.
+
+        :param dn: DN of the entry
+        :param attribute: Name of the attribute
+        :param start: Index of the first value
+        :param model: The LDAPObject class which requested the values, given to hooks
+        :return: a generator of values, as bytes
+        """
+        lowered = attribute.lower()
+        while True:
+            # Only Active Directory knows the range option, other servers would return no value
+            requested = attribute if start == 0 else '{};range={}-*'.format(attribute, start)
+            entries = self.search(dn, ldap.SCOPE_BASE, attributes=[requested], model=model)
+            if not entries:
+                return
+            for name, values in entries[0][1].items():
+                name, _, option = name.partition(';')
+                if name.lower() == lowered:
+                    break
+            else:
+                return
+            yield from values
+            if not option.lower().startswith('range='):
+                return
+            end = option[6:].partition('-')[2]
+            if end == '*':
+                return
+            start = int(end) + 1
+
+    def extop(self, request, model=None, timeout=None):
+        """
+        Perform an extended operation.
+
+        :param request: a ``ldap.extop.ExtendedRequest`` instance
+        :param model: The LDAPObject class which requested the operation, given to hooks
+        :param timeout: Maximum duration of the operation, in seconds
+        :return: a tuple (responseName, responseValue)
+        """
+        logger.debug("Performing extended operation: %s", request.requestName)
+        left = deadline.remaining(timeout)
+        return self._perform(self.event('extop', request.requestName, model=model), self._primary,
+                             lambda server: deadline.wait(server, server.extop(request), left, add_extop=1)[4:])
 
     def whoami(self):
-        return self.server.whoami_s().split(':')[1]
+        return self._primary(lambda server: server.whoami_s()).split(':')[1]
 
     def parse_schema(self):
         """
@@ -163,9 +1136,14 @@ class LDAPSession(object):
 
         self._schema['attributes'] = {}
         self._schema['objectClass'] = {}
+        self._codecs = {}
+        self._models = {}
         # TODO: base must be discovered from server (using subSchemaEntry)
-        request = self.server.search_s(base='cn=schema', scope=ldap.SCOPE_BASE, attrlist=['+'])
+        request = self._perform(self.event('schema', 'cn=schema', scope=ldap.SCOPE_BASE, attributes=['+']),
+                                self._primary,
+                                lambda server: server.search_s(base='cn=schema', scope=ldap.SCOPE_BASE, attrlist=['+']))
         schema = ldap.schema.SubSchema(request[0][1])
+        self._subschema = schema
 
         for attr in schema.tree(ldap.schema.AttributeType):
             definition = schema.get_obj(ldap.schema.AttributeType, attr)
@@ -179,3 +1157,81 @@ class LDAPSession(object):
     @property
     def schema(self):
         return self._schema
+
+    def object_class_attributes(self, object_classes):
+        """
+        Return the attributes allowed by object classes, including the ones of their superior classes.
+
+        :param object_classes: a list of object class names
+        :return: a tuple (must, may) of lists of attribute names
+        """
+        must, may = self._subschema.attribute_types(object_classes, raise_keyerror=0)
+        return ([(attribute.names or (attribute.oid,))[0] for attribute in must.values()],
+                [(attribute.names or (attribute.oid,))[0] for attribute in may.values()])
+
+    def ordering_rule(self, attribute):
+        """
+        :param attribute: Name of an attribute
+        :return: the ORDERING matching rule of attribute, inherited from its superior if needed, or None if the
+                 attribute has none or isn't defined by the schema
+        """
+        definition = self._subschema.get_obj(ldap.schema.AttributeType, attribute)
+        while definition is not None:
+            if definition.ordering is not None:
+                return definition.ordering
+            if not definition.sup:
+                return None
+            definition = self._subschema.get_obj(ldap.schema.AttributeType, definition.sup[0])
+        return None
+
+    def model(self, model, object_classes=None):
+        """
+        Return a subclass of model generated from the schema, see :func:`pyldap_orm.schema.build_model`.
+        Generated classes are cached until the schema is parsed again.
+
+        :param model: a LDAPObject class
+        :param object_classes: Object classes of the instances, default is ``model.required_objectclasses``
+        :return: a LDAPObject class
+        """
+        key = (model, tuple(object_classes or ()))
+        try:
+            return self._models[key]
+        except KeyError:
+            from pyldap_orm.schema import build_model
+
+            generated = self._models[key] = build_model(self, model, object_classes)
+            return generated
+
+    @property
+    def interned(self):
+        """
+        The table used to intern values of the whole session, or None if the intern scope is not INTERN_SESSION.
+        It can be cleared to release values.
+        """
+        return self._interned
+
+    def intern_table(self):
+        """
+        :return: the table used to intern values of a new result set, or None if interning is disabled
+        """
+        if self._intern_scope == self.INTERN_RESULT:
+            return dict()
+        return self._interned
+
+    def codec(self, model):
+        """
+        Return the SchemaCodec used to decode values of model instances. Codecs are cached until
+        the schema is parsed again.
+
+        :param model: a LDAPObject class
+        :return: a SchemaCodec instance
+        :rtype: SchemaCodec
+        """
+        key = (tuple(model.OID_TO_STR), tuple(model.OID_TO_INT), tuple(model.OID_TO_BOOL),
+               tuple(model.interned_attributes), tuple(model.OID_TO_DN))
+        try:
+            return self._codecs[key]
+        except KeyError:
+            codec = SchemaCodec(self._schema['attributes'], *key)
+            self._codecs[key] = codec
+            return codec
@@ -0,0 +1,201 @@
+"""
+Result sets stored on disk, for searches returning more entries than the memory can hold.
+
+Raw entries are written to a temporary file as they are received, then the file is memory mapped. Objects are
+built when they are accessed, so only the index stays in memory:
+
+>>> users = LDAPModelUsers(session, spill=True).all()
+>>> len(users)
+2000000
+>>> users[1234567].uid
+['jdoe']
+>>> users.get('cn=John Doe,ou=People,dc=example,dc=com').uid
+['jdoe']
+
+Each entry is stored as a record: its length, then its DN and attributes, every string prefixed by its length.
+"""
+
+# Authors: Bruno Bonfils
+# Copyright: Bruno Bonfils
+# License: Apache License version2
+
+import array
+import mmap
+import struct
+import tempfile
+import weakref
+
+from pyldap_orm.dn import DN
+
+_LENGTH = struct.Struct('>I')
+_COUNT = struct.Struct('>H')
+
+
+def encode_entry(dn, attributes):
+    """
+    :param dn: DN of the entry
+    :param attributes: a dictionary of attribute names and lists of bytes
+    :return: the record of the entry, as bytes
+    """
+    parts = []
+    encoded = dn.encode('UTF-8')
+    parts.append(_LENGTH.pack(len(encoded)))
+    parts.append(encoded)
+    parts.append(_COUNT.pack(len(attributes)))
+    for name, values in attributes.items():
+        encoded = name.encode('UTF-8')
+        parts.append(_COUNT.pack(len(encoded)))
+        parts.append(encoded)
+        parts.append(_LENGTH.pack(len(values)))
+        for value in values:
+            parts.append(_LENGTH.pack(len(value)))
+            parts.append(value)
+    body = b''.join(parts)
+    return _LENGTH.pack(len(body)) + body
+
+
+def decode_entry(buffer, offset):
+    """
+    :param buffer: a buffer holding records, like a mmap
+    :param offset: offset of the record
+    :return: a tuple (dn, attributes)
+    """
+    offset += _LENGTH.size
+    length, = _LENGTH.unpack_from(buffer, offset)
+    offset += _LENGTH.size
+    dn = buffer[offset:offset + length].decode('UTF-8')
+    offset += length
+    count, = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    attributes = dict()
+    for _ in range(count):
+        length, = _COUNT.unpack_from(buffer, offset)
+        offset += _COUNT.size
+        name = buffer[offset:offset + length].decode('UTF-8')
+        offset += length
+        values_count, = _LENGTH.unpack_from(buffer, offset)
+        offset += _LENGTH.size
+        values = []
+        for _ in range(values_count):
+            length, = _LENGTH.unpack_from(buffer, offset)
+            offset += _LENGTH.size
+            values.append(buffer[offset:offset + length])
+            offset += length
+        attributes[name] = values
+    return dn, attributes
+
+
+def _close(mapping, fh):
+    if mapping is not None:
+        mapping.close()
+    fh.close()
+
+
+class SpilledResults(object):
+    """
+    A sequence of LDAPObject instances, whose entries are stored in a memory mapped temporary file. Objects are
+    built on each access, so modifying an object doesn't change the result set.
+
+    The index holds the offset of each record, and the hash of the normalized DN of entries, so ``get()`` reads
+    the records of entries with the same hash only.
+
+    The file is deleted when the result set is closed, or garbage collected.
+
+    :param session: a LDAPSession
+    :param children: The LDAPObject class of objects
+    :param entries: an iterable of tuples (dn, attributes), like returned by ``LDAPSession.paged_search()``
+    :param directory: Directory of the temporary file, default is the system one
+    """
+
+    def __init__(self, session, children, entries, directory=None):
+        self._session = session
+        self._children = children
+        self._interned = session.intern_table()
+        self._offsets = array.array('Q')
+        self._hashes = dict()
+        self._mmap = None
+        self._file = tempfile.TemporaryFile(dir=directory)
+
+        offset = 0
+        for dn, attributes in entries:
+            if dn is None:
+                # Search reference
+                continue
+            record = encode_entry(dn, attributes)
+            self._file.write(record)
+            key = hash(DN(dn))
+            index = len(self._offsets)
+            previous = self._hashes.setdefault(key, index)
+            if previous != index:
+                # Hash collision, or the same entry returned twice
+                self._hashes[key] = (previous if isinstance(previous, tuple) else (previous,)) + (index,)
+            self._offsets.append(offset)
+            offset += len(record)
+        self._file.flush()
+
+        if offset:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._finalizer = weakref.finalize(self, _close, self._mmap, self._file)
+
+    def close(self):
+        """
+        Delete the temporary file.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def size(self):
+        """
+        Size of the temporary file, in bytes
+        """
+        return 0 if self._mmap is None else len(self._mmap)
+
+    def entry(self, index):
+        """
+        :return: the raw entry at index, as a tuple (dn, attributes)
+        """
+        return decode_entry(self._mmap, self._offsets[index])
+
+    def _build(self, index):
+        return self._children(self._session).parse(self.entry(index), self._interned)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._build(position) for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("result set index out of range")
+        return self._build(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._build(index)
+
+    def get(self, dn, default=None):
+        """
+        :param dn: a DN, as a string or a DN instance
+        :return: the object of the entry, or default if the result set doesn't hold this entry
+        """
+        if not isinstance(dn, DN):
+            dn = DN(dn)
+        indexes = self._hashes.get(hash(dn))
+        if indexes is None:
+            return default
+        for index in indexes if isinstance(indexes, tuple) else (indexes,):
+            entry = self.entry(index)
+            if DN(entry[0]) == dn:
+                return self._children(self._session).parse(entry, self._interned)
+        return default
+
+    def __contains__(self, dn):
+        return self.get(dn) is not None
@@ -8,8 +8,8 @@ setup(name='pyldap_orm',
       author_email='bbonfils@gmail.com',
       license='Apache License 2.0',
       packages=['pyldap_orm'],
+      package_data={'pyldap_orm': ['data/*.ldif']},
       install_requires=[
-          'pyldap',
-          'pyasn1'
+          'pyldap'
       ],
       zip_safe=False)
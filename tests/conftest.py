@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+import pyldap_orm
+import pyldap_orm.models
+from pyldap_orm.memory import MemoryDirectory
+
+SAMPLE_LDIF = '{}/extra/opendj-sample.ldif'.format(os.path.dirname(os.path.realpath(__file__)))
+MANAGER_DN = 'cn=ldapmanager,ou=Services,ou=People,dc=example,dc=com'
+JDOE_DN = 'cn=John Doe,ou=Employees,ou=People,dc=example,dc=com'
+
+
+class LDAPUser(pyldap_orm.models.LDAPModelUser):
+    base = 'ou=People,dc=example,dc=com'
+    membership_attribute = 'isMemberOf'
+
+
+class LDAPUsers(pyldap_orm.models.LDAPModelUsers):
+    children = LDAPUser
+
+
+class LDAPGroup(pyldap_orm.models.LDAPModelGroup):
+    base = 'ou=Groups,dc=example,dc=com'
+
+
+class LDAPGroups(pyldap_orm.LDAPModelList):
+    children = LDAPGroup
+
+
+def memory_session(backend=None, **kwargs):
+    """
+    :param backend: the backend of the session, default is a new MemoryDirectory holding the sample entries
+    :param kwargs: other arguments of LDAPSession
+    :return: a LDAPSession authenticated as the manager
+    """
+    session = pyldap_orm.LDAPSession(backend=backend or MemoryDirectory(ldif=SAMPLE_LDIF), **kwargs)
+    session.authenticate(MANAGER_DN, 'password')
+    return session
+
+
+@pytest.fixture
+def directory():
+    return MemoryDirectory(ldif=SAMPLE_LDIF)
+
+
+@pytest.fixture
+def session(directory):
+    return memory_session(directory)
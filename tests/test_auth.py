@@ -0,0 +1,33 @@
+import pytest
+
+from conftest import JDOE_DN, MANAGER_DN, LDAPUser
+from pyldap_orm.auth import BindVerifier
+
+
+class TestBindVerifier:
+    @pytest.fixture(autouse=True)
+    def setup(self, session):
+        self.session = session
+        self.events = []
+        self.session.add_hook(self.events.append)
+
+    def test_verify_dn(self):
+        verifier = BindVerifier(self.session, size=2)
+        assert verifier.verify(JDOE_DN, 'password')
+        assert not verifier.verify(JDOE_DN, 'invalid')
+        assert not verifier.verify(JDOE_DN, '')
+        assert [event.operation for event in self.events] == ['bind', 'bind']
+        # Pool connections are bound again as the service account
+        slot = verifier._acquire()
+        assert slot.connection.whoami_s() == 'dn:{}'.format(MANAGER_DN)
+        assert self.session.whoami() == MANAGER_DN
+
+    def test_verify_many(self):
+        self.session.backend.latency = 0.05
+        verifier = BindVerifier(self.session, size=4, model=LDAPUser, rebind=False)
+        results = verifier.verify_many([('jdoe', 'password'), ('jdoe', 'invalid'), ('nobody', 'password'),
+                                        ('jdoe*', 'password')] * 2)
+        assert results == [True, False, False, False] * 2
+        assert verifier.misses == 5
+        assert verifier.hits == 3
+        assert verifier._opened == 0
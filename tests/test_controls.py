@@ -1,6 +1,12 @@
+import string
+
 import pyldap_orm
 import pyldap_orm.models
 import pyldap_orm.controls
+from hypothesis import given, strategies as st
+from pyasn1.codec.der import encoder as der
+from pyasn1.type import namedtype, tag, univ
+from pyldap_orm import ber
 
 
 class LDAPUser(pyldap_orm.models.LDAPModelUser):
@@ -28,3 +34,150 @@ class TestModels:
 
     def test_search_sorted(self):
         LDAPUsers(self.session).all(serverctrls=[pyldap_orm.controls.ServerSideSort(['uid'])])
+
+
+def implicit(number, asn1_type):
+    return asn1_type.subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, number))
+
+
+class SortKey(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('attributeType', univ.OctetString()),
+        namedtype.OptionalNamedType('orderingRule', implicit(0, univ.OctetString())),
+        namedtype.DefaultedNamedType('reverseOrder', implicit(1, univ.Boolean(False))),
+    )
+
+
+class SortKeyList(univ.SequenceOf):
+    componentType = SortKey()
+
+
+class PasswdModifyRequestValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.OptionalNamedType('userIdentity', implicit(0, univ.OctetString())),
+        namedtype.OptionalNamedType('oldPasswd', implicit(1, univ.OctetString())),
+        namedtype.OptionalNamedType('newPasswd', implicit(2, univ.OctetString())),
+    )
+
+
+class PasswdModifyResponseValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.OptionalNamedType('genPasswd', implicit(0, univ.OctetString())),
+    )
+
+
+class PagedResultsValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('size', univ.Integer()),
+        namedtype.NamedType('cookie', univ.OctetString()),
+    )
+
+
+class ByOffset(univ.Sequence):
+    tagSet = univ.Sequence.tagSet.tagImplicitly(tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 0))
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('offset', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()),
+    )
+
+
+class Target(univ.Choice):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('byOffset', ByOffset()),
+        namedtype.NamedType('greaterThanOrEqual', implicit(1, univ.OctetString())),
+    )
+
+
+class VirtualListViewRequest(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('beforeCount', univ.Integer()),
+        namedtype.NamedType('afterCount', univ.Integer()),
+        namedtype.NamedType('target', Target()),
+        namedtype.OptionalNamedType('contextID', univ.OctetString()),
+    )
+
+
+class VirtualListViewResponse(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('targetPosition', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()),
+        namedtype.NamedType('virtualListViewResult', univ.Enumerated()),
+        namedtype.OptionalNamedType('contextID', univ.OctetString()),
+    )
+
+
+names = st.text(alphabet=string.ascii_letters + string.digits + '-;', min_size=1, max_size=300)
+octets = st.binary(max_size=300)
+counts = st.integers(min_value=0, max_value=2 ** 31 - 1)
+
+
+class TestBER:
+    @given(st.lists(st.tuples(names, st.none() | names, st.booleans()), max_size=5))
+    def test_sort_key_list(self, keys):
+        expected = SortKeyList()
+        for position, (attribute_type, ordering_rule, reverse_order) in enumerate(keys):
+            sort_key = SortKey()
+            sort_key.setComponentByName('attributeType', attribute_type)
+            if ordering_rule is not None:
+                sort_key.setComponentByName('orderingRule', ordering_rule)
+            sort_key.setComponentByName('reverseOrder', reverse_order)
+            expected.setComponentByPosition(position, sort_key)
+        assert ber.encode_sort_key_list(tuple(keys)) == der.encode(expected)
+
+    def test_server_side_sort(self):
+        control = pyldap_orm.controls.ServerSideSort(['uid', '-cn:caseIgnoreOrderingMatch'])
+        assert control.encodeControlValue() == ber.encode_sort_key_list(
+            (('uid', None, False), ('cn', 'caseIgnoreOrderingMatch', True)))
+
+    @given(st.none() | octets, st.none() | octets, st.none() | octets)
+    def test_passwd_modify_request(self, identity, current, new):
+        expected = PasswdModifyRequestValue()
+        for name, value in (('userIdentity', identity), ('oldPasswd', current), ('newPasswd', new)):
+            if value is not None:
+                expected.setComponentByName(name, value)
+        assert ber.encode_passwd_modify_request(identity, current, new) == der.encode(expected)
+
+    @given(st.none() | octets)
+    def test_passwd_modify_response(self, generated):
+        value = PasswdModifyResponseValue()
+        if generated is not None:
+            value.setComponentByName('genPasswd', generated)
+        assert ber.decode_passwd_modify_response(der.encode(value)) == generated
+
+    @given(counts, octets)
+    def test_paged_results(self, size, cookie):
+        value = PagedResultsValue()
+        value.setComponentByName('size', size)
+        value.setComponentByName('cookie', cookie)
+        assert ber.encode_paged_results(size, cookie) == der.encode(value)
+        assert ber.decode_paged_results(der.encode(value)) == (size, cookie)
+
+    @given(counts, counts, st.integers(min_value=1, max_value=2 ** 31 - 1), counts, st.none() | octets,
+           st.none() | octets)
+    def test_vlv_request(self, before_count, after_count, offset, content_count, assertion_value, context_id):
+        target = Target()
+        if assertion_value is None:
+            by_offset = ByOffset()
+            by_offset.setComponentByName('offset', offset)
+            by_offset.setComponentByName('contentCount', content_count)
+            target.setComponentByName('byOffset', by_offset)
+        else:
+            target.setComponentByName('greaterThanOrEqual', assertion_value)
+        expected = VirtualListViewRequest()
+        expected.setComponentByName('beforeCount', before_count)
+        expected.setComponentByName('afterCount', after_count)
+        expected.setComponentByName('target', target)
+        if context_id is not None:
+            expected.setComponentByName('contextID', context_id)
+        assert ber.encode_vlv_request(before_count, after_count, offset, content_count, assertion_value,
+                                      context_id) == der.encode(expected)
+
+    @given(counts, counts, st.integers(min_value=0, max_value=80), st.none() | octets)
+    def test_vlv_response(self, position, count, result, context_id):
+        value = VirtualListViewResponse()
+        value.setComponentByName('targetPosition', position)
+        value.setComponentByName('contentCount', count)
+        value.setComponentByName('virtualListViewResult', result)
+        if context_id is not None:
+            value.setComponentByName('contextID', context_id)
+        assert ber.decode_vlv_response(der.encode(value)) == (position, count, result, context_id)
@@ -80,3 +80,13 @@ class TestSession:
         with pytest.raises(pyldap_orm.LDAPModelQueryException):
             SingleObject(self.session).by_attr('uid', '*')
 
+    def test_object_list_workers(self):
+        class SingleObject(pyldap_orm.LDAPObject):
+            base = 'dc=example,dc=com'
+
+        class AllObjects(pyldap_orm.LDAPModelList):
+            children = SingleObject
+
+        entries = AllObjects(self.session, workers=2, chunk_size=3).all()
+        assert len(entries) == 11
+        assert [entry.dn for entry in entries] == [entry.dn for entry in AllObjects(self.session).all()]
@@ -0,0 +1,71 @@
+import time
+
+import ldap
+import pytest
+
+from conftest import MANAGER_DN, LDAPUser, LDAPUsers
+from pyldap_orm.auth import BindVerifier
+from pyldap_orm.deadline import deadline, remaining
+
+
+class TestDeadline:
+    @pytest.fixture(autouse=True)
+    def setup(self, directory, session):
+        self.directory = directory
+        self.session = session
+
+    def test_remaining(self):
+        assert remaining() is None
+        with deadline(10):
+            assert 9 < remaining() <= 10
+            with deadline(60):
+                assert remaining() <= 10
+            assert remaining(1) <= 1
+        with deadline(0):
+            with pytest.raises(ldap.TIMEOUT):
+                remaining()
+
+    def test_search(self):
+        self.session.authenticate(MANAGER_DN, 'password', timeout=1.0)
+        self.directory.latency = 0.5
+        start = time.monotonic()
+        with pytest.raises(ldap.TIMEOUT):
+            self.session.search('ou=People,dc=example,dc=com', timeout=0.05)
+        assert time.monotonic() - start < 0.5
+        assert self.directory.abandoned == 1
+        with deadline(0.05), pytest.raises(ldap.TIMEOUT):
+            list(self.session.paged_search('ou=People,dc=example,dc=com', page_size=1))
+        assert self.directory.abandoned == 2
+
+    def test_sizelimit(self):
+        with pytest.raises(ldap.SIZELIMIT_EXCEEDED):
+            self.session.search('ou=People,dc=example,dc=com', sizelimit=1)
+
+    def test_save(self):
+        user = LDAPUser(self.session).by_attr('uid', 'jdoe')
+        user.mail = ['jdoe@example.com']
+        self.directory.latency = 0.5
+        with deadline(0.05), pytest.raises(ldap.TIMEOUT):
+            user.save()
+        assert self.directory.abandoned == 1
+        with pytest.raises(ldap.TIMEOUT):
+            user.delete(timeout=0.05)
+        assert self.directory.abandoned == 2
+
+    def test_change_passwords(self):
+        users = [LDAPUser(self.session).by_attr('uid', uid) for uid in ('jdoe', 'fmulder')]
+        self.directory.latency = 0.5
+        with deadline(0.05), pytest.raises(ldap.TIMEOUT):
+            LDAPUsers(self.session).change_passwords([(user, 'newpassword') for user in users])
+        assert self.directory.abandoned == 2
+
+    def test_verify(self):
+        verifier = BindVerifier(self.session, size=2)
+        dns = ['cn=John Doe,ou=Employees,ou=People,dc=example,dc=com',
+               'cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com']
+        self.directory.latency = 0.5
+        start = time.monotonic()
+        with deadline(0.05), pytest.raises(ldap.TIMEOUT):
+            verifier.verify_many([(dn, 'password') for dn in dns])
+        assert time.monotonic() - start < 0.5
+        assert self.directory.abandoned == 2
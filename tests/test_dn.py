@@ -0,0 +1,28 @@
+import pickle
+
+from pyldap_orm.dn import DN
+
+
+class TestDN:
+    def test_equality(self):
+        dn = DN('CN=John Doe, ou=People,dc=example,dc=com')
+        assert dn == 'cn=john doe,ou=people,dc=example,dc=com'
+        assert dn == DN('cn=John  Doe,ou=People,DC=example,DC=com')
+        assert dn != DN('cn=Jane Doe,ou=People,dc=example,dc=com')
+        assert str(dn) == 'CN=John Doe, ou=People,dc=example,dc=com'
+        assert {dn: 1}[DN('cn=john doe,ou=people,dc=example,dc=com')] == 1
+        assert DN('cn=a+uid=b,dc=com') == DN('uid=B+cn=A,dc=com')
+
+    def test_descendant(self):
+        dn = DN('cn=John Doe,ou=People,dc=example,dc=com')
+        assert dn.is_descendant_of('ou=people,dc=example,dc=com')
+        assert dn.is_descendant_of(dn)
+        assert not dn.is_descendant_of('ou=Groups,dc=example,dc=com')
+        assert not DN('cn=a\\,ou=People,dc=example,dc=com').is_descendant_of('ou=People,dc=example,dc=com')
+        assert dn.parent == 'ou=People,dc=example,dc=com'
+        assert DN('dc=com').parent is None
+
+    def test_build(self):
+        dn = DN.build('cn', 'Doe, John', 'ou=People,dc=example,dc=com')
+        assert dn.rdns[0] == 'cn=doe\\, john'
+        assert pickle.loads(pickle.dumps(dn)) == dn
@@ -0,0 +1,49 @@
+import ldap
+import pytest
+
+import pyldap_orm
+from conftest import MANAGER_DN, LDAPUser, LDAPUsers
+from pyldap_orm.events import LatencyHistogram, SlowQueryLog
+
+
+class TestEvents:
+    @pytest.fixture(autouse=True)
+    def setup(self, directory):
+        # Hooks are registered before authentication, to record the bind
+        self.session = pyldap_orm.LDAPSession(backend=directory)
+        self.events = []
+        self.session.add_hook(self.events.append)
+        self.session.authenticate(MANAGER_DN, 'password')
+
+    def test_operations(self):
+        assert [event.operation for event in self.events] == ['bind', 'schema']
+        assert self.events[0].target == MANAGER_DN
+        assert self.events[1].result_count == 1
+
+        del self.events[:]
+        users = LDAPUsers(self.session).all()
+        users[0].description = ['Test']
+        users[0].save()
+        users[0].change_password('secret')
+        assert [event.operation for event in self.events] == ['search', 'modify', 'extop']
+        search = self.events[0]
+        assert search.model is LDAPUser
+        assert search.result_count == len(users)
+        assert search.bytes_received > 0
+        assert search.filter == LDAPUser.filter()
+        assert all(event.duration >= 0 and event.error is None for event in self.events)
+
+    def test_error(self):
+        with pytest.raises(ldap.NO_SUCH_OBJECT) as e:
+            LDAPUser(self.session).by_dn('cn=Nobody,dc=example,dc=com')
+        assert self.events[-1].error is e.value
+
+    def test_collectors(self):
+        histogram = self.session.add_hook(LatencyHistogram())
+        slow = self.session.add_hook(SlowQueryLog(threshold=0, log=None))
+        LDAPUsers(self.session).all()
+        LDAPUsers(self.session).by_attr('uid', 'jdoe')
+        assert histogram.count(operation='search', model='LDAPUser') == 2
+        assert histogram.percentile(0.5, operation='search') is not None
+        assert histogram.percentile(0.5, operation='delete') is None
+        assert [event.operation for event in slow.entries] == ['search', 'search']
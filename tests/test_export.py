@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from conftest import LDAPUsers, memory_session
+from pyldap_orm.exceptions import LDAPORMException
+from pyldap_orm.export import Checkpoint, CheckpointedExport
+
+
+class TestExport:
+    @pytest.fixture(autouse=True)
+    def setup(self, directory):
+        self.directory = directory
+        # Lost connections are opened again quickly
+        self.session = memory_session(directory, retry_interval=0.01)
+        # Users in the order of their key
+        users = sorted(LDAPUsers(self.session).all(['uid', 'entryUUID']), key=lambda user: user.entryUUID[0])
+        self.uids = [user.uid[0] for user in users]
+        self.uuids = [user.entryUUID[0].decode('UTF-8') for user in users]
+        self.delivered = []
+
+    def deliver(self, users, checkpoint):
+        self.delivered.extend(user.uid[0] for user in users)
+
+    def test_resume(self, tmp_path):
+        path = str(tmp_path / 'users.json')
+
+        def crash(users, checkpoint):
+            if checkpoint.pages == 1:
+                raise RuntimeError("Interrupted")
+            self.deliver(users, checkpoint)
+
+        with pytest.raises(RuntimeError):
+            LDAPUsers(self.session).export(crash, path, key='entryUUID', page_size=1)
+        checkpoint = Checkpoint.load(path)
+        assert checkpoint.pages == 1
+        assert checkpoint.watermark == self.uuids[0]
+        checkpoint = LDAPUsers(self.session).export(self.deliver, path, key='entryUUID', page_size=1)
+        assert checkpoint.done
+        assert checkpoint.entries == len(self.uids)
+        assert self.delivered == self.uids
+        # A completed export is not run again
+        LDAPUsers(self.session).export(self.deliver, path, key='entryUUID')
+        assert self.delivered == self.uids
+
+    def test_key_ordering(self, tmp_path):
+        with pytest.raises(LDAPORMException):
+            CheckpointedExport(LDAPUsers(self.session), str(tmp_path / 'users.json'), key='uid')
+
+    def test_reconnect(self, tmp_path):
+        def disconnect(users, checkpoint):
+            self.deliver(users, checkpoint)
+            if checkpoint.pages == 0:
+                self.directory.stop()
+                threading.Timer(0.05, self.directory.start).start()
+
+        export = CheckpointedExport(LDAPUsers(self.session), str(tmp_path / 'users.json'), page_size=2,
+                                    retries=10, retry_interval=0.02)
+        checkpoint = export.run(disconnect)
+        assert checkpoint.pages == 2
+        assert sorted(self.delivered) == sorted(self.uids)
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+# Maximum time spent importing pyldap_orm modules themselves, python-ldap excluded
+BUDGET_US = 25000
+
+BY_DN_SCRIPT = """
+import pyldap_orm
+pyldap_orm.LDAPObject
+pyldap_orm.LDAPSession
+"""
+
+
+def import_times(script):
+    """
+    Run script with ``python -X importtime`` and return a dictionary where keys are imported modules
+    and values the self import time in microseconds.
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', script],
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, module = line[len('import time:'):].split('|')
+        times[module.strip()] = int(self_time)
+    return times
+
+
+class TestImport:
+    def test_lazy_package(self):
+        times = import_times('import pyldap_orm')
+        assert 'pyldap_orm' in times
+        assert 'ldap' not in times
+        assert 'pyldap_orm.core' not in times
+        assert 'pyldap_orm.session' not in times
+
+    def test_by_dn_startup(self):
+        times = import_times(BY_DN_SCRIPT)
+        for module in ('pyldap_orm.controls', 'pyldap_orm.ber', 'pyldap_orm.models',
+                       'ldap.modlist', 'concurrent.futures.process'):
+            assert module not in times
+        assert sum(value for module, value in times.items() if module.startswith('pyldap_orm')) < BUDGET_US
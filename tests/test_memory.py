@@ -0,0 +1,247 @@
+import threading
+
+import ldap
+import pytest
+
+import pyldap_orm
+import pyldap_orm.controls
+from conftest import MANAGER_DN, LDAPUser, LDAPUsers, LDAPGroup, LDAPGroups, memory_session
+from pyldap_orm.memory import FilterParser
+
+
+class TestMemory:
+    @pytest.fixture(autouse=True)
+    def setup(self, session):
+        self.session = session
+
+    def test_whoami(self):
+        assert self.session.whoami() == MANAGER_DN
+
+    def test_failure_authentication(self):
+        with pytest.raises(ldap.INVALID_CREDENTIALS):
+            self.session.authenticate(MANAGER_DN, 'invalid')
+
+    def test_entry(self):
+        user = pyldap_orm.LDAPObject(self.session).by_dn('cn=John Doe,ou=Employees,ou=People,dc=example,dc=com')
+        assert sorted(user.attributes()) == sorted(
+            ['uidNumber', 'homeDirectory', 'sn', 'gidNumber', 'cn', 'objectClass', 'uid', 'userPassword'])
+        user = pyldap_orm.LDAPObject(self.session).by_dn('cn=John Doe,ou=Employees,ou=People,dc=example,dc=com',
+                                                         ['*', '+'])
+        assert user.hasSubordinates == [False]
+        assert user.isMemberOf == ['cn=Developers,ou=Groups,dc=example,dc=com']
+
+    def test_filters(self):
+        entries = self.session.search('dc=example,dc=com',
+                                      ldap_filter='(&(objectClass=posixAccount)(!(uid=bbo))'
+                                                  '(|(cn=*doe)(uidNumber>=10001)))',
+                                      attributes=['uid'])
+        assert sorted(entry[1]['uid'] for entry in entries) == [[b'fmulder'], [b'jdoe']]
+        with pytest.raises(ldap.FILTER_ERROR):
+            FilterParser.parse('(uid=jdoe')
+
+    def test_membership(self):
+        assert len(LDAPUsers(self.session).by_name_membership('Developers', LDAPGroup)) == 1
+
+    def test_interned_values(self):
+        users = LDAPUsers(self.session).all()
+        assert users[0].objectClass[0] is users[1].objectClass[0]
+        assert users[0].uid[0] is not users[1].uid[0]
+        session = pyldap_orm.LDAPSession(backend=self.session.backend, intern_scope=pyldap_orm.LDAPSession.INTERN_NONE)
+        session.authenticate()
+        users = LDAPUsers(session).all()
+        assert users[0].objectClass[0] == users[1].objectClass[0]
+        assert users[0].objectClass[0] is not users[1].objectClass[0]
+
+    def test_generated_model(self):
+        User = self.session.model(LDAPUser)
+        assert User is self.session.model(LDAPUser)
+        assert issubclass(User, LDAPUser)
+        user = User(self.session).by_attr('uid', 'jdoe')
+        assert user.uid == ['jdoe']
+        assert user.dn == 'cn=John Doe,ou=Employees,ou=People,dc=example,dc=com'
+        with pytest.raises(pyldap_orm.exceptions.LDAPORMException):
+            user.displayName = ['John', 'Doe']
+        user.displayName = 'John Doe'
+        assert user.displayName == ['John Doe']
+        user.description = [b'Generated']
+        user.save()
+        assert LDAPUser(self.session).by_attr('uid', 'jdoe').description == ['Generated']
+
+    def test_sort_and_paging(self):
+        users = LDAPUsers(self.session).all(serverctrls=[pyldap_orm.controls.ServerSideSort(['-uid'])])
+        assert [user.uid[0] for user in users] == ['jdoe', 'fmulder', 'bbo']
+        server = self.session.server
+        msgid = server.search_ext('ou=People,dc=example,dc=com', ldap.SCOPE_SUBTREE, '(uid=*)',
+                                  serverctrls=[pyldap_orm.controls.PagedResults(size=2)])
+        _, entries, _, controls = server.result3(msgid, resp_ctrl_classes={
+            pyldap_orm.controls.PagedResults.controlType: pyldap_orm.controls.PagedResults})
+        assert len(entries) == 2
+        assert controls[0].cookie
+
+    def test_multiple_bases(self):
+        class SpreadUser(LDAPUser):
+            base = ['ou=Employees,ou=People,dc=example,dc=com', 'ou=Tests,dc=example,dc=com',
+                    'ou=People,dc=example,dc=com']
+
+        class SpreadUsers(LDAPUsers):
+            children = SpreadUser
+
+        user = SpreadUser(self.session)
+        user.uid = ['cat']
+        user.cn = ['Catherine']
+        user.sn = ['Test']
+        user.save()
+        assert user.dn == 'cn=Catherine,ou=Employees,ou=People,dc=example,dc=com'
+        self.session.backend.add_entry('cn=Dana Scully,ou=Tests,dc=example,dc=com', {
+            'objectClass': [b'top', b'person', b'organizationalPerson', b'inetOrgPerson'],
+            'cn': [b'Dana Scully'], 'sn': [b'Scully'], 'uid': [b'dscully']})
+
+        users = SpreadUsers(self.session).all(serverctrls=[pyldap_orm.controls.ServerSideSort(['uid'])])
+        assert [user.uid[0] for user in users] == ['bbo', 'cat', 'dscully', 'fmulder', 'jdoe']
+        users = SpreadUsers(self.session).all()
+        assert len(users) == 5
+        assert SpreadUser(self.session).by_attr('uid', 'dscully').sn == ['Scully']
+
+    def test_coalesced_searches(self):
+        events = []
+        self.session.add_hook(events.append)
+        self.session.backend.latency = 0.2
+        barrier = threading.Barrier(8)
+        users = []
+
+        def lookup():
+            barrier.wait()
+            users.append(LDAPUser(self.session).by_attr('uid', 'jdoe'))
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(events) == 1
+        assert self.session.coalesced == 7
+        assert [user.uid for user in users] == [['jdoe']] * 8
+        users[0].uid.append('john')
+        assert users[1].uid == ['jdoe']
+
+    def test_spilled_results(self):
+        events = []
+        self.session.add_hook(events.append)
+        users = LDAPUsers(self.session, spill=True)
+        users.page_size = 2
+        with users.all(serverctrls=[pyldap_orm.controls.ServerSideSort(['uid'])]) as results:
+            assert len(events) == 2
+            assert len(results) == 3
+            assert [user.uid[0] for user in results] == ['bbo', 'fmulder', 'jdoe']
+            assert results[-1].uid == ['jdoe']
+            assert [user.uid[0] for user in results[1:]] == ['fmulder', 'jdoe']
+            assert results.get('CN=John Doe,ou=Employees,ou=People,dc=example,dc=com').uid == ['jdoe']
+            assert 'cn=Nobody,ou=People,dc=example,dc=com' not in results
+
+    def test_aggregations(self):
+        users = LDAPUsers(self.session)
+        users.page_size = 2
+        assert users.count_by('gidNumber') == {10000: 3}
+        assert users.count_by('mail') == {None: 3}
+        assert users.distinct('homeDirectory') == {'/home/jdoe', '/home/fmulder', '/home/bbo'}
+        assert users.histogram('uid', key=lambda values: values[0][0]) == {'j': 1, 'f': 1, 'b': 1}
+        assert LDAPGroups(self.session).histogram('member') == {1: 1}
+
+    def test_create_update_delete(self):
+        new = LDAPUser(self.session)
+        new.uid = ['bobama']
+        new.cn = ['Barack Obama']
+        new.sn = ['Obama']
+        new.userPassword = [b'password']
+        new.save()
+        current = LDAPUser(self.session).by_attr('uid', 'bobama')
+        current.description = ['Test']
+        current.save()
+        assert LDAPUser(self.session).by_attr('uid', 'bobama').description == ['Test']
+        with pytest.raises(ldap.NOT_ALLOWED_ON_NONLEAF):
+            pyldap_orm.LDAPObject(self.session).by_dn('ou=People,dc=example,dc=com').delete()
+        current.delete()
+        with pytest.raises(ldap.NO_SUCH_OBJECT):
+            pyldap_orm.LDAPObject(self.session).by_dn(current.dn)
+
+    def test_delete_subtree(self):
+        events = []
+        self.session.add_hook(events.append)
+        employees = pyldap_orm.LDAPObject(self.session).by_dn('ou=Employees,ou=People,dc=example,dc=com')
+        employees.delete_subtree(tree_delete=False, window=2)
+        assert [event.target for event in events if event.operation == 'delete'][-1] == employees.dn
+        assert len(LDAPUsers(self.session).all()) == 0
+        del events[:]
+        pyldap_orm.LDAPObject(self.session).by_dn('ou=People,dc=example,dc=com').delete_subtree()
+        deletes = [event for event in events if event.operation == 'delete']
+        assert deletes[0].controls[0].controlType == pyldap_orm.controls.TreeDelete.controlType
+        with pytest.raises(ldap.NO_SUCH_OBJECT):
+            self.session.search('ou=People,dc=example,dc=com')
+
+    def test_group_members(self):
+        events = []
+        self.session.add_hook(events.append)
+        fmulder = LDAPUser(self.session).by_attr('uid', 'fmulder')
+        group = LDAPGroup(self.session).by_attr('cn', 'Developers')
+        group.add_members([fmulder, 'cn=John Doe,ou=Employees,ou=People,dc=example,dc=com'])
+        modify = events[-1]
+        assert modify.operation == 'modify'
+        assert modify.controls[0].controlType == pyldap_orm.controls.PermissiveModify.controlType
+        assert fmulder.dn in group.member
+        group.remove_members(['CN=John Doe,ou=Employees,ou=People,dc=example,dc=com'])
+        assert group.member == [fmulder.dn]
+        group.save()
+        assert list(group.iter_members()) == [fmulder.dn]
+
+    def test_ranged_values(self):
+        self.session.backend.max_values = 1
+        group = LDAPGroup(self.session).by_attr('cn', 'Developers')
+        group.add_members(['cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com'])
+        dn, attributes = self.session.search(group.dn, ldap.SCOPE_BASE, attributes=['member'])[0]
+        assert list(attributes) == ['member;range=0-0']
+        assert len(LDAPGroup(self.session).by_dn(group.dn).member) == 2
+        assert len(list(group.iter_members())) == 2
+
+    def test_values_without_ranges(self):
+        # Like OpenLDAP and OpenDJ, range= is an option no value has
+        self.session.backend.ranges = False
+        self.session.backend.max_values = 1
+        group = LDAPGroup(self.session).by_attr('cn', 'Developers')
+        group.add_members(['cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com'])
+        assert self.session.search(group.dn, ldap.SCOPE_BASE, attributes=['member;range=0-*'])[0][1] == {}
+        assert len(list(group.iter_members())) == 2
+
+    def test_compare(self):
+        jdoe = 'cn=John Doe,ou=Employees,ou=People,dc=example,dc=com'
+        fmulder = 'cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com'
+        self.session.compare_cache = pyldap_orm.session.CompareCache()
+        group = LDAPGroup(self.session).by_attr('cn', 'Developers')
+        events = []
+        self.session.add_hook(events.append)
+        assert group.is_member(jdoe)
+        assert not group.is_member(fmulder)
+        assert group.are_members([fmulder, jdoe, 'CN=John Doe, ou=Employees,ou=People,dc=example,dc=com']) == \
+            [False, True, True]
+        assert [event.operation for event in events] == ['compare'] * 3
+        assert self.session.compare_cache.hits == 2
+        # Writes forget cached results of the entry
+        group.add_members([fmulder])
+        assert group.is_member(fmulder)
+        assert LDAPUser(self.session).by_attr('uid', 'jdoe').has_values('uid', ['JDOE', 'fmulder']) == [True, False]
+
+    def test_password_change(self):
+        user = LDAPUser(self.session).by_attr('uid', 'jdoe')
+        user.change_password(new='newpassword', current='password')
+        self.session.authenticate(user.dn, 'newpassword')
+        result, = LDAPUsers(self.session).change_passwords([(user, None)])
+        self.session.authenticate(user.dn, result.generated)
+        self.session.authenticate(MANAGER_DN, 'password')
+        other = memory_session(self.session.backend)
+        fmulder = 'cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com'
+        results = LDAPUsers(self.session).change_passwords([(user, 'first'), (fmulder, 'second'),
+                                                            ('cn=Nobody,ou=People,dc=example,dc=com', 'password')],
+                                                           sessions=[self.session, other])
+        assert [result.success for result in results] == [True, True, False]
+        assert results[1].user == fmulder
+        self.session.authenticate(user.dn, 'first')
+        self.session.authenticate(fmulder, 'second')
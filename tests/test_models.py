@@ -81,3 +81,21 @@ class TestModels:
         self.session.authenticate('cn=ldapmanager,ou=Services,ou=People,dc=example,dc=com',
                                   'password')
         current.delete()
+
+    def test_change_passwords(self):
+        new = LDAPUser(self.session)
+        new.uid = ['bobama']
+        new.cn = ['Barack Obama']
+        new.sn = ['Obama']
+        new.userPassword = [b'password']
+        new.save()
+        current = LDAPUser(self.session).by_attr('uid', 'bobama')
+        results = LDAPUsers(self.session).change_passwords([(current, 'newpassword'),
+                                                           ('cn=Nobody,ou=People,dc=example,dc=com', 'password')])
+        assert results[0].success
+        assert results[0].user is current
+        assert not results[1].success
+        self.session.authenticate(current.dn, 'newpassword')
+        self.session.authenticate('cn=ldapmanager,ou=Services,ou=People,dc=example,dc=com',
+                                  'password')
+        current.delete()
@@ -0,0 +1,46 @@
+import ldap
+import pytest
+
+from conftest import LDAPUser, LDAPUsers, LDAPGroup, LDAPGroups
+
+
+class TestReconcile:
+    @pytest.fixture(autouse=True)
+    def setup(self, session):
+        self.session = session
+        self.records = [
+            {'uid': 'JDoe', 'cn': 'John Doe', 'sn': 'Doe', 'mail': 'jdoe@example.com'},
+            {'uid': 'fmulder', 'cn': 'Fox Mulder', 'sn': 'Mulder', 'mail': []},
+            {'uid': 'kmoon', 'cn': 'Kay Moon', 'sn': 'Moon', 'mail': ['kmoon@example.com']},
+        ]
+
+    def test_plan(self):
+        events = []
+        self.session.add_hook(events.append)
+        plan = LDAPUsers(self.session).reconcile(self.records, key='uid', dry_run=True)
+        assert len(events) == 1
+        assert plan.unchanged == 1
+        assert plan.modifies == [('cn=John Doe,ou=Employees,ou=People,dc=example,dc=com',
+                                  [(ldap.MOD_REPLACE, 'mail', [b'jdoe@example.com'])])]
+        assert plan.deletes == ['cn=Bruno Bonfils,ou=Employees,ou=People,dc=example,dc=com']
+        assert [dn for dn, _ in plan.adds] == ['cn=Kay Moon,ou=People,dc=example,dc=com']
+        assert LDAPUser(self.session).by_attr('uid', 'jdoe')._attributes.get('mail') is None
+
+    def test_apply(self):
+        plan = LDAPUsers(self.session).reconcile(self.records, key='uid')
+        assert not plan.errors
+        assert LDAPUser(self.session).by_attr('uid', 'jdoe').mail == ['jdoe@example.com']
+        assert LDAPUser(self.session).by_attr('uid', 'kmoon').sn == ['Moon']
+        assert sorted(user.uid[0] for user in LDAPUsers(self.session).all()) == ['fmulder', 'jdoe', 'kmoon']
+        plan = LDAPUsers(self.session).reconcile(self.records, key='uid')
+        assert len(plan) == 0
+        assert plan.unchanged == 3
+
+    def test_members(self):
+        members = ['cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com',
+                   'CN=John Doe, ou=Employees,ou=People,dc=example,dc=com']
+        plan = LDAPGroups(self.session).reconcile([{'cn': 'Developers', 'member': members}], delete=False)
+        assert plan.modifies[0][1] == [(ldap.MOD_ADD, 'member', [members[0].encode('UTF-8')])]
+        assert sorted(LDAPGroup(self.session).by_attr('cn', 'Developers').member) == sorted([
+            'cn=Fox Mulder,ou=Employees,ou=People,dc=example,dc=com',
+            'cn=John Doe,ou=Employees,ou=People,dc=example,dc=com'])
@@ -0,0 +1,87 @@
+import time
+
+import ldap
+import pytest
+
+from conftest import JDOE_DN, MANAGER_DN, SAMPLE_LDIF, LDAPUser, memory_session
+from pyldap_orm.memory import MemoryDirectory
+
+
+class TestReplicas:
+    def setup_method(self):
+        self.primary = MemoryDirectory(ldif=SAMPLE_LDIF)
+        self.replicas = [MemoryDirectory(ldif=SAMPLE_LDIF), MemoryDirectory(ldif=SAMPLE_LDIF)]
+        self.session = memory_session(self.primary, replicas=self.replicas)
+
+    def test_hedged_read(self):
+        # Open connections to both replicas
+        LDAPUser(self.session).by_dn(JDOE_DN)
+        LDAPUser(self.session).by_dn(JDOE_DN)
+        # The first replica is the fastest known, then stalls
+        self.session.replicas[0].latency = 0
+        self.replicas[0].latency = 0.5
+        start = time.perf_counter()
+        user = LDAPUser(self.session).by_dn(JDOE_DN)
+        assert time.perf_counter() - start < 0.4
+        assert user.uid == ['jdoe']
+        assert self.session.reader.hedged == 1
+        assert self.session.replicas[0].latency > self.session.replicas[1].latency
+
+    def test_fast_read(self):
+        for _ in range(4):
+            LDAPUser(self.session).by_attr('uid', 'jdoe')
+        assert self.session.reader.requests == 4
+        assert self.session.reader.hedged == 0
+
+    def test_write_on_primary(self):
+        user = LDAPUser(self.session).by_dn(JDOE_DN)
+        user.description = ['Primary']
+        user.save()
+        assert self.primary.entry(JDOE_DN)[2]['description'] == [b'Primary']
+        assert all('description' not in replica.entry(JDOE_DN)[2] for replica in self.replicas)
+
+    def test_lowest_latency(self):
+        self.replicas[0].latency = 0.01
+        for _ in range(10):
+            LDAPUser(self.session).by_dn(JDOE_DN)
+        fast = self.session.replicas[1]
+        assert fast.latency < self.session.replicas[0].latency
+
+    def test_replica_down(self):
+        self.replicas[0].stop()
+        for _ in range(3):
+            assert LDAPUser(self.session).by_dn(JDOE_DN).uid == ['jdoe']
+        assert self.session.replicas[0].failures == 1
+        self.replicas[0].start()
+        self.session.replicas[0].ejected_until = 0
+        assert self.session.probe() == [self.session.replicas[0]]
+
+    def test_all_replicas_down(self):
+        for replica in self.replicas:
+            replica.stop()
+        # The error of the last replica is raised
+        with pytest.raises(ldap.SERVER_DOWN) as e:
+            LDAPUser(self.session).by_dn(JDOE_DN)
+        assert e.value.args[0]['desc'] == "Can't contact LDAP server"
+
+
+class TestFailover:
+    def setup_method(self):
+        self.primaries = [MemoryDirectory(ldif=SAMPLE_LDIF), MemoryDirectory(ldif=SAMPLE_LDIF)]
+        self.session = memory_session(self.primaries, retry_interval=60)
+
+    def test_rebind(self):
+        self.primaries[0].stop()
+        self.primaries[0].start()
+        # The connection is lost, a new one is opened and bound with the same identity
+        assert self.session.whoami() == MANAGER_DN
+        assert self.session.primaries[0].failures == 0
+
+    def test_failover(self):
+        self.primaries[0].stop()
+        user = LDAPUser(self.session).by_dn(JDOE_DN)
+        user.description = ['Failover']
+        user.save()
+        assert self.primaries[1].entry(JDOE_DN)[2]['description'] == [b'Failover']
+        assert not self.session.primaries[0].available
+        assert self.session.whoami() == MANAGER_DN
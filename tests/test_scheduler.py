@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from conftest import LDAPUsers, memory_session
+from pyldap_orm.exceptions import LDAPOverloadedException
+from pyldap_orm.scheduler import Scheduler, INTERACTIVE, NORMAL, BATCH
+
+
+class TestScheduler:
+    def setup_method(self):
+        self.scheduler = Scheduler(concurrency=1, queue_depth=1)
+
+    def wait_for(self, name, count):
+        while self.scheduler.stats()[name][1] != count:
+            time.sleep(0.001)
+
+    def test_rejection(self):
+        slot = self.scheduler.acquire(NORMAL)
+        thread = threading.Thread(target=lambda: self.scheduler.release(self.scheduler.acquire(NORMAL)))
+        thread.start()
+        self.wait_for(NORMAL, 1)
+        with pytest.raises(LDAPOverloadedException):
+            self.scheduler.acquire(NORMAL)
+        self.scheduler.release(slot)
+        thread.join()
+        assert self.scheduler.stats()[NORMAL] == (0, 0, 2, 1)
+
+    def test_order(self):
+        admitted = []
+
+        def run(name):
+            with self.scheduler.priority(name), self.scheduler.slot():
+                admitted.append(name)
+
+        slot = self.scheduler.acquire(INTERACTIVE)
+        threads = [threading.Thread(target=run, args=(name,)) for name in (BATCH, NORMAL, INTERACTIVE)]
+        for thread, name in zip(threads, (BATCH, NORMAL, INTERACTIVE)):
+            thread.start()
+            self.wait_for(name, 1)
+        self.scheduler.release(slot)
+        for thread in threads:
+            thread.join()
+        assert admitted == [INTERACTIVE, NORMAL, BATCH]
+
+    def test_idle_only(self):
+        scheduler = Scheduler(concurrency=8)
+        with scheduler.slot(INTERACTIVE):
+            with pytest.raises(LDAPOverloadedException):
+                scheduler.acquire(BATCH, timeout=0.01)
+        scheduler.release(scheduler.acquire(BATCH, timeout=0.01))
+
+    def test_session(self):
+        scheduler = Scheduler(concurrency=2)
+        session = memory_session(scheduler=scheduler)
+        with scheduler.priority(BATCH):
+            assert len(LDAPUsers(session).all()) == 3
+        # The search of all(), and the bind and schema load of the session
+        assert scheduler.stats()[BATCH] == (0, 0, 1, 0)
+        assert scheduler.stats()[NORMAL] == (0, 0, 2, 0)